@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the vectorized friedlein_multi against the previous per-time-point
+loop, as model evaluations and as Powell fits of synthetic transients.
+Fits use lmfit as in model_friedlein if it is installed, else scipy's Powell
+
+Also times getVt, which model_friedlein calls twice per fit, with the
+closed-form roots against fsolve at every time point
+
+Usage:
+
+    >> python benchmarks/bench_friedlein.py [npts] [repeats]
+
+"""
+
+import numpy as np
+import os
+import sys
+import time
+from scipy.optimize import minimize
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from oect_processing import model_fitting as mf
+
+# mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr
+TRUE = [1e-5, 1e-2, 1e-2, 20e-4, 0.85, 1000, 0.25, 0.6, 0]
+GUESS = [2e-5, 2e-2, 5e-3, 20e-4, 0.85, 1500, 0.3, 0.6, 0]
+VARY = [0, 1, 2, 5, 6, 8]  # as in fmParams, L, Vg and Vd are fixed
+
+
+def friedlein_multi_loop(t, mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr):
+    '''
+    The previous friedlein_multi implementation
+    '''
+    C = Cd + Cs
+    K = mu * C / L ** 2
+    tau = Rs * C
+
+    Ids = np.zeros(len(t))
+    Vt0 = Vt
+
+    for tm, x in zip(t, range(len(Ids))):
+
+        Vch = Vg * (1 - np.exp(-tm / tau))
+        K = (C / L ** 2) * mu
+
+        if Vch > Vt0 and Vd >= Vch:
+            Ids[x] = 0.5 * K * (Vch - Vt0) ** 2 + Ierr
+        elif Vch > Vt0 and Vd < Vch:
+            Ids[x] = K * (Vch - Vt0 - Vd / 2) * Vd + Ierr
+        else:
+            Ids[x] = 0.5 * K * (Vch - Vt0) ** 2 + Ierr
+
+    return Ids
+
+
+def synthetic(npts, seed=0):
+    '''
+    Transient crossing from subthreshold through saturation into linear, with 1% noise
+    '''
+    t = np.linspace(0, 200, npts)
+    Ids = mf.friedlein_multi(t, *TRUE)
+    rng = np.random.default_rng(seed)
+
+    return t, Ids + 0.01 * np.max(Ids) * rng.standard_normal(npts)
+
+
+def fit(func, t, Ids):
+
+    if mf.lmfit is not None:
+        fmodel = mf.lmfit.Model(func, independent_vars=['t'])
+        params = mf.fmParams(fmodel)
+        for k, v in zip(fmodel.param_names, GUESS):
+            params[k].set(value=v)
+        result = fmodel.fit(params=params, t=t, data=Ids, method='powell')
+
+        return result.nfev
+
+    p = np.array(GUESS, dtype=np.float64)
+    scale = np.where(p[VARY] != 0, np.abs(p[VARY]), np.max(Ids))
+    norm = np.sum(Ids ** 2)
+
+    def cost(x):
+        p[VARY] = x * scale
+        return np.sum((func(t, *p) - Ids) ** 2) / norm
+
+    result = minimize(cost, p[VARY] / scale, method='Powell')
+
+    return result.nfev
+
+
+def run(npts=2000, repeats=3):
+
+    t, Ids = synthetic(npts)
+
+    # same currents as the previous loop, to the last bit of the vectorized exp
+    assert np.allclose(mf.friedlein_multi(t, *GUESS), friedlein_multi_loop(t, *GUESS), rtol=1e-12, atol=0)
+    _, regime = mf.friedlein_multi(t, *TRUE, return_regime=True)
+    print('regimes (sat, lin, sub):', np.bincount(regime, minlength=3))
+
+    timings = {}
+    for name, func in [('loop', friedlein_multi_loop), ('vectorized', mf.friedlein_multi)]:
+
+        tic = time.perf_counter()
+        for _ in range(repeats * 10):
+            func(t, *GUESS)
+        evals = (time.perf_counter() - tic) / (repeats * 10)
+
+        tic = time.perf_counter()
+        for _ in range(repeats):
+            nfev = fit(func, t, Ids)
+        timings[name] = (evals, (time.perf_counter() - tic) / repeats, nfev)
+
+    print('{} points, {} fits with {}'.format(npts, repeats, 'lmfit' if mf.lmfit else 'scipy'))
+    for name, (evals, fits, nfev) in timings.items():
+        print('{:>11}: {:.3f} ms per call, {:.3f} s per fit ({} evaluations)'.format(name, evals * 1e3,
+                                                                                     fits, nfev))
+    print('speedup: {:.1f}x'.format(timings['loop'][1] / timings['vectorized'][1]))
+
+    return timings
+
+
+def run_getVt(npts=2000, repeats=3):
+
+    t, _ = synthetic(npts)
+    mu, Cd, Cs, L, Vg, Rs, Vt, Vd, _ = GUESS
+    K = mu * (Cd + Cs) / L ** 2
+    Vch = Vg * (1 - np.exp(-t / (Rs * (Cd + Cs))))
+
+    timings = {}
+    roots = {}
+    for method in ['fsolve', 'analytic']:
+        tic = time.perf_counter()
+        for _ in range(repeats):
+            roots[method] = mf.getVt(Vt, K, Vch, Vd, method=method)[1]
+        timings[method] = (time.perf_counter() - tic) / repeats
+
+    print('getVt, {} points, max root difference {:.2e} V'.format(npts, np.max(np.abs(roots['fsolve'] -
+                                                                                     roots['analytic']))))
+    for name, tm in timings.items():
+        print('{:>11}: {:.3f} ms per call'.format(name, tm * 1e3))
+    print('speedup: {:.1f}x'.format(timings['fsolve'] / timings['analytic']))
+
+    return timings
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:]])
+    run_getVt(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Time and peak memory of the pipeline hot paths on synthetic data (see synthetic.py)
+
+    OECT load, calc_gms, thresh     per pixel folder, summed over the device
+    uC_scale                        whole device, serial
+    fit_cycles, fit_cycles_batch    transient cycling log
+    model_friedlein                 two Powell fits of a transient (needs lmfit)
+    time_dep_spectra                spectra files of every potential
+    banded_fits                     400 nm band, batch and curve_fit
+
+Times are the best of `repeats` runs. Peak memory is measured with tracemalloc
+in a separate run, since tracing slows the code down.
+
+Usage:
+
+    >> python benchmarks/bench_pipeline.py [small|medium|large] [repeats] [--out results.csv]
+    >> python benchmarks/bench_pipeline.py medium --compare results.csv
+
+--compare flags benchmarks more than 20% (and 10 ms) slower than a previous --out
+file, and exits with an error if there are any.
+"""
+
+import argparse
+import contextlib
+import io
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+import oect_processing as oectp
+import synthetic
+from oect_processing import model_fitting as mf
+from oect_processing import transient
+from oect_processing.oect_utils import oect_load
+from oect_processing.specechem import read_files, uvvis
+
+SCALES = {'small': {'pixels': 5, 'points': 73, 'cycles': 5, 'cycle_points': 115,
+                    'potentials': 3, 'wavelengths': 201, 'times': 40},
+          'medium': {'pixels': 16, 'points': 145, 'cycles': 20, 'cycle_points': 300,
+                     'potentials': 11, 'wavelengths': 401, 'times': 60},
+          'large': {'pixels': 64, 'points': 289, 'cycles': 100, 'cycle_points': 1000,
+                    'potentials': 21, 'wavelengths': 1001, 'times': 200}}
+
+SLOWER = 1.2  # --compare threshold, as a ratio
+MIN_DIFF = 0.01  # and in s, as tiny timings are noisy
+
+
+def measure(func, repeats=3):
+    '''
+    Returns (best time in s, peak traced memory in MB) of func()
+    '''
+    times = []
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tic)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak / 1e6
+
+
+def _pixels(paths):
+
+    pixels = [oectp.OECT(p) for p in paths]
+    for dv in pixels:
+        dv.calc_gms()
+
+    return pixels
+
+
+def _friedlein_device(npts):
+    '''
+    Transient in the format model_friedlein expects, {V_G : DataFrame of 'Ids (A)'}
+    '''
+    t = np.linspace(0, 200, npts)
+    Ids = mf.friedlein_multi(t, 1e-5, 1e-2, 1e-2, 20e-4, 0.85, 1000, 0.25, 0.6, 0)
+    Ids = Ids + 0.01 * np.max(Ids) * np.random.default_rng(0).standard_normal(npts)
+
+    return {-0.8: pd.DataFrame({'Ids (A)': Ids}, index=t)}
+
+
+def run(scale='small', repeats=3, folder=None):
+    '''
+    Writes the synthetic data for a scale (name in SCALES or a dict like them),
+    runs every benchmark and returns a DataFrame of time (s) and peak memory (MB)
+    '''
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    tmp = folder if folder else tempfile.mkdtemp(prefix='oect_bench_')
+
+    warnings.simplefilter('ignore')
+    results = {}
+
+    try:
+        paths = synthetic.write_device(os.path.join(tmp, 'device'), sizes['pixels'], sizes['points'])
+        cycles = synthetic.write_transient(os.path.join(tmp, 'cycles.txt'), sizes['cycles'],
+                                           sizes['cycle_points'])
+        synthetic.write_uvvis(os.path.join(tmp, 'uvvis'), sizes['potentials'], sizes['wavelengths'],
+                              sizes['times'])
+
+        with contextlib.redirect_stdout(io.StringIO()):  # the pipeline prints a lot
+
+            results['OECT load'] = measure(lambda: [oectp.OECT(p) for p in paths], repeats)
+
+            loaded = [oectp.OECT(p) for p in paths]
+            results['calc_gms'] = measure(lambda: [dv.calc_gms() for dv in loaded], repeats)
+
+            pixels = _pixels(paths)
+            results['thresh'] = measure(lambda: [dv.thresh() for dv in pixels], repeats)
+
+            results['uC_scale'] = measure(lambda: oect_load.uC_scale(os.path.join(tmp, 'device'),
+                                                                     plot=[False, False], verbose=False,
+                                                                     params={}), repeats)
+
+            df = transient.read_time_dep(cycles)
+            results['fit_cycles'] = measure(lambda: transient.fit_cycles(df, 0, 0, plot=False), repeats)
+            results['fit_cycles_batch'] = measure(lambda: transient.fit_cycles_batch(df), repeats)
+
+            if mf.lmfit is not None:
+                from matplotlib import pyplot as plt
+                device = _friedlein_device(2000)
+                results['model_friedlein'] = measure(lambda: (mf.model_friedlein(device),
+                                                              plt.close('all')), 1)
+
+            steps, specs, potentials, _, _ = read_files.read_files(os.path.join(tmp, 'uvvis'))
+            data = uvvis.UVVis(steps, specs, potentials)
+            results['time_dep_spectra'] = measure(lambda: data.time_dep_spectra(specs, smooth=3), repeats)
+
+            data.single_wl_time(potentials[-1], 700)
+            for method in ['batch', 'curve_fit']:
+                results['banded_fits ' + method] = measure(
+                    lambda: data.banded_fits(500, 900, voltage=potentials[-1], method=method), repeats)
+
+    finally:
+        if not folder:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return pd.DataFrame(results, index=['time (s)', 'peak (MB)']).T
+
+
+def compare(results, baseline):
+    '''
+    Adds the ratio to a previous run's times and flags slowdowns past SLOWER and MIN_DIFF
+    '''
+    results = results.copy()
+    results['baseline (s)'] = baseline['time (s)'].reindex(results.index)
+    results['ratio'] = results['time (s)'] / results['baseline (s)']
+    results['slower'] = (results['ratio'] > SLOWER) & (results['time (s)'] - results['baseline (s)'] > MIN_DIFF)
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scale', nargs='?', default='small', choices=list(SCALES))
+    parser.add_argument('repeats', nargs='?', default=3, type=int)
+    parser.add_argument('--out', help='save the results to this csv')
+    parser.add_argument('--compare', help='compare against a csv saved with --out')
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeats)
+    print('{} scale: {}'.format(args.scale, SCALES[args.scale]))
+
+    if args.compare:
+        results = compare(results, pd.read_csv(args.compare, index_col=0))
+    print(results.to_string(float_format='{:.3f}'.format))
+
+    if args.out:
+        results[['time (s)', 'peak (MB)']].to_csv(args.out)
+
+    if args.compare and results['slower'].any():
+        sys.exit(1)
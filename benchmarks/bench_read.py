@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the transfer/output curve parser against the previous
+python-engine read_csv path, on the files in test_data
+
+Usage:
+
+    >> python benchmarks/bench_read.py [repeats]
+
+"""
+
+import glob
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from oect_processing.oect_utils.oect_read import read_curve
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+
+def read_python_engine(path, voltage):
+    '''
+    The previous OECT.transfer_curve/output_curve parsing path
+    '''
+    df = pd.read_csv(path, delimiter='\t', engine='python')
+    _junk = pd.to_numeric(df[voltage], errors='coerce')
+    _junk = _junk.notnull()
+    df = df.loc[_junk]
+    df = df.set_index(voltage)
+    df = df.set_index(pd.to_numeric(df.index.values))
+
+    return df
+
+
+def read_c_engine(path, voltage):
+
+    v, data, columns = read_curve(path, voltage)
+
+    return pd.DataFrame(data, index=v, columns=columns)
+
+
+def run(repeats=20):
+
+    files = sorted(glob.glob(os.path.join(TEST_DATA, '*', '*.txt')))
+    files = [(f, 'V_G' if 'transfer' in f else 'V_DS') for f in files]
+
+    # sanity check that both paths return the same data
+    for f, v in files:
+        a = read_python_engine(f, v)
+        b = read_c_engine(f, v)
+        assert np.allclose(a.index.values, b.index.values)
+        assert np.allclose(a.values, b.values, equal_nan=True)
+
+    timings = {}
+    for name, func in [('python engine', read_python_engine), ('read_curve', read_c_engine)]:
+        tic = time.perf_counter()
+        for _ in range(repeats):
+            for f, v in files:
+                func(f, v)
+        timings[name] = (time.perf_counter() - tic) / (repeats * len(files))
+
+    print('{} files, {} repeats'.format(len(files), repeats))
+    for name, t in timings.items():
+        print('{:>15}: {:.3f} ms per file'.format(name, t * 1e3))
+    print('speedup: {:.1f}x'.format(timings['python engine'] / timings['read_curve']))
+
+    return timings
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:]])
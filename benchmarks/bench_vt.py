@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and agreement of the threshold voltage engines ('spline' vs 'lstsq')
+on the files in test_data
+
+Usage:
+
+    >> python benchmarks/bench_vt.py [repeats]
+
+"""
+
+import contextlib
+import glob
+import io
+import numpy as np
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import oect_processing as oectp
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'test_data')
+
+
+def time_thresh(folder, vt_method, repeats):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        dv = oectp.OECT(folder, options={'vt_method': vt_method})
+        dv.calc_gms()
+
+    tic = time.perf_counter()
+    for _ in range(repeats):
+        dv.thresh()
+
+    return dv.Vts, (time.perf_counter() - tic) / repeats
+
+
+def run(repeats=5):
+
+    warnings.simplefilter('ignore')
+    folders = sorted(f for f in glob.glob(os.path.join(TEST_DATA, '*')) if os.path.isdir(f))
+
+    print('{:>8} {:>22} {:>22} {:>10} {:>10}'.format('pixel', 'Vt spline (V)', 'Vt lstsq (V)',
+                                                    'spline ms', 'lstsq ms'))
+    diffs = []
+    times = np.zeros(2)
+    for f in folders:
+        vt_spl, t_spl = time_thresh(f, 'spline', repeats)
+        vt_lsq, t_lsq = time_thresh(f, 'lstsq', repeats)
+        diffs.extend(np.abs(vt_spl - vt_lsq))
+        times += [t_spl, t_lsq]
+
+        print('{:>8} {:>22} {:>22} {:>10.2f} {:>10.2f}'.format(os.path.basename(f),
+                                                            str(np.round(vt_spl, 4)),
+                                                            str(np.round(vt_lsq, 4)),
+                                                            t_spl * 1e3, t_lsq * 1e3))
+
+    print('Vt difference: mean {:.1f} mV, max {:.1f} mV'.format(np.mean(diffs) * 1e3,
+                                                               np.max(diffs) * 1e3))
+    print('thresh speedup: {:.1f}x'.format(times[0] / times[1]))
+
+    return diffs, times
+
+
+if __name__ == '__main__':
+    run(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data in the formats the pipeline reads, at any scale
+
+    write_device     pixel folders (01, 02, ...) of transfer/output .txt files and a .cfg,
+                     as read by OECT and uC_scale
+    write_transient  a doping/dedoping cycles log, as read by transient.read_time_dep
+    write_uvvis      spectra(n).txt and steps(n).txt per potential, as read by
+                     specechem.read_files and UVVis (from tests/uvvis_data.py)
+
+Currents follow a square-law p-type OECT (on at negative V_G) with a smooth
+subthreshold turn-on, a slightly lower reverse sweep and 0.5% noise, so gm
+peaks, Vt and uC* come out close to the values used to generate them.
+
+Usage:
+
+    >> python benchmarks/synthetic.py path_to_folder [pixels] [points]
+
+"""
+
+import numpy as np
+import os
+import sys
+
+# shared with the tests, so the test and benchmark spectra cannot drift apart
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+from uvvis_data import write_uvvis
+
+HEADER = 'I_DS (A)\tI_DS Error (A)\tI_G (A)\tI_G Error (A)'
+
+# p-type square law, Id = -uC * W*d/L * Veff**2 / 2
+UC = 2e3  # K = UC * W(um) * d(m) / L(um)
+VT = -0.3
+VD = -0.6
+
+
+def _veff(vg, vt=VT, s=0.03):
+    '''
+    Overdrive -(Vg - Vt) for Vg < Vt, going smoothly to 0 below threshold
+    '''
+    return s * np.logaddexp(0, (vt - vg) / s)
+
+
+def _ids(vg, vd, K, vt=VT):
+    '''
+    Drain current in saturation (|Vd| > Veff) and linear regimes, negative for p-type
+    '''
+    veff = _veff(vg, vt)
+    vd = np.abs(vd)
+
+    return -K * np.where(vd < veff, (veff - vd / 2) * vd, veff ** 2 / 2)
+
+
+def _write_curve(fl, voltage, v, ids, rng, trailer):
+
+    ig = -1e-6 + 1e-6 * v
+    noise = 5e-3 * np.abs(ids) * rng.standard_normal(len(v))
+    data = np.column_stack([v, ids + noise, np.abs(noise) + 1e-9, ig, np.full(len(v), 1e-9)])
+
+    with open(fl, 'w') as f:
+        f.write(voltage + '\t' + HEADER + '\n')
+        np.savetxt(f, data, delimiter='\t', fmt='%.6E')
+        for k, val in trailer:
+            f.write('{} \t{}\t\n'.format(k, val))
+
+    return
+
+
+def write_pixel(folder, W=2000, L=20, d=50e-9, points=73, transfers=1, outputs=2, seed=0):
+    '''
+    Writes one pixel folder: a config file, transfer_n.txt and output_n.txt
+
+    W, L : float
+        Width and length in um
+    d : float
+        Thickness in m
+    points : int
+        Points per transfer curve (forward plus reverse sweep)
+    transfers, outputs : int
+        Number of transfer and output files
+    '''
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    name = os.path.basename(os.path.normpath(folder))
+    K = UC * W * d / L
+
+    vgs = np.round(np.linspace(-0.1, -0.8, outputs), 3)
+    with open(os.path.join(folder, 'uc{}_config.cfg'.format(name)), 'w') as f:
+        f.write('[Dimensions]\nWidth (um):\t{}\t\nLength (um):\t{}\t\nThickness (nm):\t{}\t\n\n'.format(
+            W, L, d * 1e9))
+        f.write('[Transfer]\nPreread (ms): 20000.000\nFirst Bias (ms): 60000.000\nVds (V):\t{:.3f}\n\n'.format(VD))
+        f.write('[Output]\nPreread (ms): 5000.000\nFirst Bias (ms): 200.000\nOutput Vgs: {}\n'.format(outputs))
+        for n, v in enumerate(vgs):
+            f.write('Vgs (V) {}:\t{:.3f}\n'.format(n, v))
+
+    dims = [('Number of Averages =', 5), ('Width/um =', W), ('Length/um =', L)]
+
+    fwd = np.linspace(-0.9, 0, points // 2 + 1)
+    vg = np.concatenate([fwd, fwd[-2::-1]])
+    for n in range(transfers):
+        ids = _ids(vg, VD, K) * np.where(np.arange(len(vg)) < len(fwd), 1, 0.95)
+        _write_curve(os.path.join(folder, 'uc{}_transfer_{}.txt'.format(name, n)), 'V_G', vg, ids, rng,
+                     [('V_DS =', '{:.3f}'.format(VD))] + dims)
+
+    fwd = np.linspace(0, -0.8, points // 4 + 1)
+    vd = np.concatenate([fwd, fwd[-2::-1]])
+    for n, v in enumerate(vgs):
+        _write_curve(os.path.join(folder, 'uc{}_output_{}.txt'.format(name, n)), 'V_DS', vd,
+                     _ids(v, vd, K), rng, [('V_G =', '{:.3f}'.format(v))] + dims)
+
+    return
+
+
+def write_device(path, pixels=5, points=73, transfers=1, outputs=2, seed=0):
+    '''
+    Writes pixel folders 01, 02, ... with widths from 4000 um down, as for uC_scale
+    '''
+    widths = np.round(np.geomspace(4000, 400, pixels))
+    for n, W in enumerate(widths):
+        write_pixel(os.path.join(path, '{:02d}'.format(n + 1)), W=W, points=points,
+                    transfers=transfers, outputs=outputs, seed=seed + n)
+
+    return [os.path.join(path, '{:02d}'.format(n + 1)) for n in range(pixels)]
+
+
+def write_transient(fl, cycles=10, points=115, dt=346.0, tau_dope=5.0, tau_dedope=2.0, seed=0):
+    '''
+    Writes a constant-voltage cycling log: V_G alternates between 0 and -0.8 V,
+    with the current relaxing exponentially in each phase
+
+    points : int
+        Points per doping phase. Dedoping phases are half as long
+    dt : float
+        Time step in ms
+    '''
+    rng = np.random.default_rng(seed)
+    i_off, i_on = -5e-9, -1e-4
+
+    vg, ids = [np.zeros(3)], [np.full(3, i_off)]
+    for _ in range(cycles):
+        t = np.arange(points) * dt / 1000
+        vg.append(np.full(points, -0.8))
+        ids.append(i_on + (i_off - i_on) * np.exp(-t / tau_dope))
+
+        t = np.arange(points // 2) * dt / 1000
+        vg.append(np.zeros(points // 2))
+        ids.append(i_off + (i_on - i_off) * np.exp(-t / tau_dedope))
+
+    vg = np.concatenate(vg)
+    ids = np.concatenate(ids)
+    ids += 1e-3 * np.abs(i_on) * rng.standard_normal(len(ids))
+    time = np.arange(len(vg)) * dt
+
+    with open(fl, 'w') as f:
+        f.write('Time (ms)\tV_G (V)\tI_DS (A)\tI_DS error(A)\tI_G (A)\tI_G error(A)\n')
+        for row in zip(time, vg, ids, -ids * 1e-2):
+            f.write('{:.10f}\t{:.10f}\t{:.10f}\tnan\t{:.10f}\tnan\n'.format(*row))
+        f.write('V_DS =\t{}\n'.format(VD))
+
+    return fl
+
+
+if __name__ == '__main__':
+    write_device(sys.argv[1], *[int(a) for a in sys.argv[2:]])
@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 import os
 import pandas as pd
@@ -6,6 +7,7 @@ import sys
 from matplotlib import pyplot as plt
 
 import oect_processing as oectp
+from oect_processing.oect_utils import oect_cache
 from oect_processing.oect_utils import oect_plot
 from oect_processing.oect_utils.oect_load import uC_scale
 
@@ -15,6 +17,8 @@ from oect_processing.oect_utils.oect_load import uC_scale
 
 TEST_DATA = r'oect_processing/notebooks/test_data_manufactured'
 
+CACHE_ENTRIES = 64  # pixels, devices and figures kept between reruns
+
 st.set_page_config(page_title='OECT Processing')
 st.title('OECT processing')
 st.header('Rajiv Giridharagopal, Ph.D.')
@@ -46,16 +50,73 @@ def file_selector(folder_path=TEST_DATA):
     return os.path.join(folder_path, selected_filename)
 
 
-def create_pixel_dict(selected_pixels, pixel_paths, thickness):
-    pixels = {}
-    for s in selected_pixels:
-        if thickness:
-            dv = oectp.OECT(pixel_paths[s], params={'d': thickness}, options={'Average': True})
-        else:
-            dv = oectp.OECT(pixel_paths[s], options={'Average': True})
-        pixels[s] = dv
+def cached(func):
+    '''
+    Keeps the results of func between reruns, keyed on its arguments.
+    The results are shared, not copied, so they must not be modified
+    '''
+    if hasattr(st, 'cache_resource'):
+        return st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner=False)(func)
+
+    return st.cache(allow_output_mutation=True, max_entries=CACHE_ENTRIES, show_spinner=False)(func)
+
+
+def signature(folder):
+    '''
+    Cache key of a pixel folder, changes when its .txt or .cfg files change
+    '''
+    return tuple(oect_cache.folder_signature(folder))
+
+
+@cached
+def load_pixel(folder, sig, average=False):
+    '''
+    Processed pixel (gm and Vt) at its .cfg thickness.
+    sig is only the cache key, see signature
+    '''
+    dv = oectp.OECT(folder, options={'Average': average})
+    dv.calc_gms()
+    dv.thresh()
+
+    return dv
+
+
+@cached
+def pixel_figures(folder, sig):
+    '''
+    Transfer/gm, output and Vt figures of a pixel. None of them depend on the thickness
+    '''
+    dv = copy.copy(load_pixel(folder, sig))  # thresh replaces attributes of the copy only
+    vt_plot, _ = dv.thresh(plot=True)
+
+    return (oect_plot.plot_transfers_gm(dv), oect_plot.plot_outputs(dv, sort=True, direction='bwd'), vt_plot)
+
 
-    return pixels
+@cached
+def load_device(pixels, thickness):
+    '''
+    uC* fit of the cached pixels, rescaled to the thickness override.
+    gm and Vt are not recalculated when only the thickness changes
+
+    pixels : tuple
+        (name, folder, signature) for each selected pixel
+    '''
+    # shallow copies, so that set_thickness does not change the cached pixels
+    pix = {name: copy.copy(load_pixel(folder, sig, average=True)) for name, folder, sig in pixels}
+    device = oectp.OECTDevice(pixels=pix, params={'L': 20e-6},
+                              options={'plot': [False, False], 'verbose': False})
+    if thickness:
+        device.set_thickness(thickness)
+
+    return device
+
+
+@cached
+def device_figure(pixels, thickness):
+
+    _, _, fig = oect_plot.plot_uC(load_device(pixels, thickness), savefig=False)
+
+    return fig
 
 
 device_folder = st.sidebar.text_input('Device folder (only works locally)')
@@ -92,9 +153,8 @@ if len(selected_pixels) < 2:
     st.sidebar.markdown('**Must select at least two pixels to generate uC* curve**')
 
 else:
-    pixels = create_pixel_dict(selected_pixels, pixel_paths, thickness)
-    device = oectp.OECTDevice(pixels=pixels, params={'thickness': thickness, 'L': 20e-6},
-                              options={'plot': [False, False], 'verbose': False})
+    pixels = tuple((s, pixel_paths[s], signature(pixel_paths[s])) for s in selected_pixels)
+    device = load_device(pixels, thickness)
 
     # Update sidebar display
     df = pd.DataFrame(index=selected_pixels)
@@ -106,12 +166,11 @@ else:
     st.sidebar.write(df)
     st.sidebar.write('$\mu C^*$ = ', '$' + str(np.round(device.uC_0) * 1e-2)[1:-1] + '$', ' $Fcm^{-1}V^{-1}s^{-1}$')
 
-dv = oectp.OECT(pixel_folder, params={'d': thickness})
+pixel_sig = signature(pixel_folder)
+dv = load_pixel(pixel_folder, pixel_sig)
 st.write('Width = `%s`' % dv.W)
 st.write('Length = `%s`' % dv.L)
 
-dv.calc_gms()
-vt_plot, _ = dv.thresh(plot=True)
 st.write('Transconductance, $g_m$ (S)')
 dv.gms
 st.write('Threshold Voltage $V_t$ (V)')
@@ -120,15 +179,11 @@ st.write('Peak $g_m$ (S)')
 dv.gm_peaks
 
 st.header('Plots')
-fig = oect_plot.plot_transfers_gm(dv)
-st.pyplot(fig)
-
-fig = oect_plot.plot_outputs(dv, sort=True, direction='bwd')
-st.pyplot(fig)
-
+transfer_plot, output_plot, vt_plot = pixel_figures(pixel_folder, pixel_sig)
+st.pyplot(transfer_plot)
+st.pyplot(output_plot)
 st.pyplot(vt_plot)
 
 # Run device analysis
-
-_, _, fig = oect_plot.plot_uC(device, savefig=False)
-st.pyplot(fig)
+if len(selected_pixels) >= 2:
+    st.pyplot(device_figure(pixels, thickness))
@@ -8,6 +8,7 @@ Created on Thu Aug 23 11:04:47 2018
 import numpy as np
 import os
 import pandas as pd
+import traceback
 from collections import Counter
 from scipy.optimize import curve_fit as cf
 
@@ -115,6 +116,44 @@ def uC_scale(paths, average_devices=False, dimDict={}, thickness=40e-9, plot=[Tr
             pixkeys.remove(f)
 
     # do uC* graphs, need gm vs W*d/L
+    if average_devices:
+        pixels = average_same_widths(pixels)
+
+    uC_dv = fit_pixels(pixels, retrace_only=retrace_only)
+    uC_dv['folder'] = os.path.dirname(paths[0])
+    uC_0 = uC_dv['uC_0']
+
+    if plot[0]:
+        fig = oect_plot.plot_uC(uC_dv, pg_graphs, dot_color=dot_color)
+
+        if verbose:
+            if text_browser:
+                text_browser.append('uC* = ' + str(uC_0 * 1e-2) + ' F/cm*V*s')
+            print('uC* = ', str(uC_0 * 1e-2), ' F/cm*V*s')
+
+    if verbose:
+        print('Vt = ', uC_dv['Vt'])
+        if text_browser:
+            text_browser.append('Vt = ' + str(uC_dv['Vt']))
+
+    return pixels, uC_dv
+
+
+def fit_pixels(pixels, retrace_only=False):
+    '''
+    uC* fit of processed pixels, without plotting. Used by uC_scale and by
+    the app's background worker once a parent folder is processed
+
+    pixels : dict of OECT
+        After calc_gms() and thresh()
+    retrace_only : bool, optional
+        Whether to only do the retrace in case trace isn't saturating
+
+    Returns
+    -------
+    uC_dv : dict
+        As uC_scale, without 'folder'
+    '''
     Wd_L = np.array([])
     W = np.array([])
     Vg_Vt = np.array([])  # threshold offset
@@ -124,9 +163,6 @@ def uC_scale(paths, average_devices=False, dimDict={}, thickness=40e-9, plot=[Tr
     # assumes Length and thickness are fixed
     uC_dv = {}
 
-    if average_devices:
-        pixels = average_same_widths(pixels)
-
     for pixel in pixels:
         if not pixels[pixel].gms.empty:
 
@@ -170,22 +206,8 @@ def uC_scale(paths, average_devices=False, dimDict={}, thickness=40e-9, plot=[Tr
     uC_dv['uC'] = uC
     uC_dv['uC_0'] = uC_0
     uC_dv['gms'] = gms
-    uC_dv['folder'] = os.path.dirname(paths[0])
-
-    if plot[0]:
-        fig = oect_plot.plot_uC(uC_dv, pg_graphs, dot_color=dot_color)
-
-        if verbose:
-            if text_browser:
-                text_browser.append('uC* = ' + str(uC_0 * 1e-2) + ' F/cm*V*s')
-            print('uC* = ', str(uC_0 * 1e-2), ' F/cm*V*s')
-
-    if verbose:
-        print('Vt = ', uC_dv['Vt'])
-        if text_browser:
-            text_browser.append('Vt = ' + str(uC_dv['Vt']))
 
-    return pixels, uC_dv
+    return uC_dv
 
 
 def loadOECT(path, dimDict, params=None, gm_plot=True, plot=True, options={}, verbose=True, text_browser=None):
@@ -228,6 +250,23 @@ def loadOECT(path, dimDict, params=None, gm_plot=True, plot=True, options={}, ve
     return device
 
 
+def load_pixel(path, dimDict, thickness=40e-9, options={'V_low': False}):
+    '''
+    loadOECT without plotting or printing, as uC_scale does for each pixel.
+    For running in a worker thread or process, so errors are returned rather than raised
+
+    Returns
+    -------
+    (OECT, None) or (None, traceback)
+    '''
+    try:
+        dv = loadOECT(path, dimDict, {'d': thickness}, plot=False, options=options, verbose=False)
+    except Exception:
+        return None, traceback.format_exc()
+
+    return dv, None
+
+
 def file_open(caption='Select folder'):
     '''
     File dialog if path not given in load commands
@@ -1,14 +1,17 @@
+import numpy as np
 import os
 import pyqtgraph as pg
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PyQt5 import QtGui
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt5.QtWidgets import *
 
-sys.path.insert(0, os.path.abspath('..'))
-sys.path.append(os.path.abspath('..'))
-import oect
-from oect.oect_utils.oect_load import uC_scale
-import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from oect_processing.app import oect_load_app
+from oect_processing.oect_utils import oect_plot
+from oect_processing.oect_utils.config import make_config, config_file
 
 pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
@@ -33,8 +36,128 @@ class getExistingDirectories(QFileDialog):
         self.exec()
 
 
+class AnalysisSignals(QObject):
+    '''
+    Signals of AnalysisWorker. They are emitted from the worker thread and
+    delivered to the slots of the main window in the GUI thread
+    '''
+    pixel = pyqtSignal(int, str, object)  # parent folder index, pixel folder, OECT
+    failed = pyqtSignal(int, str, str)  # parent folder index, folder, traceback
+    device = pyqtSignal(int, object)  # parent folder index, uC_dv as from uC_scale
+    progress = pyqtSignal(int, int)  # pixels done, pixels in total
+    finished = pyqtSignal(bool)  # True if cancelled
+
+
+class AnalysisWorker(QRunnable):
+    '''
+    Runs the analysis of MainWindow.analyze off the GUI thread.
+
+    The selected pixels of all parent folders are loaded in one process pool,
+    or in this thread if n_jobs is 1, and each pixel is reported as soon as it
+    finishes. The uC* fit of a parent folder is reported once all its pixels are done.
+
+    paths : list of lists
+        Selected subfolders of each parent folder
+    dimDict : dict
+        {parentfolder1: {subfolder1: [w1, l1], ...}, ...}
+    thickness : float
+    average_devices : bool
+        Whether to average devices of same WdL before the uC* fit
+    n_jobs : int
+        Number of worker processes. 1 = in this thread, None = one per CPU
+    '''
+
+    def __init__(self, paths, dimDict, thickness=100e-9, average_devices=False, n_jobs=None):
+        super(AnalysisWorker, self).__init__()
+        self.setAutoDelete(False)  # kept by the main window
+
+        self.paths = paths
+        self.dimDict = dimDict
+        self.thickness = thickness
+        self.average_devices = average_devices
+        self.n_jobs = n_jobs
+
+        self.signals = AnalysisSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+        Stops after the pixels that are already running
+        '''
+        self.cancelled = True
+
+    def run(self):
+
+        jobs = [(i, p) for i, group in enumerate(self.paths) for p in group
+                if os.path.isdir(p) and os.listdir(p)]
+        remaining = {i: 0 for i in range(len(self.paths))}
+        for i, _ in jobs:
+            remaining[i] += 1
+        pixels = {i: {} for i in range(len(self.paths))}
+
+        try:
+            self.signals.progress.emit(0, len(jobs))
+            for done, ((i, p), (dv, err)) in enumerate(self._process(jobs), 1):
+
+                if err:
+                    self.signals.failed.emit(i, p, err)
+                else:
+                    pixels[i][p] = dv
+                    self.signals.pixel.emit(i, p, dv)
+                self.signals.progress.emit(done, len(jobs))
+
+                remaining[i] -= 1
+                if remaining[i] == 0 and pixels[i]:
+                    self._fit(i, pixels[i])
+
+        finally:
+            self.signals.finished.emit(self.cancelled)
+
+    def _process(self, jobs):
+        '''
+        Yields ((parent index, folder), (OECT, error)) as each pixel finishes
+        '''
+        args = (self.dimDict, self.thickness)
+
+        if self.n_jobs == 1 or len(jobs) < 2:
+            for job in jobs:
+                if self.cancelled:
+                    return
+                yield job, oect_load_app.load_pixel(job[1], *args)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+            futures = {pool.submit(oect_load_app.load_pixel, job[1], *args): job for job in jobs}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+                if self.cancelled:
+                    for f in futures:
+                        f.cancel()
+                    return
+
+    def _fit(self, i, pixels):
+        '''
+        uC* fit of a parent folder, in the selected order, as uC_scale
+        '''
+        folder = os.path.dirname(self.paths[i][0])
+        pixels = {p + '_uC': pixels[p] for p in self.paths[i] if p in pixels}
+
+        try:
+            if self.average_devices:
+                pixels = oect_load_app.average_same_widths(pixels)
+            uC_dv = oect_load_app.fit_pixels(pixels)
+        except Exception:
+            self.signals.failed.emit(i, folder, traceback.format_exc())
+            return
+
+        uC_dv['folder'] = folder
+        self.signals.device.emit(i, uC_dv)
+
+
 class MainWindow(QMainWindow):
     MAX_PLOTS = 5
+    N_JOBS = None  # worker processes for the pixels, None = one per CPU, 1 = in the worker thread
 
     def __init__(self, *args, **kwargs):
         '''
@@ -68,7 +191,11 @@ class MainWindow(QMainWindow):
         self.menuLayout.setColumnStretch(1, 1)
 
         self.textBrowser = QTextBrowser()  # text browser displaying info
-        self.addPlaceHolder(self.menuLayout, [4, 0])
+        self.progressBar = QProgressBar()
+        self.cancelPushButton = QPushButton('Cancel')
+        self.cancelPushButton.setEnabled(False)
+        self.menuLayout.addWidget(self.progressBar, 4, 0)
+        self.menuLayout.addWidget(self.cancelPushButton, 4, 1)
         self.menuLayout.addWidget(self.textBrowser, 5, 0, 1, 2)
         self.menuLayout.setRowStretch(0, 1)
         self.menuLayout.setRowStretch(1, 10)
@@ -111,6 +238,11 @@ class MainWindow(QMainWindow):
         # setup ui signals
         self.loadPushbutton.clicked.connect(self.open_file)
         self.analyzePushButton.clicked.connect(self.analyze)
+        self.cancelPushButton.clicked.connect(self.cancel)
+
+        self.threadPool = QThreadPool.globalInstance()
+        self.worker = None
+        self.streamed = {}  # parent folder index : plot items of single pixels
 
     def open_file(self):
         '''
@@ -194,7 +326,9 @@ class MainWindow(QMainWindow):
 
     def analyze(self):
         '''
-        Plot uC graphs.
+        Plot uC graphs. The pixels are processed by an AnalysisWorker in the
+        background; each pixel is plotted as it finishes, then replaced by the
+        uC* plot of its parent folder
         '''
         self.linearPlot.clearPlots()
         self.logPlot.clearPlots()
@@ -226,20 +360,87 @@ class MainWindow(QMainWindow):
             dimensionDict[parentFolderName] = parentFolderEntry
             allPaths.append(subfolders)
 
-        # plot each parent folder
-        for i in range(self.MAX_PLOTS):
-            uC_scale(allPaths[i], average_devices=self.averageCheckBox.isChecked(), dimDict=dimensionDict,
-                     thickness=100e-9,
-                     pg_graphs=[self.linearPlot, self.logPlot], dot_color=pg.intColor(i, alpha=128),
-                     text_browser=self.textBrowser)
-            if i == len(allPaths) - 1: break
+        # process the parent folders in the background, plotting each pixel as it finishes
+        self.worker = AnalysisWorker(allPaths[:self.MAX_PLOTS], dimensionDict, thickness=100e-9,
+                                     average_devices=self.averageCheckBox.isChecked(), n_jobs=self.N_JOBS)
+        self.worker.signals.pixel.connect(self.pixelDone)
+        self.worker.signals.failed.connect(self.pixelFailed)
+        self.worker.signals.device.connect(self.deviceDone)
+        self.worker.signals.progress.connect(self.showProgress)
+        self.worker.signals.finished.connect(self.analysisDone)
+
+        self.streamed = {}
+        self.analyzePushButton.setEnabled(False)
+        self.cancelPushButton.setEnabled(True)
+        self.threadPool.start(self.worker)
+
+    def cancel(self):
+        '''
+        Cancels the running analysis. Pixels already running still finish
+        '''
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancelPushButton.setEnabled(False)
+            self.textBrowser.append('Cancelling...')
+
+    def showProgress(self, done, total):
+
+        self.progressBar.setRange(0, max(total, 1))
+        self.progressBar.setValue(done)
+
+    def pixelDone(self, i, path, dv):
+        '''
+        Plots the points of one pixel as soon as it is processed
+        '''
+        WdL_VgVt = np.abs(dv.WdL * np.atleast_1d(dv.VgVts)) * 1e2
+        gms = np.atleast_1d(dv.peak_gm) * 1000
+        WdL_VgVt[WdL_VgVt == 0] = 10e-10  # ensure log plot won't throw error
+        gms[gms == 0] = 10e-10
+
+        for plot in [self.linearPlot, self.logPlot]:
+            item = plot.plot(WdL_VgVt, gms, pen=None, symbolBrush=pg.intColor(i, alpha=128), symbol='o')
+            self.streamed.setdefault(i, []).append((plot, item))
+
+        self.textBrowser.append(path)
+        for key in dv.gms:
+            self.textBrowser.append(key + ': {:.2f}'.format(np.max(dv.gms[key].values * 1e-2) / dv.WdL)
+                                    + 'S/cm scaled')
+            self.textBrowser.append(key + ': {:.2f}'.format(np.max(dv.gms[key].values * 1000)) + 'mS max')
+
+    def pixelFailed(self, i, path, err):
+
+        self.textBrowser.append('Failed to process ' + path + ': ' + err.strip().split('\n')[-1])
+
+    def deviceDone(self, i, uC_dv):
+        '''
+        Replaces the pixels of a parent folder with its uC* plot
+        '''
+        for plot, item in self.streamed.pop(i, []):
+            plot.removeItem(item)
+
+        oect_plot.plot_uC(uC_dv, [self.linearPlot, self.logPlot], dot_color=pg.intColor(i, alpha=128))
+
+        self.textBrowser.append('uC* = ' + str(uC_dv['uC_0'] * 1e-2) + ' F/cm*V*s')
+        self.textBrowser.append('Vt = ' + str(uC_dv['Vt']))
+
+    def analysisDone(self, cancelled):
+
+        self.worker = None
+        self.analyzePushButton.setEnabled(True)
+        self.cancelPushButton.setEnabled(False)
 
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Information)
-        msg.setText("Analysis complete.")
+        msg.setText("Analysis cancelled." if cancelled else "Analysis complete.")
         msg.setWindowTitle("")
         msg.exec()
 
+    def closeEvent(self, event):
+
+        self.cancel()
+        self.threadPool.waitForDone()
+        event.accept()
+
     def addPlaceHolder(self, layout, coords=[]):
         '''
         Add a placeholder button.
@@ -267,9 +468,11 @@ class MainWindow(QMainWindow):
         groupBox.deleteLater()
 
 
-app = QApplication(sys.argv)
+if __name__ == '__main__':  # worker processes import this module
+
+    app = QApplication(sys.argv)
 
-window = MainWindow()
-window.show()
+    window = MainWindow()
+    window.show()
 
-app.exec_()
+    app.exec_()
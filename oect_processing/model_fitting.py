@@ -10,6 +10,16 @@ from matplotlib import pyplot as plt
 from scipy.optimize import curve_fit
 from scipy.optimize import fsolve
 
+try:
+    import lmfit
+except ImportError:  # only needed for the lmfit wrappers
+    lmfit = None
+
+# friedlein_multi regime labels
+REGIME_SAT = 0
+REGIME_LIN = 1
+REGIME_SUB = 2
+
 
 #### Model fitting ####
 def friedlein_decay(t, mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr):
@@ -52,7 +62,7 @@ def model_friedlein(device, index=-0.8, multi=True, params=None):
     Wrapper for generating a friedlein_multi fit
     '''
     if multi:
-        fmodel = lmfit.Model(friedlein_multi)
+        fmodel = lmfit.Model(friedlein_multi, independent_vars=['t'])
     else:
         fmodel = lmfit.Model(friedlein_decay)
 
@@ -88,7 +98,7 @@ def model_friedlein(device, index=-0.8, multi=True, params=None):
     return fmodel, result
 
 
-def friedlein_multi(t, mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr):
+def friedlein_multi(t, mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr, return_regime=False):
     '''
     Modified version of the Friedlein model taking into account that we move
     from saturation to linear regime during the gate voltage pulse
@@ -103,60 +113,44 @@ def friedlein_multi(t, mu, Cd, Cs, L, Vg, Rs, Vt, Vd, Ierr):
         L = channel length (should be constant, in cm)
         mu = mobility (1e-8 to 10 cm^2/V*s is reasonable)
         Ierr = current error (y-offset)
-    
+        return_regime = also return the regime at each time point (lmfit
+            treats this as an independent variable, not a parameter)
+
+    Returns:
+        Ids : ndarray
+        regime : ndarray of int8, only if return_regime
+            REGIME_SAT, REGIME_LIN or REGIME_SUB at each time point
     '''
     #    C = Cd + Cs
     C = Cd + Cs
-    K = mu * C / L ** 2
     tau = Rs * C
-
-    Vch = Vg * (1 - np.exp(-t / tau))
-    Ids = np.zeros(len(t))
-    regime = []
-
-    sat = 0
-    lin = 0
+    t = np.asarray(t, dtype=np.float64)
 
     # For a given device, need Vt such that regimes meet.
     #    Vt0, _ = getVt(Vt, K, Vch, Vd)
     #    print('Vt', Vt0)
     Vt0 = Vt
 
-    for tm, x in zip(t, range(len(Ids))):
-
-        Vch = Vg * (1 - np.exp(-tm / tau))
-        # scale mobility with empirical carrier-dependent factor
-        p = (1 - np.exp(-tm / tau)) * (0.05 / 0.025 - 1)  # from 0 to ~3, 0.1=disorder width, 0.025 = kT/q
-
-        #        K = (C/L**2) * (1 - np.exp(-tm/tau))* mu   # represents increase in density
-        K = (C / L ** 2) * mu
-        # saturation
-        if Vch > Vt0 and Vd >= Vch:
-
-            # print('a')
-            regime.append('sat')
-            sat += 1
-
-            Ids[x] = 0.5 * K * (Vch - Vt0) ** 2 + Ierr
+    Vch = Vg * (1 - np.exp(-t / tau))
 
-        # linear
-        elif Vch > Vt0 and Vd < Vch:
+    #        K = (C/L**2) * (1 - np.exp(-tm/tau))* mu   # represents increase in density
+    K = (C / L ** 2) * mu
 
-            # print('b')
-            regime.append('lin')
-            lin += 1
+    on = Vch > Vt0
+    lin = on & (Vd < Vch)
 
-            Ids[x] = K * (Vch - Vt0 - Vd / 2) * Vd + Ierr
+    # saturation and subthreshold share the square law
+    Ids = np.where(lin,
+                   K * (Vch - Vt0 - Vd / 2) * Vd + Ierr,
+                   0.5 * K * (Vch - Vt0) ** 2 + Ierr)
 
-            # subthreshold
-        else:
+    if return_regime:
+        regime = np.full(len(t), REGIME_SUB, dtype=np.int8)
+        regime[on & (Vd >= Vch)] = REGIME_SAT
+        regime[lin] = REGIME_LIN
 
-            regime.append('sub')
-            Ids[x] = 0
-            Ids[x] = 0.5 * K * (Vch - Vt0) ** 2 + Ierr
+        return Ids, regime
 
-    #    print('sat', sat,'; lin', lin)
-    #    print(regime)
     return Ids
 
 
@@ -164,7 +158,7 @@ def vtdiff(Vt, K, Vch, Vd):
     return (0.5 * K * (Vch - Vt) ** 2) - (K * (Vch - Vt - Vd / 2) * Vd)
 
 
-def getVt(Vt, K, Vch, Vd):
+def getVt(Vt, K, Vch, Vd, method='analytic'):
     '''
     Uses root solver to find minimum of difference between saturation line
      and linear regime line (when they intersect)
@@ -172,6 +166,10 @@ def getVt(Vt, K, Vch, Vd):
     The optimal threshold voltage defining the overlap is then extracted
     By default the plateau of Vch should be the right Vt, which is roots[-1]
     
+    vtdiff reduces to 0.5*K*(Vch - Vt - Vd)**2, so the (double) root is
+    Vt = Vch - Vd for every Vch at once. When K is 0 or not finite any Vt
+    is a root, and those points fall back to fsolve from the initial guess
+    
     Parameters:
         Vt : float
             Initial Vt guess
@@ -181,17 +179,29 @@ def getVt(Vt, K, Vch, Vd):
             A list of channel-gate voltages (after electrolyte)
         Vd : float
             drain voltage, should be fixed
+        method : str, optional
+            'analytic' = closed-form roots
+            'fsolve' = scipy.optimize.fsolve for each Vch
     
     Returns:
-        roots : list
+        roots : ndarray
             All the roots at each time step 
         roots[-1] : float
             The final Vt 
     '''
-    roots = []
-    for v in Vch:
-        root = fsolve(vtdiff, Vt, args=(K, v, Vd))
-        roots.append(root[0])
+    Vch = np.atleast_1d(np.asarray(Vch, dtype=np.float64))
+
+    if method == 'analytic':
+        roots = Vch - Vd
+        degenerate = ~np.isfinite(roots) | (K == 0) | (not np.isfinite(K))
+    elif method == 'fsolve':
+        roots = np.empty(len(Vch))
+        degenerate = np.ones(len(Vch), dtype=bool)
+    else:
+        raise ValueError('method must be analytic or fsolve')
+
+    for x in np.flatnonzero(degenerate):
+        roots[x] = fsolve(vtdiff, float(Vt), args=(K, Vch[x], Vd))[0]
 
     return roots[-1], roots
 
@@ -20,10 +20,16 @@ from scipy.optimize import curve_fit as cf
 
 try:
 	from .oect_utils.config import make_config, config_file
-	from .oect_utils.deriv import gm_deriv
+	from .oect_utils.deriv import gm_deriv, gm_deriv_batch
+	from .oect_utils.oect_read import read_curve, read_file, read_metadata
+	from .oect_utils import oect_profile
+	from .oect_utils.oect_sweeps import Sweeps, assemble
 except: # Jupyter
 	from oect_utils.config import make_config, config_file
-	from oect_utils.deriv import gm_deriv
+	from oect_utils.deriv import gm_deriv, gm_deriv_batch
+	from oect_utils.oect_read import read_curve, read_file, read_metadata
+	from oect_utils import oect_profile
+	from oect_utils.oect_sweeps import Sweeps, assemble
 
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -100,6 +106,20 @@ class OECT:
         	Overwrites the associated config file. For debugging
         V_low : bool
         	Detects if there is a non-monotonic transfer curve (sometimes occurs at very negative voltages)
+        gm_batch : bool
+            Calculates all the gms on a shared voltage grid in a single vectorized call.
+            Gives the same gms and gm_peaks as the per-curve loop
+        vt_method : str
+            For finding the threshold voltage from the sqrt(Id) fit
+            'spline' = spline second derivative, CWT peak-finding and curve_fit per peak
+            'lstsq' = faster closed-form least-squares line fits at second-derivative peaks
+        verbose : bool
+            Prints each file as it is read and the gm peaks. Default False
+        profile : bool or str
+            Records the time of each processing stage in timings. 'memory' also
+            records the peak memory of each stage. See oect_utils.oect_profile
+        profile_log : str
+            File to append the profiling records to as JSON lines
 
 
     Attributes
@@ -125,8 +145,11 @@ class OECT:
 
     Other attributes:
         
+        sweeps : Sweeps
+            All the output and transfer data, each file stored once as rows of
+            one voltage array and one current array. See oect_utils.oect_sweeps
         output : dict
-            dict of DataFrames
+            dict of DataFrames, views over sweeps (read-only attribute)
             Each DataFrame is Id-Vd, with index of DataFrame set to Vd.
             All other columns removed (Id-error, Ig, Ig-error)
         output_raw : dict
@@ -134,7 +157,7 @@ class OECT:
             same as output except columns maintained
     
         transfer : dict
-            dict of DataFrames
+            dict of DataFrames, views over sweeps (read-only attribute)
             DataFrame of Id-Vg, with index of DataFrame set to Vg
             All other columns removed (Ig-error)
         transfer_raw : dict
@@ -164,6 +187,8 @@ class OECT:
             If a reverse trace exists
         rev_point : float
             Voltage where the Id trace starts reverse sweep
+        timings : DataFrame
+            Calls, time and peak memory of each processing stage, if options['profile']
     '''
 
     def __init__(self,
@@ -173,11 +198,8 @@ class OECT:
                  options={}):
 
         # Data containers
-        self.output = {}
-        self.output_raw = {}
+        self.sweeps = Sweeps()
         self.outputs = pd.DataFrame()
-        self.transfer = {}
-        self.transfer_raw = {}
         self.transfers = pd.DataFrame()
         self.Vg_array = []
         self.Vd_array = []
@@ -215,6 +237,7 @@ class OECT:
         _par, _opt = config_file(self.config)
 
         self.set_params(_par, _opt, params, options)
+        self.profiler = oect_profile.get_profiler(self.options, name=self.folder)
         self.loaddata()
 
         if dimDict:  # set W and L based on dictionary
@@ -279,6 +302,14 @@ class OECT:
             self.options['V_low'] = False
         if 'overwrite' not in self.options:
             self.options['overwrite'] = False
+        if 'gm_batch' not in self.options:
+            self.options['gm_batch'] = False
+        if 'vt_method' not in self.options:
+            self.options['vt_method'] = 'spline'
+        if 'verbose' not in self.options:
+            self.options['verbose'] = False
+        if 'profile' not in self.options:
+            self.options['profile'] = False
 
         return
 
@@ -292,14 +323,7 @@ class OECT:
         """
 
         for t in self.files:
-            print(t)
-            self.get_metadata(t)
-
-            if 'transfer' in t:
-                self.transfer_curve(t)
-
-            elif 'output' in t:
-                self.output_curve(t)
+            self._load_file(t)
 
         self.all_outputs()
 
@@ -317,6 +341,85 @@ class OECT:
                 self.update_config()
         return
 
+    @property
+    def output(self):
+        """ Id-Vd DataFrame of each output sweep, as views of sweeps """
+        return self.sweeps.frames('output')
+
+    @property
+    def output_raw(self):
+        """ Output sweeps with every column """
+        return self.sweeps.frames('output', raw=True)
+
+    @property
+    def transfer(self):
+        """ Id-Vg DataFrame of each transfer curve, as views of sweeps """
+        return self.sweeps.frames('transfer')
+
+    @property
+    def transfer_raw(self):
+        """ Transfer curves with every column """
+        return self.sweeps.frames('transfer', raw=True)
+
+    @property
+    def timings(self):
+        """ Calls, seconds and peak memory (MB) of each processing stage """
+        return oect_profile.table(getattr(self, 'profiler', None))
+
+    def _stage(self, name):
+        """ Context timing a processing stage, a no-op unless options['profile'] """
+        return oect_profile.stage(getattr(self, 'profiler', None), name)
+
+    def _load_file(self, t):
+        """ Reads a single data file into the output or transfer dicts """
+        if self.options.get('verbose'):
+            print(t)
+
+        # each file is read once, for both the metadata and the data
+        if 'transfer' in t:
+            with self._stage('read'):
+                v, data, columns, metadata = read_file(t, 'V_G')
+            self.get_metadata(t, metadata)
+            self.transfer_curve(t, (v, data, columns))
+
+        elif 'output' in t:
+            with self._stage('read'):
+                v, data, columns, metadata = read_file(t, 'V_DS')
+            self.get_metadata(t, metadata)
+            self.output_curve(t, (v, data, columns))
+
+        else:
+            self.get_metadata(t)
+
+        return
+
+    def add_files(self, files):
+        """
+        Reads data files added to the folder after loading, without re-reading
+        the existing ones, and rebuilds the outputs and transfers dataFrames.
+        Run calc_gms() and thresh() again afterwards
+
+        files : list of str
+            Paths to the new files. Files already loaded are ignored
+        """
+        files = [f for f in files if f not in self.files]
+
+        for t in files:
+            self._load_file(t)
+        self.files = self.files + files
+
+        self.outputs = pd.DataFrame()
+        self.transfers = pd.DataFrame()
+        self.Vd_labels = []
+
+        self.all_outputs()
+        self.all_transfers()
+
+        self.num_transfers = len(self.transfers.columns)
+        self.num_outputs = len(self.outputs.columns)
+
+        return files
+
     def filelist(self):
         """ Generates list of files to process and config file"""
 
@@ -348,27 +451,36 @@ class OECT:
 
         return
 
-    def get_metadata(self, fl):
-        """ Called in load_data to extract file-specific parameters """
+    @oect_profile.timed('metadata')
+    def get_metadata(self, fl, metadata=None):
+        """
+        Called in load_data to extract file-specific parameters
+
+        fl : str
+            Path to the data file
+        metadata : dict, optional
+            Metadata already read by oect_read.read_file, so fl is not re-read
+        """
 
         # search params in first file in this folder for missing params
-        h = open(fl)
-        for line in h:
-            if 'V_DS = ' in line or 'V_DS =' in line:
-                self.Vd = float(line.split()[-1])
-            if 'V_G = ' in line or 'V_G =' in line:
-                self.Vg = float(line.split()[-1])
+        if metadata is None:
+            metadata = read_metadata(fl)
 
-            # if no config file found, populate based on the raw data
-            if 'Width/um' in line and (self.make_config or self.options['overwrite']):
-                self.W = float(line.split()[-1])
-            if 'Length/um' in line and (self.make_config or self.options['overwrite']):
-                self.L = float(line.split()[-1])
+        if 'V_DS' in metadata:
+            self.Vd = metadata['V_DS']
+        if 'V_G' in metadata:
+            self.Vg = metadata['V_G']
 
-        h.close()
+        # if no config file found, populate based on the raw data
+        if self.make_config or self.options['overwrite']:
+            if 'Width/um' in metadata:
+                self.W = metadata['Width/um']
+            if 'Length/um' in metadata:
+                self.L = metadata['Length/um']
 
         return
 
+    @oect_profile.timed('reverse')
     def _reverse(self, v, transfer=False):
         """if reverse trace exists, return inflection-point index and flag
         
@@ -423,6 +535,7 @@ class OECT:
 
             return mx, False
 
+    @oect_profile.timed('gm')
     def calc_gms(self):
         """
         Calculates all the gms in the set of data.
@@ -431,50 +544,41 @@ class OECT:
         Creates a single dataFrame gms_fwd and another gms_bwd
         """
 
-        for i in self.transfer:
-            self.gm_fwd[i], self.gm_bwd[i], self.gm_peaks = self._calc_gm(self.transfer[i])
+        self.gms = pd.DataFrame()  # rebuilt from scratch if called again
+
+        if self.options['gm_batch']:
+            self._calc_gms_batch()
+        else:
+            for i in self.transfer:
+                self.gm_fwd[i], self.gm_bwd[i], self.gm_peaks = self._calc_gm(self.transfer[i])
 
         # combine all the gm_fwd and gm_bwd into a single dataframe
         labels = 0
+        names = []
+        curves = []
 
-        for g in self.gm_fwd:
-
-            if not self.gm_fwd[g].empty:
-
-                gm = self.gm_fwd[g].values.flatten()
-                idx = self.gm_fwd[g].index.values
-
-                nm = 'gm_' + g
+        for gm_dict in [self.gm_fwd, self.gm_bwd]:
 
-                while nm in self.gms:
-                    labels += 1
-                    nm = 'gm_' + g[:-1] + str(labels)
+            for g, gm in gm_dict.items():
 
-                df = pd.Series(data=gm, index=idx)
-                # df.sort_index(inplace=True)
-                self.gms[nm] = df
+                if not gm.empty:
 
-        for g in self.gm_bwd:
+                    nm = 'gm_' + g
 
-            if not self.gm_bwd[g].empty:
+                    while nm in names:
+                        labels += 1
+                        nm = 'gm_' + g[:-1] + str(labels)
 
-                gm = self.gm_bwd[g].values.flatten()
-                idx = self.gm_bwd[g].index.values
+                    names.append(nm)
+                    curves.append((gm.index.values, gm.values[:, 0]))
 
-                nm = 'gm_' + g
-
-                while nm in self.gms:
-                    labels += 1
-                    nm = 'gm_' + g[:-1] + str(labels)
-
-                df = pd.Series(data=gm, index=idx)
-                # df.sort_index(inplace=True)
-                self.gms[nm] = df
+        # on the voltages of the first gm
+        self.gms = assemble(curves, names)
 
         self.peak_gm = self.gm_peaks['peak gm (S)'].values
 
         if 'Average' in self.options and self.options['Average']:
-            self.gms = pd.DataFrame(self.gms.mean(1), columns={'gm_avg'})
+            self.gms = pd.DataFrame(self.gms.mean(1), columns=['gm_avg'])
             self.peak_gm = self.gm_peaks['peak gm (S)'].values.mean()
 
         return
@@ -499,11 +603,7 @@ class OECT:
         gm_peaks = np.array([])
         gm_args = np.array([])
 
-        # sg parameters
-        window = np.max([int(0.04 * self.transfers.shape[0]), 3])
-        polyorder = 2
-        deg = 8
-        fitparams = {'window': window, 'polyorder': polyorder, 'deg': deg}
+        fitparams = self._gm_fitparams()
 
         def get_gm(v, i, fit, options):
 
@@ -533,86 +633,140 @@ class OECT:
             gm_bwd = pd.DataFrame()  # empty dataframe
 
         gm_peaks = pd.DataFrame(data=gm_peaks, index=gm_args, columns=['peak gm (S)'])
-        print(gm_peaks)
+        if self.options.get('verbose'):
+            print(gm_peaks)
+
         return gm_fwd, gm_bwd, gm_peaks
 
-    def output_curve(self, path):
-        """Loads Id-Vd output curves from a folder as Series in a list"""
+    def _calc_gms_batch(self):
+        """
+        Vectorized version of the _calc_gm loop in calc_gms.
+        Every transfer curve is split into forward and (flipped) reverse
+        segments, and segments on the same voltage grid are differentiated
+        together with gm_deriv_batch
+        """
+
+        mx, reverse = self.rev_point, self.reverse
+        fitparams = self._gm_fitparams()
+
+        segments = []  # (transfer key, is forward, voltage, current)
+        for k, df in self.transfer.items():
+            v = df.index.values
+            i = df.values[:, 0]
+            segments.append((k, True, v[:mx], i[:mx]))
+
+            if reverse:
+                segments.append((k, False, np.flip(v[mx:]), np.flip(i[mx:])))
+            else:
+                self.gm_bwd[k] = pd.DataFrame()  # empty dataframe
+
+        # segments sharing a voltage grid
+        grids = {}
+        for n, seg in enumerate(segments):
+            grids.setdefault(seg[2].tobytes(), []).append(n)
+
+        gms = [None] * len(segments)
+        gm_peaks = np.zeros(len(segments))
+        gm_args = np.zeros(len(segments))
+        for ix in grids.values():
+            v = segments[ix[0]][2]
+            i = np.vstack([segments[n][3] for n in ix])
+            _gms, _peaks, _args = gm_deriv_batch(v, i, self.options['gm_method'], fitparams)
+            for row, n in enumerate(ix):
+                gms[n] = _gms[row]
+                gm_peaks[n] = _peaks[row]
+                gm_args[n] = _args[row]
+
+        for (k, fwd, v, _), gml in zip(segments, gms):
+            gm = pd.DataFrame(data=gml, index=v, columns=['gm'])
+            gm.index.name = 'Voltage (V)'
+
+            if fwd:
+                self.gm_fwd[k] = gm
+            else:
+                self.gm_bwd[k] = gm
+
+        # as the loop, which keeps the peaks of the last transfer curve
+        last = [n for n, seg in enumerate(segments) if seg[0] == segments[-1][0]] if segments else []
+        self.gm_peaks = pd.DataFrame(data=gm_peaks[last], index=gm_args[last], columns=['peak gm (S)'])
+
+        return
+
+    def _gm_fitparams(self):
+        """ Smoothing/fitting parameters for gm_deriv """
+
+        # sg parameters
+        window = np.max([int(0.04 * self.transfers.shape[0]), 3])
+        polyorder = 2
+        deg = 8
+
+        return {'window': window, 'polyorder': polyorder, 'deg': deg}
+
+    def output_curve(self, path, curve=None):
+        """
+        Loads Id-Vd output curves from a folder as Series in a list
+
+        curve : tuple, optional
+            (v, data, columns) already read from path by oect_read.read_file
+        """
 
         V = self.Vg
 
-        op = pd.read_csv(path, delimiter='\t', engine='python')
+        if curve is None:
+            curve = read_curve(path, 'V_DS')
+        v, data, columns = curve
 
-        # Remove junk rows
-        _junk = pd.to_numeric(op['V_DS'], errors='coerce')
-        _junk = _junk.notnull()
-        op = op.loc[_junk]
-        op = op.set_index('V_DS')
-        op = op.set_index(pd.to_numeric(op.index.values))
+        mx, reverse = self._reverse(v, transfer=False)
 
-        mx, reverse = self._reverse(op.index.values, transfer=False)
-        idx = op.index.values[mx]
+        # forward and reverse sweeps both include the turnaround point
+        sweeps = [(str(V) + '_fwd', 0, mx + 1, 'fwd')]
+        if reverse:
+            sweeps.append((str(V) + '_bwd', mx, len(v), 'bwd'))
 
+        self.sweeps.add('output', v, data, columns, sweeps, bias=V)
         self.Vg_array.append(V)
-        Vfwd = str(V) + '_fwd'
-        self.output[Vfwd] = op[:idx]
-        self.output_raw[Vfwd] = op[:idx]
-        self.output[Vfwd] = self.output[Vfwd].drop(['I_DS Error (A)',
-                                                    'I_G (A)',
-                                                    'I_G Error (A)'], 1)
-        if reverse:
-            Vbwd = str(V) + '_bwd'
-            self.output[Vbwd] = op[idx:]
-            self.output_raw[Vbwd] = op[idx:]
-            self.output[Vbwd] = self.output[Vbwd].drop(['I_DS Error (A)',
-                                                        'I_G (A)',
-                                                        'I_G Error (A)'], 1)
 
     def all_outputs(self):
         """
         Creates a single dataFrame with all output curves
         This assumes that all data were taken at the same Vds range
         """
-        self.Vg_labels = []  # corrects for labels below
+        output = self.output
+        self.Vg_labels = list(output)
 
-        for op in self.output:
-            self.Vg_labels.append(op)
-            df = pd.DataFrame(self.output[op])
-            df = df.rename(columns={self.output[op].columns[0]: op})
+        # appended to any existing outputs, on the voltages of the first sweep
+        names = list(self.outputs.columns) + list(output)
+        curves = [(self.outputs.index.values, y) for y in self.outputs.values.T]
+        curves += [(df.index.values, df.values[:, 0]) for df in output.values()]
 
-            if self.outputs.empty:
-                self.outputs = pd.DataFrame(df)
-            else:
-                self.outputs = pd.concat([self.outputs, df], axis=1)
+        self.outputs = assemble(curves, names)
 
         self.num_outputs = len(self.outputs.columns)
         return
 
-    def transfer_curve(self, path):
-        """Loads Id-Vg transfer curve from a path"""
-        transfer_raw = pd.read_csv(path, delimiter='\t', engine='python')
+    def transfer_curve(self, path, curve=None):
+        """
+        Loads Id-Vg transfer curve from a path
 
-        # Remove junk rows
-        _junk = pd.to_numeric(transfer_raw['V_G'], errors='coerce')
-        _junk = _junk.notnull()
-        transfer_raw = transfer_raw.loc[_junk]
-        transfer_raw = transfer_raw.set_index('V_G')
-        transfer_raw = transfer_raw.set_index(pd.to_numeric(transfer_raw.index.values))
+        curve : tuple, optional
+            (v, data, columns) already read from path by oect_read.read_file
+        """
+        if curve is None:
+            curve = read_curve(path, 'V_G')
+        v, data, columns = curve
 
         transfer_Vd = str(self.Vd)
+        keys = self.sweeps.keys('transfer')
 
-        if (transfer_Vd + '_0') in self.transfer:
-            c = list(self.transfer.keys())[-1]
+        if (transfer_Vd + '_0') in keys:
+            c = keys[-1]
             c = str(int(c[-1]) + 1)
             transfer_Vd = transfer_Vd + '_' + c
 
         else:
             transfer_Vd += '_0'
 
-        self.transfer[transfer_Vd] = transfer_raw
-        self.transfer_raw[transfer_Vd] = transfer_raw
-        self.transfer[transfer_Vd] = self.transfer[transfer_Vd].drop(['I_DS Error (A)', 'I_G (A)',
-                                                                      'I_G Error (A)'], 1)
+        self.sweeps.add('transfer', v, data, columns, [(transfer_Vd, 0, len(v), 'both')], bias=self.Vd)
 
         return
 
@@ -622,26 +776,26 @@ class OECT:
         Creates a single dataFrame with all transfer curves (in case more than 1)
         This assumes that all data were taken at the same Vgs range
         """
-        for tf in self.transfer:
+        # existing columns of the same name are replaced
+        curves = {c: (self.transfers.index.values, self.transfers[c].values) for c in self.transfers}
+
+        for tf, df in self.transfer.items():
             self.Vd_labels.append(tf)
 
-            transfer = self.transfer[tf]['I_DS (A)'].values
-            idx = self.transfer[tf]['I_DS (A)'].index.values
+            transfer = df['I_DS (A)'].values
+            idx = df.index.values
 
             mx, reverse = self._reverse(idx, transfer=True)
-            nm = tf + '_01'
-            df = pd.Series(data=transfer[:mx], index=idx[:mx])
-            # df.sort_index(inplace=True)
-            self.transfers[nm] = df
+            curves[tf + '_01'] = (idx[:mx], transfer[:mx])
 
             if reverse:
-                nm = tf + '_02'
-                df = pd.Series(data=transfer[mx:], index=idx[mx:])
-                # df.sort_index(inplace=True)
-                self.transfers[nm] = df
+                curves[tf + '_02'] = (idx[mx:], transfer[mx:])
+
+        # on the voltages of the first forward sweep
+        self.transfers = assemble(list(curves.values()), list(curves))
 
         if 'Average' in self.options and self.options['Average']:
-            self.transfers = pd.DataFrame(self.transfers.mean(1), columns={'transfer_avg'})
+            self.transfers = pd.DataFrame(self.transfers.mean(1), columns=['transfer_avg'])
 
         # if there's an "inversion" at the end, finds that point
         if self.options['V_low'] is True:
@@ -677,6 +831,7 @@ class OECT:
 
         return
 
+    @oect_profile.timed('Vt')
     def thresh(self, plot=False, c_star=None, cap=None):
         """
         Finds the threshold voltage by fitting sqrt(Id) vs (Vg-Vt) and finding
@@ -793,11 +948,23 @@ class OECT:
             Id = np.flip(Id)
             V = np.flip(-V)
 
-        mx_d2 = self._find_peak(Id * 1000, V)  # *1000 improves numerical spline accuracy
+        if self.options['vt_method'] == 'lstsq':
+
+            fit = self._fit_cuts(Id, V, self._find_peak_d2(Id))
+
+            if fit is not None:
+
+                if self.quad == 'I':
+                    fit[0] *= -1
+
+                return fit
 
-        # sometimes for very small currents run into numerical issues
-        if not mx_d2:
-            mx_d2 = self._find_peak(Id * 1000, V, width=15)
+        with self._stage('peak'):
+            mx_d2 = self._find_peak(Id * 1000, V)  # *1000 improves numerical spline accuracy
+
+            # sometimes for very small currents run into numerical issues
+            if not mx_d2:
+                mx_d2 = self._find_peak(Id * 1000, V, width=15)
 
         # for each peak found, fits a line. Uses that to determine Vt, then residual up to that found Vt
         for m in mx_d2:
@@ -860,6 +1027,91 @@ class OECT:
 
         return mx_d2
 
+    @staticmethod
+    def _find_peak_d2(I, smooth=5):
+        """
+        Cheaper alternative to _find_peak. Finds peaks in the second derivative
+        of the lightly smoothed sqrt(Id) on the measured voltage grid
+
+        Parameters
+        ----------
+        I : array
+            Id vs Vg, currents
+        smooth : int
+            Savitsky-Golay window for smoothing before the derivative
+
+        Returns
+        -------
+        mx_d2 : ndarray
+            Candidate indices (peaks and their neighbors) for the end of the line fit
+        """
+
+        if smooth and len(I) > smooth:
+            I = sps.savgol_filter(I, smooth, 2)
+
+        d2 = np.gradient(np.gradient(I))
+        peaks, _ = sps.find_peaks(d2)
+
+        # the peak-finder is coarser than the spline, so also try the neighbors
+        mx_d2 = np.unique(np.concatenate([peaks - 1, peaks, peaks + 1]))
+        mx_d2 = mx_d2[(mx_d2 > 1) & (mx_d2 <= len(I))]  # edge errors
+
+        return mx_d2
+
+    @staticmethod
+    def _fit_cuts(I, V, cuts):
+        """
+        Closed-form version of the line fits in _min_fit. Fits sqrt(Id) = f1 + f0 * V
+        to V[:m] for every m in cuts, and sums the squared residuals up to the
+        resulting Vt, using cumulative sums so each cut costs O(1)
+
+        Parameters
+        ----------
+        I : array
+            sqrt(Id) vs Vg, ascending Vg
+        V : array
+            Id vs Vg, voltages
+        cuts : array
+            End indices of the fits
+
+        Returns
+        -------
+        fit : ndarray or None
+            [f0, f1] with the smallest residual. None if no cut gives a negative slope
+        """
+
+        cuts = np.asarray(cuts, dtype=int)
+        if not cuts.size:
+            return None
+
+        # prepended 0 so that c[m] is the sum over [:m]
+        def csum(x):
+            return np.concatenate(([0], np.cumsum(x)))
+
+        sx, sy, sxx, sxy, syy = csum(V), csum(I), csum(V * V), csum(V * I), csum(I * I)
+
+        n = cuts.astype(float)
+        den = n * sxx[cuts] - sx[cuts] ** 2
+        valid = den > 0
+        den[~valid] = 1
+        f0 = (n * sxy[cuts] - sx[cuts] * sy[cuts]) / den
+        f1 = (sy[cuts] - f0 * sx[cuts]) / n
+
+        # same bound as the curve_fit in _min_fit, slope <= 0
+        valid &= f0 < 0
+        if not np.any(valid):
+            return None
+
+        vt = -f1[valid] / f0[valid]
+        f0, f1 = f0[valid], f1[valid]
+        v_x = np.searchsorted(V, vt)  # residual up to the Vt from each fit
+        res = (syy[v_x] - 2 * f0 * sxy[v_x] - 2 * f1 * sy[v_x]
+               + f0 ** 2 * sxx[v_x] + 2 * f0 * f1 * sx[v_x] + f1 ** 2 * v_x)
+
+        best = np.argmin(res)
+
+        return np.array([f0[best], f1[best]])
+
     def update_config(self):
 
         config = configparser.ConfigParser()
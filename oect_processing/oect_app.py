@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 import os
 import pandas as pd
@@ -6,6 +7,7 @@ import sys
 from matplotlib import pyplot as plt
 
 import oect_processing as oect
+from oect_utils import oect_cache
 from oect_utils import oect_plot
 from oect_utils.oect_load import uC_scale
 
@@ -13,6 +15,8 @@ from oect_utils.oect_load import uC_scale
 # os.chdir('..')
 # os.chdir('..')
 
+CACHE_ENTRIES = 64  # pixels, devices and figures kept between reruns
+
 st.title('OECT processing')
 
 device_folder = st.sidebar.text_input('Device folder')
@@ -26,6 +30,75 @@ def file_selector(folder_path=r'notebooks/test_data_manufactured'):
 
     return os.path.join(folder_path, selected_filename)
 
+def cached(func):
+    '''
+    Keeps the results of func between reruns, keyed on its arguments.
+    The results are shared, not copied, so they must not be modified
+    '''
+    if hasattr(st, 'cache_resource'):
+        return st.cache_resource(max_entries=CACHE_ENTRIES, show_spinner=False)(func)
+
+    return st.cache(allow_output_mutation=True, max_entries=CACHE_ENTRIES, show_spinner=False)(func)
+
+
+def signature(folder):
+    '''
+    Cache key of a pixel folder, changes when its .txt or .cfg files change
+    '''
+    return tuple(oect_cache.folder_signature(folder))
+
+
+@cached
+def load_pixel(folder, sig):
+    '''
+    Processed pixel (gm and Vt) at its .cfg thickness.
+    sig is only the cache key, see signature
+    '''
+    dv = oect.OECT(folder)
+    dv.calc_gms()
+    dv.thresh()
+
+    return dv
+
+
+@cached
+def pixel_figures(folder, sig):
+    '''
+    Transfer/gm and output figures of a pixel. Neither depends on the thickness
+    '''
+    dv = load_pixel(folder, sig)
+
+    return oect_plot.plot_transfers_gm(dv), oect_plot.plot_outputs(dv, sort=True, direction='bwd')
+
+
+@cached
+def load_device(folder, pixels, thickness):
+    '''
+    uC* fit of the cached pixels, rescaled to the thickness override.
+    Only the pixels whose files changed are reprocessed, and gm and Vt are
+    not recalculated when only the thickness changes
+
+    pixels : tuple
+        (name, folder, signature) for each pixel, as in uC_scale
+    '''
+    # shallow copies, so that set_thickness does not change the cached pixels
+    pix = {name: copy.copy(load_pixel(path, sig)) for name, path, sig in pixels}
+    device = oect.OECTDevice(folder, pixels=pix,
+                             options={'plot': [False, False], 'verbose': False})
+    if thickness:
+        device.set_thickness(thickness)
+
+    return device
+
+
+@cached
+def device_figure(folder, pixels, thickness):
+
+    _, _, fig = oect_plot.plot_uC(load_device(folder, pixels, thickness), savefig=False)
+
+    return fig
+
+
 if device_folder:
     pixel_folder = file_selector(device_folder)
 else:
@@ -48,16 +121,12 @@ except:
     thickness = None
 
 # Run Pixel analysis
-if thickness:
-    dv = oect.OECT(pixel_folder, params={'d': thickness})
-else:
-    dv = oect.OECT(pixel_folder)
+pixel_sig = signature(pixel_folder)
+dv = load_pixel(pixel_folder, pixel_sig)
 
 st.write('Width = `%s`' % dv.W)
 st.write('Length = `%s`' % dv.L)
 
-dv.calc_gms()
-dv.thresh()
 st.write('Transconductance, $g_m$ (S)')
 dv.gms
 st.write('Threshold Voltage $V_t$ (V)')
@@ -66,19 +135,19 @@ st.write('Peak $g_m$ (S)')
 dv.gm_peaks
 
 st.header('Plots')
-fig = oect_plot.plot_transfers_gm(dv)
-st.pyplot(fig)
-
-fig = oect_plot.plot_outputs(dv, sort=True, direction='bwd')
-st.pyplot(fig)
-
-# Run device analysis
-device = oect.OECTDevice(device_folder,
-                         params={'thickness': thickness},
-                         options={'plot': [False, False], 'verbose': False})
-
-_, _, fig = oect_plot.plot_uC(device, savefig=False)
-st.pyplot(fig)
+transfer_plot, output_plot = pixel_figures(pixel_folder, pixel_sig)
+st.pyplot(transfer_plot)
+st.pyplot(output_plot)
+
+# Run device analysis, on the pixel folders '01', '02', ... as uC_scale
+names = sorted([n for n in os.listdir(device_folder) if n.isdigit()
+                and os.path.isdir(os.path.join(device_folder, n))
+                and os.listdir(os.path.join(device_folder, n))], key=int)
+pixels = tuple((n + '_uC', os.path.join(device_folder, n), signature(os.path.join(device_folder, n)))
+               for n in names)
+device = load_device(device_folder, pixels, thickness)
+
+st.pyplot(device_figure(device_folder, pixels, thickness))
 
 # Update sidebar display
 df = pd.DataFrame(index= device.W)
@@ -8,10 +8,11 @@ Created on Wed Apr 24 10:16:43 2019
 import numpy as np
 import pandas as pd
 import pickle
-from scipy.optimize import curve_fit as cf
 
 from .oect_utils import oect_load
 from .oect_utils import oect_plot
+from .oect_utils import oect_profile
+from .oect_utils import uc_fit
 
 
 class OECTDevice:
@@ -53,12 +54,27 @@ class OECTDevice:
             Whether to find erroneous "turnover" points when devices break down
         retrace_only : bool, optional
             Only use the retrace in case trace isn't saturating
+        gm_batch : bool, optional
+            Calculate the gms of each pixel in one vectorized call
+        vt_method : str, optional
+            'spline' or 'lstsq', the threshold voltage search (see OECT options)
+        uc_method : str, optional
+            'ols', 'huber' or 'theilsen', the line fit for uC* (see uc_fit.fit_uC)
         verbose: bool, optional
             Print to display
         plot : list of bools, optional
             [0]: Plot the uC* data
             [1]: plot the individual plots
             Whether to plot or not. Plotting can be very fast if both are turned on!
+        n_jobs : int, optional
+            Number of processes for loading the pixels. 1 = serial, None or -1 = one per CPU
+        cache : bool, str or oect_cache.OECTCache, optional
+            Reuse processed pixels from an on-disk cache when their files are unchanged
+            True = default cache folder, str = path to a cache folder
+        profile : bool or str, optional
+            Time each processing stage, see timings. 'memory' also records peak memory
+        profile_log : str, optional
+            File to append the profiling records to as JSON lines
 
     Attributes
     ----------
@@ -78,12 +94,19 @@ class OECTDevice:
         uC* extracted from the gm vs WdL * Vg_Vt plot
     uC_0 : float
         uC* forced to go through 0,0 
+    uC_err, uC_0_err : array
+        1-sigma uncertainties of uC and uC_0, in params
     gms : array
         peak transconductances for each device
     pix_paths : array
         Folder paths for the pixels
     pixels : dictionary
         Dictionary of the generated pixels using OECT class for each folder
+    failed : dictionary
+        Pixel folders that could not be processed, with the error message
+    timings : DataFrame
+        With options['profile'], calls, time and peak memory of each stage per pixel,
+        and of the device-level stages as pixel 'device'
     '''
 
     def __init__(self,
@@ -108,7 +131,9 @@ class OECTDevice:
         for m in params:
             self.params[m] = params[m]
 
-        self.options = {'V_low': False, 'retrace_only': False,'verbose': False, 'plot': [True, False]}
+        self.options = {'V_low': False, 'retrace_only': False, 'gm_batch': False,
+                        'vt_method': 'spline', 'uc_method': 'ols', 'verbose': False, 'plot': [True, False],
+                        'n_jobs': 1, 'cache': None, 'profile': False}
         self.options.update(options)
 
         # if device has not been processed
@@ -135,6 +160,7 @@ class OECTDevice:
         self.uC = self.params['uC']
         self.uC_0 = self.params['uC_0']
         self.gms = self.params['gms']
+        self.failed = self.params.get('failed', {})
 
         self.pix_paths = []
 
@@ -148,15 +174,6 @@ class OECTDevice:
         Generates the parameters from the pixel data and calculates uC*
         By default this averages forward and backward curves together
         '''
-        Wd_L = np.array([])
-        W = np.array([])
-        Vg_Vt = np.array([])  # threshold offset
-        Vt = np.array([])
-        gms = np.array([])
-
-        # assumes Length and thickness are fixed
-        params = {}
-
         for pixel in self.pixels:
 
             if self.pixels[pixel].gms.empty:
@@ -164,47 +181,13 @@ class OECTDevice:
                 self.pixels[pixel].calc_gms()
                 self.pixels[pixel].thresh()
 
-            ix = len(self.pixels[pixel].VgVts)
-            Vt = np.append(Vt, self.pixels[pixel].Vts)
-            Vg_Vt = np.append(Vg_Vt, self.pixels[pixel].VgVts)
-            gms = np.append(gms, self.pixels[pixel].peak_gm)
-            W = np.append(W, self.pixels[pixel].W)
-
-            # appends WdL as many times as there are transfer curves
-            for i in range(len(self.pixels[pixel].VgVts)):
-                Wd_L = np.append(Wd_L, self.pixels[pixel].WdL)
-
-            # remove the trace ()
-            if self.options['retrace_only'] and len(self.pixels[pixel].VgVts) > 1:
-                Vt = np.delete(Vt, -ix)
-                Vg_Vt = np.delete(Vg_Vt, -ix)
-                gms = np.delete(gms, -ix)
-                Wd_L = np.delete(Wd_L, -ix)
-
-            params['L'] = self.pixels[pixel].L
-            params['d'] = self.pixels[pixel].d
-
-        # fit functions
-        def line_f(x, a, b):
-
-            return a + b * x
-
-        def line_0(x, b):
-            'no y-offset --> better log-log fits'
-            return b * x
+        # assumes Length and thickness are fixed
+        params = uc_fit.collect_pixels(self.pixels,
+                                       retrace_only=self.options['retrace_only'])
 
         # * 1e2 to get into right mobility units (cm)
-        uC_0, _ = cf(line_0, Wd_L * Vg_Vt, gms)
-        uC, _ = cf(line_f, Wd_L * Vg_Vt, gms)
-
-        # Create an OECT and add arrays 
-        params['WdL'] = Wd_L
-        params['W'] = W
-        params['Vg_Vt'] = Vg_Vt
-        params['Vt'] = Vt
-        params['uC'] = uC
-        params['uC_0'] = uC_0
-        params['gms'] = gms
+        params.update(uc_fit.fit_uC(params['WdL'] * params['Vg_Vt'], params['gms'],
+                                    method=self.options['uc_method']))
 
         self.params = params
 
@@ -220,6 +203,56 @@ class OECTDevice:
 
         return
 
+    def set_thickness(self, d):
+        '''
+        Rescales every pixel to a new film thickness and refits uC*.
+        gm and Vt do not depend on the thickness, so they are not recalculated;
+        only W*d/L, c_star (if from a capacitance) and the mobilities change.
+        The pixels' attributes are replaced rather than modified in place, so
+        shallow copies of cached pixels can be rescaled safely
+
+        d : float
+            Film thickness in m (or nm if > 1, as OECT)
+        '''
+        if d > 1:  # wrong units
+            d *= 1e-9
+
+        for p in self.pixels:
+
+            pixel = self.pixels[p]
+            old = pixel.WdL * (pixel.c_star if pixel.c_star else 1)
+
+            pixel.d = d
+            pixel.params = dict(pixel.params, d=d)
+            pixel.WdL = pixel.W * d / pixel.L
+
+            if not pixel.params.get('c_star') and pixel.params.get('capacitance'):
+                pixel.c_star = pixel.params['capacitance'] / (pixel.W * 1e-4 * pixel.L * 1e-4 * d)
+
+            # mobility ~ 1 / (c_star * W*d/L), see OECT.thresh
+            if np.size(getattr(pixel, 'mobilities', [])):
+                pixel.mobilities = pixel.mobilities * old / (pixel.WdL * (pixel.c_star if pixel.c_star else 1))
+                pixel.mobility = np.mean(pixel.mobilities)
+
+        keep = {k: self.params[k] for k in ['folder', 'failed', 'timings'] if k in self.params}
+        self.get_params()
+        self.params.update(keep)
+
+        return
+
+    @property
+    def timings(self):
+
+        frames = {p: self.pixels[p].timings for p in self.pixels}
+        if isinstance(self.params.get('timings'), pd.DataFrame):
+            frames['device'] = self.params['timings']
+
+        if not frames:
+            return pd.DataFrame(columns=oect_profile.COLUMNS,
+                                index=pd.MultiIndex.from_tuples([], names=['pixel', 'stage']))
+
+        return pd.concat(frames, names=['pixel'])
+
     def plot_uc(self, save=False):
 
         fig = oect_plot.plot_uC(self.params, savefig=save)
@@ -257,6 +290,10 @@ class OECTDevice:
         return
 
 def save(dv, append=''):
+    '''
+    Pickles the whole device. See oect_utils.oect_h5.save_h5 for a store that
+    can be read one pixel at a time
+    '''
     with open(dv.path + r'\uC_data_' + append + '.pkl', 'wb') as output:
         pickle.dump(dv, output, pickle.HIGHEST_PROTOCOL)
 
@@ -3,4 +3,4 @@ from . import *
 #import oect_load
 #import oect_plot
 
-__all__ = ['oect_load', 'oect_plot', 'deriv']
\ No newline at end of file
+__all__ = ['oect_load', 'oect_plot', 'oect_read', 'oect_cache', 'oect_h5', 'oect_lot', 'oect_profile', 'oect_sweeps', 'oect_watch', 'uc_fit', 'deriv']
\ No newline at end of file
@@ -39,7 +39,7 @@ def config_file(cfg):
     vgs_keys = ['Preread (ms)', 'First Bias (ms)', 'Vds (V)']
     vds_keys = ['Preread (ms)', 'First Bias (ms)', 'Output Vgs']
     opts_bools = ['Reverse', 'Average']
-    opts_str = ['gm_method']
+    opts_str = ['gm_method', 'vt_method']
     opts_flt = ['V_low']
 
     for key in dim_keys:
@@ -30,3 +30,52 @@ def gm_deriv(v, i, method='raw', fit_params={'window': 11, 'polyorder': 2, 'deg'
         return
 
     return gml
+
+
+def gm_deriv_batch(v, i, method='raw', fit_params={'window': 11, 'polyorder': 2, 'deg': 8}):
+    '''
+    Vectorized gm_deriv for many transfer curves on a shared voltage grid
+
+    v : ndarray
+        Gate voltages, 1D of length n_points
+    i : ndarray
+        Drain currents, 2D of shape (n_curves, n_points)
+    method : str
+        'sg', 'raw' or 'poly', as in gm_deriv
+
+    Returns
+    -------
+    gms : ndarray
+        Transconductance, shape (n_curves, n_points)
+    peaks : ndarray
+        Peak gm of each curve
+    peak_v : ndarray
+        Gate voltage at the peak gm of each curve
+    '''
+    i = np.atleast_2d(i)
+    dv = v[2] - v[1]
+
+    if method == 'sg':
+        # Savitsky-Golay method
+        window = fit_params['window']
+        if not window & 1:  # is odd
+            window += 1
+        gms = sps.savgol_filter(i, window_length=window, polyorder=fit_params['polyorder'],
+                                deriv=1, delta=dv, axis=-1)
+    elif method == 'raw':
+        # raw derivative
+        gms = np.gradient(i, dv, axis=-1)
+
+    elif method == 'poly':
+        # polynomial fit, all curves at once
+        funclo = np.polyfit(v, i.T, fit_params['deg'])
+        fits = np.vander(v, fit_params['deg'] + 1) @ funclo
+        gms = np.gradient(fits.T, dv, axis=-1)
+
+    else:
+        warnings.warn('Bad gm_method, aborting')
+        return
+
+    mx = np.argmax(gms, axis=1)
+
+    return gms, gms[np.arange(gms.shape[0]), mx], v[mx]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of processed OECT pixels
+
+Usage:
+
+    >> cache = oect_cache.OECTCache()  # defaults to ~/.cache/oect_processing
+    >> device = cache.load(r'path_to_pixel_folder', params={'d': 40e-9})
+    >> pixels, uC_dv = oect_load.uC_scale(r'path_to_device', cache=cache)
+
+An entry is the pickled OECT after calc_gms() and thresh(). It is keyed on the
+folder path, the size and modification time (or contents) of every .txt and
+.cfg file in the folder, the contents of the config file, and the params and
+options passed to OECT. Changing any data file, the config, or the processing
+options therefore results in a cache miss. The least-recently used entries are
+deleted once the cache grows past max_size.
+
+@author: Raj
+"""
+
+import contextlib
+import hashlib
+import os
+import pickle
+import tempfile
+
+import oect_processing as oectp
+from . import oect_profile
+
+CACHE_VERSION = 2
+
+DEFAULT_PATH = os.environ.get('OECT_CACHE_DIR',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'oect_processing'))
+
+
+class OECTCache:
+    '''
+    Cache of processed OECT pixels stored as pickles in a single folder
+
+    Parameters
+    ----------
+    path : str, optional
+        Folder for the cache files. Defaults to $OECT_CACHE_DIR or ~/.cache/oect_processing
+        Use the device folder to keep the cache next to the data
+    max_size : float, optional
+        Maximum total size of the cache in bytes before old entries are evicted
+    hash_contents : bool, optional
+        Key on the contents of the data files rather than the size and
+        modification time. Slower, but robust to copies that change mtimes
+
+    Attributes
+    ----------
+    hits : int
+        Number of pixels loaded from the cache
+    misses : int
+        Number of pixels processed and added to the cache
+    '''
+
+    def __init__(self, path=None, max_size=500e6, hash_contents=False):
+
+        self.path = path if path else DEFAULT_PATH
+        self.max_size = max_size
+        self.hash_contents = hash_contents
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.path, exist_ok=True)
+
+        return
+
+    def key(self, folder, params={}, options={}):
+        '''
+        Returns the cache filename for this folder and processing options.
+        The first part depends only on the folder, so all entries for a folder
+        can be found by invalidate()
+        '''
+        folder = os.path.abspath(folder)
+
+        h = hashlib.sha1()
+        h.update(repr(CACHE_VERSION).encode())
+        h.update(repr(folder_signature(folder, self.hash_contents)).encode())
+        h.update(repr(sorted((str(k), repr(v)) for k, v in params.items())).encode())
+        h.update(repr(sorted((str(k), repr(v)) for k, v in options.items())).encode())
+
+        return _folder_hash(folder) + '_' + h.hexdigest() + '.pkl'
+
+    def get(self, folder, params={}, options={}):
+        '''
+        Returns the cached OECT, or None if there is no valid entry
+        '''
+        return self._read(os.path.join(self.path, self.key(folder, params, options)))
+
+    def put(self, device, folder, params={}, options={}):
+        '''
+        Adds a processed OECT to the cache, then evicts old entries if needed
+        '''
+        self._write(device, os.path.join(self.path, self.key(folder, params, options)))
+
+        return
+
+    def load(self, folder, params={}, options={}):
+        '''
+        Returns the processed OECT (calc_gms and thresh already run) for a
+        pixel folder, from the cache if it is unchanged
+        '''
+        fl = os.path.join(self.path, self.key(folder, params, options))
+        device = self._read(fl)
+
+        if device is not None:
+            self.hits += 1
+            return device
+
+        device = oectp.OECT(folder, params=params, options=options)
+        device.calc_gms()
+        device.thresh()
+
+        self.misses += 1
+        # after loading, in case OECT wrote a config file into the folder
+        self._write(device, os.path.join(self.path, self.key(folder, params, options)))
+
+        return device
+
+    def invalidate(self, folder=None):
+        '''
+        Deletes all the entries for a pixel folder, or the whole cache if None
+        '''
+        prefix = _folder_hash(os.path.abspath(folder)) + '_' if folder else ''
+
+        for name in os.listdir(self.path):
+            if name.startswith(prefix) and name.endswith('.pkl'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.path, name))
+
+        return
+
+    def clear(self):
+        '''
+        Deletes every entry in the cache
+        '''
+        self.invalidate()
+
+        return
+
+    def size(self):
+        '''
+        Total size of the cache entries in bytes
+        '''
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self):
+        '''
+        Deletes the least-recently used entries until the cache is below max_size
+        '''
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+
+        for fl, _, size in sorted(entries, key=lambda e: e[1]):
+
+            if total <= self.max_size:
+                break
+
+            total -= size
+            with contextlib.suppress(FileNotFoundError):  # evicted by another worker
+                os.remove(fl)
+
+        return
+
+    def _entries(self):
+        '''
+        (path, last used time, size) of every entry. Entries deleted by
+        another process while listing are skipped
+        '''
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                fl = os.path.join(self.path, name)
+                with contextlib.suppress(FileNotFoundError):
+                    st = os.stat(fl)
+                    entries.append((fl, st.st_mtime, st.st_size))
+
+        return entries
+
+    def _read(self, fl):
+
+        try:
+            with open(fl, 'rb') as f:
+                device = pickle.load(f)
+            os.utime(fl)  # marks as recently used for eviction
+        except OSError:  # no entry, or evicted by another worker
+            return None
+        except Exception:  # truncated, or pickled from an older class layout
+            with contextlib.suppress(OSError):
+                os.remove(fl)
+            return None
+
+        # the stored timings are of the run that processed it, not this one
+        if hasattr(device, 'profiler'):
+            device.profiler = oect_profile.get_profiler(device.options, name=device.folder)
+
+        return device
+
+    def _write(self, device, fl):
+
+        # write then rename, so parallel workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(device, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, fl)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        self.evict()
+
+        return
+
+
+def get_cache(cache):
+    '''
+    Converts the cache argument of loadOECT/uC_scale to an OECTCache
+
+    cache : bool, str or OECTCache
+        True = default location, str = cache folder, False/None = no cache
+    '''
+    if not cache:
+        return None
+    if isinstance(cache, OECTCache):
+        return cache
+    if isinstance(cache, str):
+        return OECTCache(cache)
+
+    return OECTCache()
+
+
+def folder_signature(folder, hash_contents=False):
+    '''
+    Identifies the state of the data in a pixel folder
+
+    Returns a list of (filename, size, mtime) for every .txt and .cfg file,
+    or (filename, sha1) if hash_contents. The config file is always hashed
+    by contents since it is small.
+    '''
+    sig = []
+    for name in sorted(os.listdir(folder)):
+
+        fl = os.path.join(folder, name)
+
+        if name.endswith('.cfg') or (hash_contents and name.endswith('.txt')):
+            sig.append((name, _file_hash(fl)))
+        elif name.endswith('.txt'):
+            st = os.stat(fl)
+            sig.append((name, st.st_size, st.st_mtime_ns))
+
+    return sig
+
+
+def _file_hash(fl):
+
+    h = hashlib.sha1()
+    with open(fl, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _folder_hash(folder):
+
+    return hashlib.sha1(folder.encode()).hexdigest()[:16]
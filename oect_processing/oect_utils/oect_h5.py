@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar HDF5 store for processed devices, as an alternative to pickling
+
+Usage:
+
+    >> oect_h5.save_h5(device, r'path_to_device\\uC_data.h5')
+    >> summary = oect_h5.load_summary(r'path_to_device\\uC_data.h5')  # DataFrame, one row per pixel
+    >> device = oect_h5.load_h5(r'path_to_device\\uC_data.h5')  # pixels are read on first access
+    >> device.pixels['01_uC'].transfers
+
+File layout:
+
+    /summary                one dataset per column, one row per pixel
+    /device                 uC* arrays (WdL, Vg_Vt, gms, uC, ...) as datasets
+    /pixels/<name>          one group per pixel
+        <DataFrame attr>        group with 'index' and 'values' datasets
+        profiler                group with the records of oect_profile.Profiler
+        <dict of DataFrames>    group with one DataFrame group per key
+        sweeps                  group with the 'v' and 'data' arrays of oect_sweeps.Sweeps
+        <ndarray attr>          dataset
+        attrs['attributes']     JSON of the remaining scalars, lists and dicts
+
+@author: Raj
+"""
+
+import h5py
+import json
+import numpy as np
+import os
+import pandas as pd
+from collections.abc import Mapping
+
+import oect_processing as oectp
+from .oect_profile import Profiler
+from .oect_sweeps import Sweeps
+
+H5_VERSION = 2
+
+SUMMARY = ['W', 'L', 'd', 'WdL', 'Vt', 'mobility', 'num_transfers', 'num_outputs']
+
+
+def save_h5(dv, filename=None):
+    '''
+    Saves an OECTDevice to a single HDF5 file
+
+    dv : OECTDevice
+        The processed device
+    filename : str, optional
+        Defaults to uC_data.h5 in the device folder
+
+    Returns
+    -------
+    filename : str
+    '''
+    if not filename:
+        filename = os.path.join(dv.path, 'uC_data.h5')
+
+    with h5py.File(filename, 'w') as f:
+
+        f.attrs['version'] = H5_VERSION
+        f.attrs['path'] = dv.path
+        f.attrs['pixels'] = json.dumps(list(dv.pixels))
+
+        f.create_group('summary')
+        for k, v in summary(dv.pixels).reset_index().items():
+            if v.dtype == object:
+                f['summary'].create_dataset(k, data=v.astype(str).values.astype(object),
+                                            dtype=h5py.string_dtype())
+            else:
+                f['summary'].create_dataset(k, data=v.values)
+
+        _write_attrs(f.create_group('device'), {**dv.params, 'options': dv.options,
+                                                'failed': dv.failed})
+
+        grp = f.create_group('pixels')
+        for p in dv.pixels:
+            _write_attrs(grp.create_group(p), vars(dv.pixels[p]))
+
+    return filename
+
+
+def load_h5(filename):
+    '''
+    Loads an OECTDevice saved by save_h5. Only the device arrays are read;
+    each pixel is read from the file the first time it is accessed
+
+    filename : str
+
+    Returns
+    -------
+    dv : OECTDevice
+    '''
+    dv = oectp.OECTDevice.__new__(oectp.OECTDevice)
+
+    with h5py.File(filename, 'r') as f:
+
+        dv.path = f.attrs['path']
+        dv.params = _read_attrs(f['device'])
+        pixkeys = json.loads(f.attrs['pixels'])
+
+    dv.options = dv.params.pop('options')
+    dv.failed = dv.params.pop('failed')
+    dv.pixels = LazyPixels(filename, pixkeys)
+
+    dv.L = dv.params['L']
+    dv.WdL = dv.params['WdL']
+    dv.W = dv.params['W']
+    dv.d = dv.params['d']
+    dv.Vg_Vt = dv.params['Vg_Vt']
+    dv.Vt = dv.params['Vt']
+    dv.uC = dv.params['uC']
+    dv.uC_0 = dv.params['uC_0']
+    dv.gms = dv.params['gms']
+
+    # folders are in the summary table, so this does not load the pixels
+    dv.pix_paths = list(load_summary(filename)['folder'])
+
+    return dv
+
+
+def load_summary(filename):
+    '''
+    Reads only the per-pixel summary table of a file saved by save_h5
+
+    Returns
+    -------
+    df : DataFrame
+        Indexed by pixel name, with the folder and the SUMMARY columns
+    '''
+    with h5py.File(filename, 'r') as f:
+        df = {}
+        for k, v in f['summary'].items():
+            df[k] = v.asstr()[()] if h5py.check_string_dtype(v.dtype) else v[()]
+    df = pd.DataFrame(df)
+
+    cols = ['pixel', 'folder'] + SUMMARY + ['peak gm (S)']
+
+    return df[cols].set_index('pixel')
+
+
+def summary(pixels):
+    '''
+    One row per pixel of the scalar results. Vt is the mean of Vts and
+    peak gm is the largest of the transfer curves
+    '''
+    rows = {}
+    for p in pixels:
+
+        pix = pixels[p]
+        rows[p] = {'folder': pix.folder}
+        for k in SUMMARY:
+            rows[p][k] = getattr(pix, k, np.nan)
+        rows[p]['Vt'] = np.nanmean(pix.Vts) if np.size(pix.Vts) else np.nan
+        rows[p]['peak gm (S)'] = np.nanmax(pix.peak_gm) if np.size(pix.peak_gm) else np.nan
+
+    df = pd.DataFrame.from_dict(rows, orient='index')
+    df.index.name = 'pixel'
+
+    return df
+
+
+class LazyPixels(Mapping):
+    '''
+    Read-only dict of the pixels in a file saved by save_h5. A pixel is read
+    into an OECT the first time it is accessed, then kept
+    '''
+
+    def __init__(self, filename, keys):
+
+        self.filename = filename
+        self._keys = list(keys)
+        self._pixels = {}
+
+        return
+
+    def __getitem__(self, key):
+
+        if key not in self._pixels:
+
+            if key not in self._keys:
+                raise KeyError(key)
+
+            pix = oectp.OECT.__new__(oectp.OECT)
+            with h5py.File(self.filename, 'r') as f:
+                attrs = _read_attrs(f['pixels'][key])
+
+            if 'sweeps' not in attrs:  # version 1 files
+                attrs['sweeps'] = Sweeps.from_frames(attrs.pop('output_raw', {}), attrs.pop('transfer_raw', {}))
+                attrs.pop('output', None)
+                attrs.pop('transfer', None)
+
+            pix.__dict__.update(attrs)
+            self._pixels[key] = pix
+
+        return self._pixels[key]
+
+    def __iter__(self):
+
+        return iter(self._keys)
+
+    def __len__(self):
+
+        return len(self._keys)
+
+    def loaded(self):
+        '''
+        Names of the pixels read so far
+        '''
+        return list(self._pixels)
+
+
+def _write_attrs(grp, attrs):
+    '''
+    DataFrames and dicts of DataFrames become groups, numeric arrays become
+    datasets and everything else goes into a JSON attribute
+    '''
+    other = {}
+    for k, v in attrs.items():
+
+        if isinstance(v, pd.DataFrame):
+            _write_frame(grp.create_group(k), v)
+
+        elif isinstance(v, dict) and v and all(isinstance(d, pd.DataFrame) for d in v.values()):
+            sub = grp.create_group(k)
+            sub.attrs['kind'] = 'frames'
+            sub.attrs['keys'] = json.dumps(list(v))
+            for n, d in enumerate(v.values()):
+                _write_frame(sub.create_group(str(n)), d)
+
+        elif isinstance(v, Sweeps):
+            _write_sweeps(grp.create_group(k), v)
+
+        elif isinstance(v, Profiler):
+            _write_profiler(grp.create_group(k), v)
+
+        elif isinstance(v, np.ndarray) and v.dtype.kind in 'biuf':
+            grp.create_dataset(k, data=v)
+
+        else:
+            other[k] = v
+
+    grp.attrs['attributes'] = json.dumps(other, default=_to_json)
+
+    return
+
+
+def _read_attrs(grp):
+
+    attrs = json.loads(grp.attrs['attributes'])
+
+    for k, v in grp.items():
+
+        if isinstance(v, h5py.Dataset):
+            attrs[k] = v[()]
+
+        elif v.attrs['kind'] == 'frames':
+            keys = json.loads(v.attrs['keys'])
+            attrs[k] = {key: _read_frame(v[str(n)]) for n, key in enumerate(keys)}
+
+        elif v.attrs['kind'] == 'sweeps':
+            attrs[k] = _read_sweeps(v)
+
+        elif v.attrs['kind'] == 'profiler':
+            attrs[k] = _read_profiler(v)
+
+        else:
+            attrs[k] = _read_frame(v)
+
+    return attrs
+
+
+def _write_frame(grp, df):
+
+    grp.attrs['kind'] = 'frame'
+    grp.attrs['columns'] = json.dumps(list(df.columns), default=_to_json)
+    grp.attrs['index_name'] = json.dumps(df.index.name)
+    grp.attrs['columns_name'] = json.dumps(df.columns.name)
+    if df.index.dtype.kind in 'biuf':
+        grp.create_dataset('index', data=df.index.values.astype(np.float64))
+    else:  # e.g. the stages of timings
+        grp.create_dataset('index', data=df.index.astype(str).values.astype(object),
+                           dtype=h5py.string_dtype())
+    grp.create_dataset('values', data=df.values.astype(np.float64))
+
+    return
+
+
+def _read_frame(grp):
+
+    index = grp['index']
+    index = index.asstr()[()] if h5py.check_string_dtype(index.dtype) else index[()]
+    df = pd.DataFrame(grp['values'][()], index=index,
+                      columns=json.loads(grp.attrs['columns']))
+    df.index.name = json.loads(grp.attrs['index_name'])
+    df.columns.name = json.loads(grp.attrs['columns_name'])
+
+    return df
+
+
+def _write_sweeps(grp, sw):
+
+    grp.attrs['kind'] = 'sweeps'
+    grp.attrs['columns'] = json.dumps(sw.columns)
+    grp.attrs['sweeps'] = json.dumps(sw.sweeps, default=_to_json)
+    grp.create_dataset('v', data=sw.v)
+    grp.create_dataset('data', data=sw.data)
+
+    return
+
+
+def _read_sweeps(grp):
+
+    sw = Sweeps()
+    sw.v = grp['v'][()]
+    sw.data = grp['data'][()]
+    sw.columns = json.loads(grp.attrs['columns'])
+    sw.sweeps = json.loads(grp.attrs['sweeps'])
+
+    return sw
+
+
+def _write_profiler(grp, prof):
+
+    grp.attrs['kind'] = 'profiler'
+    grp.attrs['profiler'] = json.dumps({'name': prof.name, 'memory': prof.memory, 'log': prof.log,
+                                        'records': prof.records})
+
+    return
+
+
+def _read_profiler(grp):
+
+    attrs = json.loads(grp.attrs['profiler'])
+    prof = Profiler(attrs['name'], memory=attrs['memory'], log=attrs['log'])
+    prof.records = attrs['records']
+
+    return prof
+
+
+def _to_json(obj):
+    '''
+    numpy types to python, anything else (e.g. an OECTCache) to its repr
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+
+    return repr(obj)
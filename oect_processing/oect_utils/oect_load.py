@@ -8,10 +8,16 @@ Created on Thu Aug 23 11:04:47 2018
 import numpy as np
 import os
 import pandas as pd
-from scipy.optimize import curve_fit as cf
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import oect_processing as oectp
+from . import oect_cache
 from . import oect_plot
+from . import oect_profile
+from . import uc_fit
 
 '''
 Wrapper function for generating a uC* plot. This file contains one main function:
@@ -33,13 +39,21 @@ def uC_scale(path='',
              plot=[True, False],
              V_low=False,
              retrace_only=False,
+             gm_batch=False,
+             vt_method='spline',
+             uc_method='ols',
              verbose=True,
              thickness=None,
              d = None,
              capacitance=None,
              c_star=None,
              params = {},
-             options={}):
+             options={},
+             n_jobs=1,
+             executor=None,
+             cache=None,
+             profile=False,
+             profile_log=None):
     '''
     path: str
         string path to folder '.../avg'. Note Windows path are of form r'Path_name'
@@ -55,6 +69,12 @@ def uC_scale(path='',
         Only use the retrace in case trace isn't saturating
     V_low : bool, optional
         Whether to find erroneous "turnover" points when devices break down
+    gm_batch : bool, optional
+        Calculate all the gms of a pixel in one vectorized call (see OECT options)
+    vt_method : str, optional
+        'spline' or 'lstsq', the threshold voltage search (see OECT options)
+    uc_method : str, optional
+        'ols', 'huber' or 'theilsen', the line fit for uC* (see uc_fit.fit_uC)
     verbose: bool, optional
         Print to display
     thickness, d : float, optional
@@ -67,6 +87,19 @@ def uC_scale(path='',
     c_star : float, optional
         in Farad / cm^3 NOTE THE CENTIMETERS^3 units
         This value is calculated from EIS or so
+    n_jobs : int, optional
+        Number of worker processes for loading the pixels. 1 = serial,
+        None or -1 = one per CPU
+    executor : concurrent.futures.Executor, optional
+        An existing pool to run the pixels in, instead of creating one
+    cache : bool, str or oect_cache.OECTCache, optional
+        Reuse processed pixels from an on-disk cache when their files are unchanged
+        True = default cache folder, str = path to a cache folder
+    profile : bool or str, optional
+        Time each processing stage of the pixels and the device. 'memory' also
+        records peak memory. See oect_utils.oect_profile
+    profile_log : str, optional
+        File to append the profiling records to as JSON lines
 
     Returns
     -------
@@ -82,6 +115,12 @@ def uC_scale(path='',
         
         Vg_Vt : ndarray
             threshold voltage shifts for correcting uC* fit
+
+        failed : dict
+            Pixels that could not be processed, with the error message
+
+        timings : DataFrame
+            If profile, calls, time and peak memory of the device-level stages
     
     '''
     if not path:
@@ -98,7 +137,7 @@ def uC_scale(path='',
             if verbose:
                 print('Ignoring', k)
             f.remove(k)
-    filelist = f[:]
+    filelist = sorted(f, key=int)  # deterministic pixel order
     paths = [os.path.join(path, name) for name in filelist]
     pixkeys = [f + '_uC' for f in filelist]
 
@@ -107,13 +146,17 @@ def uC_scale(path='',
         if not os.path.isdir(p):
             paths.remove(p)
 
-    pixels = {}
-    opts = {'V_low': V_low}
+    opts = {'V_low': V_low, 'gm_batch': gm_batch, 'vt_method': vt_method}
+    if profile:
+        opts['profile'] = profile
+    if profile_log:
+        opts['profile_log'] = profile_log
     if any(options):
         for o in options:
             opts[o] = options[o]
     if thickness:
         d = thickness
+    params = dict(params)  # not the shared default
     for k, v in {'d': d, 'capacitance': capacitance, 'c_star': c_star}.items():
         if v:
             params[k] = v
@@ -122,96 +165,55 @@ def uC_scale(path='',
     if type(plot) == bool or len(plot) == 1:
         plot = [plot, plot]
 
-    for p, f in zip(paths, pixkeys):
-
-        if os.listdir(p):
-
-            if verbose:
-                print(p)
-            print(params)
-            dv = loadOECT(p, params, gm_plot=plot, plot=plot[1], options=opts, verbose=verbose)
-            pixels[f] = dv
-
-        else:
+    # skips empty folders
+    pixkeys = [f for p, f in zip(paths, pixkeys) if os.listdir(p)]
+    paths = [p for p in paths if os.listdir(p)]
 
-            pixkeys.remove(f)
+    if verbose:
+        print(params)
+    prof = oect_profile.get_profiler(opts, name=path)
+    with oect_profile.stage(prof, 'pixels'):
+        pixels, failed = load_pixels(paths, pixkeys, params, gm_plot=plot, plot=plot[1],
+                                     options=opts, verbose=verbose, n_jobs=n_jobs,
+                                     executor=executor, cache=cache)
 
     # do uC* graphs, need gm vs W*d/L
-    Wd_L = np.array([])
-    W = np.array([])
-    Vg_Vt = np.array([])  # threshold offset
-    Vt = np.array([])
-    gms = np.array([])
-    mobility = np.array([])
-
     # assumes Length and thickness are fixed
-    uC_dv = {}
-
-    for pixel in pixels:
-
-        if not pixels[pixel].gms.empty:
-
-            ix = len(pixels[pixel].VgVts)
-            Vt = np.append(Vt, pixels[pixel].Vts)
-            Vg_Vt = np.append(Vg_Vt, pixels[pixel].VgVts)
-            gms = np.append(gms, pixels[pixel].gm_peaks['peak gm (S)'].values)
-            W = np.append(W, pixels[pixel].W)
-            mobility = np.append(mobility, pixels[pixel].mobility)
-
-            # appends WdL as many times as there are transfer curves
-            for i in range(len(pixels[pixel].VgVts)):
-                Wd_L = np.append(Wd_L, pixels[pixel].WdL)
-            # remove the trace ()
-            if retrace_only and len(pixels[pixel].VgVts) > 1:
-                Vt = np.delete(Vt, -ix)
-                Vg_Vt = np.delete(Vg_Vt, -ix)
-                gms = np.delete(gms, -ix)
-                Wd_L = np.delete(Wd_L, -ix)
-
-            uC_dv['L'] = pixels[pixel].L
-            uC_dv['d'] = pixels[pixel].d
-
-    # fit functions
-    def line_f(x, a, b):
-
-        return a + b * x
-
-    def line_0(x, b):
-        'no y-offset --> better log-log fits'
-        return b * x
-
-    # * 1e2 to get into right mobility units (cm)
-    uC_0, _ = cf(line_0, Wd_L * Vg_Vt, gms)
-    uC, _ = cf(line_f, Wd_L * Vg_Vt, gms)
-
-    # Create an OECT and add arrays 
-    uC_dv['WdL'] = Wd_L
-    uC_dv['W'] = W
-    uC_dv['Vg_Vt'] = Vg_Vt
-    uC_dv['Vt'] = Vt
-    uC_dv['uC'] = uC
-    uC_dv['uC_0'] = uC_0
-    uC_dv['gms'] = gms
+    with oect_profile.stage(prof, 'uC fit'):
+        uC_dv = uc_fit.collect_pixels(pixels, retrace_only=retrace_only)
+
+        # * 1e2 to get into right mobility units (cm)
+        fit = uc_fit.fit_uC(uC_dv['WdL'] * uC_dv['Vg_Vt'], uC_dv['gms'], method=uc_method)
+        uC_0 = fit['uC_0']
+
+    uC_dv.update(fit)
     uC_dv['folder'] = path
-    uC_dv['mobility'] = mobility
+    uC_dv['failed'] = failed
 
     if plot[0]:
-        fig = oect_plot.plot_uC(uC_dv)
-        fig = oect_plot.plot_uC(uC_dv, average=True, label='avg')
+        with oect_profile.stage(prof, 'plot'):
+            fig = oect_plot.plot_uC(uC_dv)
+            fig = oect_plot.plot_uC(uC_dv, average=True, label='avg')
 
         if verbose:
             print('uC* = ', str(uC_0 * 1e-2), ' F/cm*V*s')
 
+    if prof:
+        uC_dv['timings'] = prof.table()
+
     if verbose:
         print('Vt = ', uC_dv['Vt'])
 
     return pixels, uC_dv
 
 
-def loadOECT(path, params=None, gm_plot=True, plot=True, options={}, verbose=True):
+def loadOECT(path, params=None, gm_plot=True, plot=True, options={}, verbose=True,
+             cache=None):
     """
     Wrapper function for processing OECT data
     params = {W: , L: , d: } for W, L, d of device
+    cache : bool, str or oect_cache.OECTCache, optional
+        Load the processed pixel from an on-disk cache if the files are unchanged
     USAGE:
         device1 = loadOECT(folder_name)
     """
@@ -219,9 +221,13 @@ def loadOECT(path, params=None, gm_plot=True, plot=True, options={}, verbose=Tru
     if not path:
         path = file_open(caption='Select device subfolder')
 
-    device = oectp.OECT(path, params=params, options=options)
-    device.calc_gms()
-    device.thresh()
+    cache = oect_cache.get_cache(cache)
+    if cache:
+        device = cache.load(path, params=params if params else {}, options=options)
+    else:
+        device = oectp.OECT(path, params=params, options=options)
+        device.calc_gms()
+        device.thresh()
 
     scaling = device.WdL  # W *d / L
 
@@ -231,19 +237,86 @@ def loadOECT(path, params=None, gm_plot=True, plot=True, options={}, verbose=Tru
             print(key, ': {:.2f}'.format(np.max(device.gms[key].values * 1000)), 'mS max')
 
     if plot:
-        fig = oect_plot.plot_transfers_gm(device, gm_plot=gm_plot, leakage=True)
-        fig.savefig(path + r'\transfer_leakage.tif', format='tiff')
-        fig = oect_plot.plot_transfers_gm(device, gm_plot=gm_plot, leakage=False)
-        fig.savefig(path + r'\transfer.tif', format='tiff')
+        prof = getattr(device, 'profiler', None)
+
+        figs = {}
+        with oect_profile.stage(prof, 'plot'):
+            figs['transfer_leakage'] = oect_plot.plot_transfers_gm(device, gm_plot=gm_plot, leakage=True)
+            figs['transfer'] = oect_plot.plot_transfers_gm(device, gm_plot=gm_plot, leakage=False)
+            figs['output_leakage'] = oect_plot.plot_outputs(device, leakage=True)
+            figs['output'] = oect_plot.plot_outputs(device, leakage=False)
 
-        fig = oect_plot.plot_outputs(device, leakage=True)
-        fig.savefig(path + r'\output_leakage.tif', format='tiff')
-        fig = oect_plot.plot_outputs(device, leakage=False)
-        fig.savefig(path + r'\output.tif', format='tiff')
+        with oect_profile.stage(prof, 'save'):
+            for name, fig in figs.items():
+                fig.savefig(path + '\\' + name + '.tif', format='tiff')
 
     return device
 
 
+def load_pixels(paths, keys, params=None, gm_plot=True, plot=True, options={},
+                verbose=True, n_jobs=1, executor=None, cache=None):
+    '''
+    Runs loadOECT on a list of pixel folders, optionally in a process pool.
+    Results are returned in the same order as paths regardless of which
+    pixel finishes first. A pixel that raises is reported and skipped.
+
+    paths : list of str
+        Pixel folders
+    keys : list of str
+        Keys for the returned dict, one per path
+    n_jobs : int, optional
+        Number of worker processes. 1 = serial, None or -1 = one per CPU
+    executor : concurrent.futures.Executor, optional
+        An existing pool to submit the pixels to. Overrides n_jobs
+    cache : bool, str or oect_cache.OECTCache, optional
+        On-disk cache of processed pixels, see loadOECT
+
+    Returns
+    -------
+    pixels : dict of OECT
+        The processed pixels, in the order of paths
+    failed : dict
+        key : error message (traceback) for each pixel that failed
+    '''
+    args = (repeat(params), repeat(gm_plot), repeat(plot), repeat(options), repeat(verbose),
+            repeat(oect_cache.get_cache(cache)))
+
+    if executor is not None:
+        results = list(executor.map(_load_pixel, paths, *args))
+    elif n_jobs == 1 or len(paths) < 2:
+        results = list(map(_load_pixel, paths, *args))
+    else:
+        if n_jobs is not None and n_jobs < 1:
+            n_jobs = None  # one worker per CPU
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_load_pixel, paths, *args))
+
+    pixels = {}
+    failed = {}
+    for k, p, (dv, err) in zip(keys, paths, results):
+
+        if err:
+            warnings.warn('Failed to process ' + p + '\n' + err)
+            failed[k] = err
+        else:
+            pixels[k] = dv
+
+    return pixels, failed
+
+
+def _load_pixel(path, params, gm_plot, plot, options, verbose, cache):
+    '''
+    Process-pool worker for load_pixels. Returns (OECT, None) or (None, traceback)
+    '''
+    try:
+        dv = loadOECT(path, params, gm_plot=gm_plot, plot=plot,
+                      options=options, verbose=verbose, cache=cache)
+    except Exception:
+        return None, traceback.format_exc()
+
+    return dv, None
+
+
 def file_open(caption='Select folder'):
     '''
     File dialog if path not given in load commands
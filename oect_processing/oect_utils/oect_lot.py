@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Processing of a whole lot: every device folder under a root folder
+
+Usage:
+
+    >> lot = oect_lot.Lot(r'path_to_lot', params={'d': 40e-9}, n_jobs=-1)
+    >> results, fits = lot.run()
+    >> results.loc['device_A']  # one row per pixel, as oect_h5.summary
+    >> fits['uC_0']  # one row per device
+    >> lot.devices['device_A'].plot_uc()
+
+A device folder is any folder under root with pixel subfolders (01, 02, ...)
+as for uC_scale, so a lot can be nested (root/batch/device/01). All the
+pixels of every device are submitted to one worker pool, rather than one
+device after the other.
+
+Calling run() again only processes pixels whose .txt or .cfg files changed
+(see oect_cache.folder_signature), and only refits the devices they belong
+to. Pass cache to also keep the pixels between sessions (see oect_cache).
+
+@author: Raj
+"""
+
+import os
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import oect_processing as oectp
+from . import oect_cache
+from . import oect_load
+from .oect_h5 import summary
+
+FITS = ['pixels', 'failed', 'uC_0', 'uC_0_err', 'uC', 'uC_err', 'Vt']
+
+
+class Lot:
+    '''
+    Processes every device folder under a root folder in one shared pool
+
+    Parameters
+    ----------
+    root : str
+        Folder containing the device folders, at any depth
+    params : dict, optional
+        Passed to each OECT, e.g. {'d': 40e-9}
+    options : dict, optional
+        Passed to each OECT, e.g. {'gm_batch': True}.
+        'retrace_only' and 'uc_method' are used for the uC* fits, see OECTDevice
+    n_jobs : int, optional
+        Number of worker processes for the pixels. 1 = serial, None or -1 = one per CPU
+    executor : concurrent.futures.Executor, optional
+        An existing pool to submit the pixels to. Overrides n_jobs
+    cache : bool, str or oect_cache.OECTCache, optional
+        On-disk cache of processed pixels, see loadOECT
+    verbose : bool, optional
+
+    Attributes
+    ----------
+    devices : dict
+        Device name (path relative to root) : OECTDevice, or None for devices
+        with fewer than two processed pixels
+    pixels : dict
+        Device name : dict of processed OECT pixels, keyed as in uC_scale ('01_uC', ...)
+    failed : dict
+        Device name : {pixel : error message} for pixels that could not be processed.
+        They are retried when their files change
+    results : DataFrame
+        One row per pixel, indexed by (device, pixel). See oect_h5.summary
+    fits : DataFrame
+        One row per device with the uC* fits
+    '''
+
+    def __init__(self, root, params={}, options={}, n_jobs=1, executor=None, cache=None,
+                 verbose=False):
+
+        self.root = root
+        self.params = dict(params)
+        self.options = {'V_low': False, 'gm_batch': False, 'vt_method': 'spline',
+                        'retrace_only': False, 'uc_method': 'ols'}
+        self.options.update(options)
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.cache = oect_cache.get_cache(cache)
+        self.verbose = verbose
+
+        self.devices = {}
+        self.pixels = {}
+        self.failed = {}
+        self.results = pd.DataFrame()
+        self.fits = pd.DataFrame(columns=FITS)
+
+        self.cancelled = False
+        self._signatures = {}  # (device, pixel) : folder signature when last processed
+
+        return
+
+    def discover(self):
+        '''
+        Finds the device folders under root
+
+        Returns
+        -------
+        devices : dict
+            Device name : {pixel key : pixel folder}, sorted by name
+        '''
+        devices = {}
+        for folder, subfolders, _ in os.walk(self.root):
+
+            pixels = {name + '_uC': os.path.join(folder, name) for name in sorted(subfolders, key=_pixel_order)
+                      if name.isdigit() and os.listdir(os.path.join(folder, name))}
+
+            if pixels:
+                name = os.path.relpath(folder, self.root)
+                if name == '.':
+                    name = os.path.basename(os.path.normpath(self.root))
+                devices[name] = pixels
+
+            subfolders[:] = [s for s in subfolders if not s.isdigit()]  # not inside pixels
+
+        return {k: devices[k] for k in sorted(devices)}
+
+    def run(self, callback=None, force=False):
+        '''
+        Processes the new and changed pixels of every device, then refits the
+        devices that changed
+
+        callback : function, optional
+            Called as callback(device, pixel, dv, error) as each pixel finishes,
+            dv is None if the pixel failed
+        force : bool, optional
+            Reprocess every pixel, e.g. after changing params or options
+
+        Returns
+        -------
+        results : DataFrame
+            One row per pixel
+        fits : DataFrame
+            One row per device
+        '''
+        self.cancelled = False
+        found = self.discover()
+        changed = set()
+
+        for dev in list(self.pixels):
+            if dev not in found:
+                self._drop(dev)
+                changed.add(dev)
+
+        jobs = []
+        for dev, pixels in found.items():
+
+            self.pixels.setdefault(dev, {})
+            self.failed.setdefault(dev, {})
+
+            for key in list(self.pixels[dev]) + list(self.failed[dev]):
+                if key not in pixels:
+                    self.pixels[dev].pop(key, None)
+                    self.failed[dev].pop(key, None)
+                    self._signatures.pop((dev, key), None)
+                    changed.add(dev)
+
+            for key, folder in pixels.items():
+                sig = oect_cache.folder_signature(folder)
+                if force or sig != self._signatures.get((dev, key)):
+                    jobs.append((dev, key, folder, sig))
+
+        for (dev, key, folder, sig), (dv, err) in self._process(jobs):
+
+            if err:
+                warnings.warn('Failed to process ' + folder + '\n' + err)
+                self.pixels[dev].pop(key, None)
+                self.failed[dev][key] = err
+            else:
+                self.pixels[dev][key] = dv
+                self.failed[dev].pop(key, None)
+
+            self._signatures[(dev, key)] = sig
+            changed.add(dev)
+
+            if callback:
+                callback(dev, key, dv, err)
+
+        for dev in found:
+            self.pixels[dev] = {k: self.pixels[dev][k] for k in sorted(self.pixels[dev], key=_pixel_order)}
+            if dev in changed or dev not in self.devices:
+                self._fit(dev)
+
+        self._tables()
+
+        return self.results, self.fits
+
+    def cancel(self):
+        '''
+        Stops run() after the pixels already running. The others are processed by the next run()
+        '''
+        self.cancelled = True
+
+        return
+
+    def _process(self, jobs):
+        '''
+        Yields (job, (OECT, error)) as each pixel finishes, in one pool for all devices
+        '''
+        args = (self.params, False, False, {k: v for k, v in self.options.items()
+                                            if k not in ['retrace_only', 'uc_method']},
+                self.verbose, self.cache)
+
+        if self.executor is None and (self.n_jobs == 1 or len(jobs) < 2):
+            for job in jobs:
+                if self.cancelled:
+                    return
+                yield job, oect_load._load_pixel(job[2], *args)
+            return
+
+        pool = self.executor
+        if pool is None:
+            n_jobs = self.n_jobs
+            if n_jobs is not None and n_jobs < 1:
+                n_jobs = None  # one worker per CPU
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+
+        futures = {pool.submit(oect_load._load_pixel, job[2], *args): job for job in jobs}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception:  # e.g. a worker process died
+                    yield futures[future], (None, traceback.format_exc())
+
+                if self.cancelled:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+            if pool is not self.executor:
+                pool.shutdown(wait=True)
+
+        return
+
+    def _fit(self, dev):
+        '''
+        uC* fit of a device from its processed pixels, as in DeviceWatcher
+        '''
+        pixels = self.pixels[dev]
+        if len(pixels) < 2:
+            self.devices[dev] = None
+            return
+
+        path = os.path.dirname(next(iter(pixels.values())).folder)
+        try:
+            device = oectp.OECTDevice(path, pixels=dict(pixels),
+                                      options={'retrace_only': self.options['retrace_only'],
+                                               'uc_method': self.options['uc_method']})
+        except Exception:
+            warnings.warn('Failed to fit ' + dev + '\n' + traceback.format_exc())
+            self.devices[dev] = None
+            return
+
+        device.params['folder'] = path
+        device.failed = dict(self.failed[dev])
+        self.devices[dev] = device
+
+        return
+
+    def _drop(self, dev):
+
+        for k in [self.devices, self.pixels, self.failed]:
+            k.pop(dev, None)
+        for key in [k for k in self._signatures if k[0] == dev]:
+            del self._signatures[key]
+
+        return
+
+    def _tables(self):
+        '''
+        Builds the combined pixel table and the device fits table
+        '''
+        frames = {dev: summary(pixels) for dev, pixels in self.pixels.items() if pixels}
+        self.results = pd.concat(frames, names=['device']) if frames else pd.DataFrame()
+
+        rows = {}
+        for dev in self.pixels:
+            device = self.devices.get(dev)
+            rows[dev] = [len(self.pixels[dev]), len(self.failed[dev])]
+            if device is None:
+                rows[dev] += [np.nan] * (len(FITS) - 2)
+            else:
+                rows[dev] += [device.uC_0[0], device.params['uC_0_err'][0], device.uC[1],
+                              device.params['uC_err'][1], np.nanmean(device.Vt)]
+
+        self.fits = pd.DataFrame.from_dict(rows, orient='index', columns=FITS)
+        self.fits.index.name = 'device'
+
+        return
+
+
+def _pixel_order(name):
+
+    return int(name.split('_')[0]) if name.split('_')[0].isdigit() else -1
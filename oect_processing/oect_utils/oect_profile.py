@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-stage timing of the OECT pipeline
+
+Usage:
+
+    >> dv = oect_processing.OECT(r'path_to_pixel', options={'profile': True})
+    >> dv.calc_gms(); dv.thresh()
+    >> dv.timings  # calls, seconds and peak memory per stage
+
+    >> device = oect_processing.OECTDevice(r'path_to_device', options={'profile': 'memory',
+                                                                      'profile_log': r'profile.jsonl'})
+    >> device.timings  # per pixel, plus the device-level stages
+
+options['profile'] : False (default), True to record wall time and call counts,
+    or 'memory' to also record the peak traced memory of each stage (slower, uses tracemalloc)
+options['profile_log'] : str, optional
+    File to append one JSON line per stage call to, e.g. for collecting lots
+
+Stages are 'read', 'metadata', 'reverse', 'gm', 'Vt', 'peak', 'plot' and 'save'
+for a pixel and 'pixels', 'uC fit' and 'plot' for a device. 'peak' runs
+inside 'Vt', and 'pixels' contains the stages of every pixel processed in
+this process. The peak memory of a stage includes that of the stages nested in it.
+
+When profiling is off the stages cost one function call each.
+
+@author: Raj
+"""
+
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+COLUMNS = ['calls', 'seconds', 'peak (MB)']
+
+_NULL = nullcontext()
+
+_PEAKS = []  # highest traced peak of each enclosing stage, before a nested stage reset it
+
+
+class Profiler:
+    '''
+    Accumulates the calls, wall time and (optionally) peak memory of named stages
+
+    Parameters
+    ----------
+    name : str, optional
+        Identifies the profiled object (e.g. the pixel folder) in the JSON log
+    memory : bool, optional
+        Record the peak memory traced during each stage
+    log : str, optional
+        File to append a JSON line to after every stage call
+
+    Attributes
+    ----------
+    records : dict
+        stage : [calls, seconds, peak bytes]
+    '''
+
+    def __init__(self, name='', memory=False, log=None):
+
+        self.name = name
+        self.memory = memory
+        self.log = log
+        self.records = {}
+
+        return
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager timing the code inside it as stage name
+        '''
+        started = False
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            if _PEAKS:  # keep the enclosing stage's peak so far
+                _PEAKS[-1] = max(_PEAKS[-1], tracemalloc.get_traced_memory()[1])
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            _PEAKS.append(0)
+
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - tic
+            peak = None
+            if self.memory:
+                peak = max(_PEAKS.pop(), tracemalloc.get_traced_memory()[1])
+                if _PEAKS:  # the enclosing stage's peak includes this one
+                    _PEAKS[-1] = max(_PEAKS[-1], peak)
+                peak -= base
+                if started:
+                    tracemalloc.stop()
+
+            self.add(name, seconds, peak)
+
+    def add(self, name, seconds, peak=None):
+        '''
+        Records one call of a stage timed elsewhere
+        '''
+        rec = self.records.setdefault(name, [0, 0.0, 0])
+        rec[0] += 1
+        rec[1] += seconds
+        if peak is not None:
+            rec[2] = max(rec[2], peak)
+
+        if self.log:
+            line = {'name': self.name, 'stage': name, 'seconds': seconds, 'time': time.time(),
+                    'pid': os.getpid()}
+            if peak is not None:
+                line['peak_mb'] = peak / 1e6
+            with open(self.log, 'a') as f:
+                f.write(json.dumps(line) + '\n')
+
+        return
+
+    def table(self):
+        '''
+        DataFrame of calls, seconds and peak (MB) per stage, in the order first run
+        '''
+        df = pd.DataFrame([[c, s, p / 1e6 if self.memory else float('nan')]
+                           for c, s, p in self.records.values()],
+                          index=pd.Index(list(self.records), name='stage'), columns=COLUMNS)
+
+        return df
+
+
+def get_profiler(options, name=''):
+    '''
+    Profiler for options['profile'] and options['profile_log'], or None if profiling is off
+    '''
+    profile = options.get('profile', False)
+    if not profile:
+        return None
+
+    return Profiler(name, memory=(profile == 'memory'), log=options.get('profile_log'))
+
+
+def stage(profiler, name):
+    '''
+    profiler.stage(name), or a no-op context if profiler is None (profiling off)
+    '''
+    if isinstance(profiler, Profiler):
+        return profiler.stage(name)
+
+    return _NULL
+
+
+def table(profiler):
+    '''
+    profiler.table(), or an empty table if profiling was off
+    '''
+    if isinstance(profiler, Profiler):
+        return profiler.table()
+
+    return pd.DataFrame(columns=COLUMNS, index=pd.Index([], name='stage'))
+
+
+def timed(name):
+    '''
+    Method decorator timing each call as stage name of the object's profiler attribute
+    '''
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with stage(getattr(self, 'profiler', None), name):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
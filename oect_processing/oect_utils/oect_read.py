@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Fast reader for the tab-delimited transfer and output curve text files
+
+Usage:
+
+    >> v, data, columns = oect_read.read_curve(r'path_to_transfer.txt', 'V_G')
+    >> v, data, columns, metadata = oect_read.read_file(r'path_to_transfer.txt', 'V_G')
+
+The files consist of a header row (V_G or V_DS, then I_DS (A), I_DS Error (A),
+I_G (A), I_G Error (A)), the data block, then a few rows of metadata
+(V_DS =, Width/um =, etc.). read_file reads each file once and returns both the
+data and the metadata; read_curve drops the metadata rows as junk.
+
+@author: Raj
+"""
+
+import io
+import numpy as np
+import pandas as pd
+
+# first character of a data row
+_NUMERIC = tuple('-+.0123456789')
+
+# metadata row markers and the key they are stored under
+_METADATA = {'V_DS =': 'V_DS', 'V_G =': 'V_G', 'Width/um': 'Width/um', 'Length/um': 'Length/um'}
+
+
+def read_curve(path, voltage='V_G'):
+    '''
+    Reads a single transfer or output curve into float64 arrays.
+
+    Junk rows (blank lines and metadata) are dropped before parsing, and the
+    remaining block is parsed in one call to np.loadtxt. Falls back to the
+    pandas C parser if the block has malformed rows.
+
+    path : str or file-like
+        Path to the .txt file, or an open text buffer positioned at the header
+
+    voltage : str, optional
+        Name of the swept voltage column, 'V_G' for transfer and 'V_DS' for output
+
+    Returns
+    -------
+    v : ndarray
+        Swept voltage, 1D
+    data : ndarray
+        Remaining columns, 2D of shape (len(v), len(columns))
+    columns : list of str
+        Column names for data (e.g. 'I_DS (A)', 'I_DS Error (A)', ...)
+    '''
+    v, data, columns, _ = read_file(path, voltage)
+
+    return v, data, columns
+
+
+def read_file(path, voltage='V_G'):
+    '''
+    Reads a transfer or output curve and its metadata in a single pass over
+    the file. The data rows are handed straight to the numeric parser and
+    only the remaining (non-data) rows are scanned for metadata.
+
+    path : str or file-like
+        Path to the .txt file, or an open text buffer positioned at the header
+
+    voltage : str, optional
+        Name of the swept voltage column, 'V_G' for transfer and 'V_DS' for output
+
+    Returns
+    -------
+    v, data, columns :
+        As in read_curve
+    metadata : dict
+        Any of 'V_DS', 'V_G', 'Width/um', 'Length/um' found in the file
+    '''
+    if hasattr(path, 'readline'):
+        header, lines, other = _split_rows(path)
+    else:
+        with open(path) as h:
+            header, lines, other = _split_rows(h)
+
+    metadata = _parse_metadata(other)
+
+    if voltage not in header:
+        raise KeyError(voltage)
+
+    try:
+        data = np.loadtxt(lines, delimiter='\t', usecols=range(len(header)),
+                          dtype=np.float64, ndmin=2)
+    except ValueError:
+        data = _read_pandas(lines, header, voltage)
+
+    if not data.size:
+        data = np.empty((0, len(header)))
+
+    x = header.index(voltage)
+    columns = header[:x] + header[x + 1:]
+
+    return data[:, x].copy(), np.delete(data, x, axis=1), columns, metadata
+
+
+def read_metadata(path):
+    '''
+    Returns the metadata dict of a file without parsing the data
+    '''
+    with open(path) as h:
+        metadata = _parse_metadata(h)
+
+    return metadata
+
+
+def _split_rows(h):
+    '''
+    Splits an open file into the header row, data rows and all other rows
+    '''
+    header = h.readline()
+    lines = []
+    other = [header]
+    for ln in h:
+        if ln.startswith(_NUMERIC):
+            lines.append(ln)
+        else:
+            other.append(ln)
+
+    return header.rstrip('\r\n').split('\t'), lines, other
+
+
+def _parse_metadata(lines):
+    '''
+    Extracts V_DS, V_G, Width and Length from the metadata rows
+    '''
+    metadata = {}
+    for ln in lines:
+        for marker, key in _METADATA.items():
+            if marker in ln:
+                metadata[key] = float(ln.split()[-1])
+
+    return metadata
+
+
+def _read_pandas(lines, header, voltage):
+    '''
+    Slower fallback for rows np.loadtxt cannot parse. Rows without a numeric
+    voltage are dropped as junk, other non-numeric entries become NaN
+    '''
+    df = pd.read_csv(io.StringIO(''.join(lines)), sep='\t', header=None,
+                     names=header, usecols=range(len(header)), engine='c')
+    df = df.apply(pd.to_numeric, errors='coerce')
+    df = df.loc[df[voltage].notnull()]
+
+    return df.to_numpy(dtype=np.float64)
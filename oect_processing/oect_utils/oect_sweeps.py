@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of the output and transfer sweeps of an OECT pixel
+
+Usage:
+
+    >> dv = oect_processing.OECT(r'path_to_pixel')
+    >> dv.sweeps.table()  # one row per sweep: kind, direction, bias, rows
+    >> dv.sweeps.nbytes
+    >> dv.output['-0.5_fwd']  # DataFrame view over dv.sweeps
+
+Every data file is stored once: its voltages are appended to one contiguous
+array v, and its current columns (I_DS, I_DS Error, I_G, I_G Error) as rows of
+one 2-D array data. The files added are joined into v and data in a single
+copy when they are next accessed. A sweep is a range of rows of a file, so the forward and
+reverse halves of an output curve share the rows, and the turnaround point.
+
+OECT.output, output_raw, transfer and transfer_raw are dicts of DataFrames
+built over slices of these arrays, without copying the currents. The dicts
+are built when first accessed and kept until the next file is added.
+
+@author: Raj
+"""
+
+import numpy as np
+import pandas as pd
+
+DROP = ['I_DS Error (A)', 'I_G (A)', 'I_G Error (A)']  # not in the 'clean' output and transfer
+
+KINDS = ['output', 'transfer']
+
+INFO = ['kind', 'direction', 'bias', 'start', 'stop', 'points']
+
+
+class Sweeps:
+    '''
+    Output and transfer sweeps stored in one voltage array and one 2-D current array
+
+    Attributes
+    ----------
+    v : ndarray
+        Voltage of every row (V_DS for outputs, V_G for transfers)
+    data : ndarray
+        2-D, one row per voltage and one column per entry in columns.
+        NaN where a file did not have that column
+    columns : list of str
+        Column names of data, e.g. 'I_DS (A)', 'I_G (A)'
+    sweeps : dict
+        kind : {key : sweep}, in the order added. Each sweep is a dict of
+        direction ('fwd', 'bwd', or 'both' for a whole transfer file),
+        bias (V_G of an output, V_DS of a transfer), start and stop rows, and
+        cols, the positions in columns of the file's columns
+    '''
+
+    def __init__(self):
+
+        self.columns = []
+        self.sweeps = {k: {} for k in KINDS}
+
+        self._v = np.empty(0)
+        self._data = np.empty((0, 0))
+        self._rows = 0  # including the pending blocks
+        self._pending = []  # (v, data) added since v and data were last joined
+        self._frames = {}  # (kind, raw) : dict of DataFrames
+
+        return
+
+    @property
+    def v(self):
+        self._join()
+        return self._v
+
+    @v.setter
+    def v(self, v):
+        self._join()
+        self._v = v
+        self._rows = len(v)
+
+    @property
+    def data(self):
+        self._join()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._join()
+        self._data = data
+
+    def add(self, kind, v, data, columns, sweeps, bias=np.nan):
+        '''
+        Appends the rows of one data file and registers its sweeps.
+        A sweep with an existing key replaces it, keeping its position
+
+        kind : str
+            'output' or 'transfer'
+        v, data, columns :
+            As returned by oect_read.read_file
+        sweeps : list of tuple
+            (key, start, stop, direction), with start and stop rows of this file
+        bias : float, optional
+            Gate voltage of an output curve or drain voltage of a transfer curve
+        '''
+        if kind not in KINDS:
+            raise ValueError('kind must be one of ' + str(KINDS))
+
+        missing = [c for c in DROP if c not in columns]
+        if missing:
+            raise KeyError(str(missing) + ' not found in axis')
+
+        for c in columns:
+            if c not in self.columns:
+                self.columns.append(c)  # earlier rows are NaN-padded in _join
+
+        cols = [self.columns.index(c) for c in columns]
+        block = np.asarray(data, dtype=np.float64)
+        if cols != list(range(len(self.columns))):
+            block = np.full((len(v), len(self.columns)), np.nan)
+            block[:, cols] = data
+
+        # joined once on the next access, rather than copying every row per file
+        offset = self._rows
+        self._pending.append((np.asarray(v, dtype=np.float64), block))
+        self._rows += len(v)
+
+        for key, start, stop, direction in sweeps:
+            self.sweeps[kind][key] = {'direction': direction, 'bias': bias, 'start': offset + start,
+                                      'stop': offset + stop, 'cols': cols}
+
+        self._frames = {}
+
+        return
+
+    def keys(self, kind):
+        '''
+        Keys of the sweeps of a kind, in the order added
+        '''
+        return list(self.sweeps[kind])
+
+    def frames(self, kind, raw=False):
+        '''
+        dict of DataFrames, one per sweep, indexed by voltage.
+        The values are views of data, not copies
+
+        raw : bool, optional
+            Keep every column. Otherwise the DROP columns are left out
+        '''
+        if (kind, raw) not in self._frames:
+
+            drop = [self.columns.index(c) for c in DROP if c in self.columns]
+            frames = {}
+            for key, sw in self.sweeps[kind].items():
+
+                cols = sw['cols'] if raw else [c for c in sw['cols'] if c not in drop]
+                index = pd.Index(self.v[sw['start']:sw['stop']])
+                frames[key] = pd.DataFrame(self.data[sw['start']:sw['stop'], _columns(cols)], index=index,
+                                           columns=[self.columns[c] for c in cols], copy=False)
+
+            self._frames[(kind, raw)] = frames
+
+        return self._frames[(kind, raw)]
+
+    def table(self):
+        '''
+        DataFrame of the sweep metadata, one row per sweep
+        '''
+        rows = [[kind, sw['direction'], sw['bias'], sw['start'], sw['stop'], sw['stop'] - sw['start']]
+                for kind in KINDS for sw in self.sweeps[kind].values()]
+        keys = [key for kind in KINDS for key in self.sweeps[kind]]
+
+        return pd.DataFrame(rows, index=pd.Index(keys, name='sweep'), columns=INFO)
+
+    @property
+    def nbytes(self):
+        ''' Bytes used by the voltage and current arrays '''
+        return self.v.nbytes + self.data.nbytes
+
+    @classmethod
+    def from_frames(cls, output_raw={}, transfer_raw={}):
+        '''
+        Sweeps from the dicts of DataFrames that OECT used to store.
+        Each DataFrame is stored as its own rows
+        '''
+        sw = cls()
+        for kind, frames in zip(KINDS, [output_raw, transfer_raw]):
+            for key, df in frames.items():
+
+                name, suffix = key.rsplit('_', 1)
+                direction = suffix if suffix in ['fwd', 'bwd'] else 'both'
+                sw.add(kind, df.index.values, df.values, list(df.columns), [(key, 0, len(df), direction)],
+                       bias=_float(name))
+
+        return sw
+
+    def _join(self):
+        '''
+        Appends the pending blocks to v and data in one allocation each
+        '''
+        if not self._pending:
+            return
+
+        v = [self._v] + [b[0] for b in self._pending]
+        data = np.full((self._rows, len(self.columns)), np.nan)
+        row = 0
+        for block in [self._data] + [b[1] for b in self._pending]:
+            data[row:row + len(block), :block.shape[1]] = block
+            row += len(block)
+
+        self._v = np.concatenate(v)
+        self._data = data
+        self._pending = []
+
+        return
+
+    def __getstate__(self):
+
+        self._join()
+        state = self.__dict__.copy()
+        state['_frames'] = {}  # rebuilt on access
+
+        return state
+
+    def __setstate__(self, state):
+
+        if 'v' in state:  # pickled before the pending blocks
+            state['_v'], state['_data'] = state.pop('v'), state.pop('data')
+            state['_rows'], state['_pending'] = len(state['_v']), []
+        self.__dict__.update(state)
+
+        return
+
+
+def assemble(curves, names, grid=None):
+    '''
+    Builds a wide DataFrame with one column per curve in a single construction
+
+    curves : list of (x, y) arrays
+    names : list of str
+        Column names, may repeat
+    grid : array, optional
+        Index of the table. Defaults to the x of the first curve
+
+    Returns
+    -------
+    df : DataFrame
+        Empty if there are no curves
+    '''
+    if not curves:
+        return pd.DataFrame()
+
+    grid, values = align(curves, grid)
+
+    return pd.DataFrame(values, index=grid, columns=names)
+
+
+def align(curves, grid=None):
+    '''
+    Linearly interpolates every curve onto a shared voltage grid at once.
+    Curves whose x is the grid are copied as they are, and the others are
+    exact wherever they were measured at a grid voltage. NaN outside the
+    voltage range of a curve
+
+    curves : list of (x, y) arrays
+        x in any order, e.g. a reverse sweep
+    grid : array, optional
+        Defaults to the x of the first curve
+
+    Returns
+    -------
+    grid : ndarray
+    values : ndarray
+        2-D, (len(grid), len(curves))
+    '''
+    grid = np.asarray(curves[0][0] if grid is None else grid, dtype=np.float64)
+    values = np.full((len(grid), len(curves)), np.nan)
+
+    other = []
+    for n, (x, y) in enumerate(curves):
+        if np.array_equal(x, grid):
+            values[:, n] = y
+        elif len(x):
+            other.append(n)
+
+    if not other:
+        return grid, values
+
+    # one row per curve, sorted and padded with the last point
+    lengths = np.array([len(curves[n][0]) for n in other])
+    cols = np.arange(lengths.max())
+    pad = np.minimum(cols, lengths[:, None] - 1)  # (curves, points)
+
+    X = np.empty(pad.shape)
+    Y = np.empty(pad.shape)
+    for r, n in enumerate(other):
+        x, y = np.asarray(curves[n][0], dtype=np.float64), np.asarray(curves[n][1], dtype=np.float64)
+        order = np.argsort(x, kind='stable')[pad[r]]
+        X[r], Y[r] = x[order], y[order]
+
+    # offset each row past the previous one, so one searchsorted finds every left neighbour
+    lo = min(np.nanmin(X), np.nanmin(grid))
+    span = max(np.nanmax(X), np.nanmax(grid)) - lo + 1
+    offset = span * np.arange(len(other))[:, None]
+    left = np.searchsorted((X - lo + offset).ravel(), (grid[None, :] - lo + offset).ravel(), side='right')
+    left = left.reshape(len(other), len(grid)) - 1 - np.arange(len(other))[:, None] * X.shape[1]
+
+    inside = (left >= 0) & (grid[None, :] <= X[:, -1:])
+    left = np.clip(left, 0, X.shape[1] - 1)
+    right = np.minimum(left + 1, lengths[:, None] - 1)
+
+    rows = np.arange(len(other))[:, None]
+    x0, x1, y0, y1 = X[rows, left], X[rows, right], Y[rows, left], Y[rows, right]
+    dx = np.where(x1 > x0, x1 - x0, 1)
+    t = np.where(x1 > x0, (grid[None, :] - x0) / dx, 0)
+    interp = np.where(t == 0, y0, y0 + t * (y1 - y0))
+
+    values[:, other] = np.where(inside, interp, np.nan).T
+
+    return grid, values
+
+
+def _columns(cols):
+    '''
+    Slice for consecutive column positions, so that indexing returns a view
+    '''
+    if cols and cols == list(range(cols[0], cols[-1] + 1)):
+        return slice(cols[0], cols[-1] + 1)
+
+    return cols
+
+
+def _float(s):
+
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
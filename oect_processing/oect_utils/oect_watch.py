@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental processing of a device folder while it is being measured
+
+Usage:
+
+    >> watcher = oect_watch.DeviceWatcher(r'path_to_device', params={'d': 40e-9})
+    >> watcher.watch(callback=lambda w, changes: print(changes, w.device.uC_0))
+
+or poll from your own loop (e.g. a GUI timer):
+
+    >> changes = watcher.poll()
+    >> watcher.pixels, watcher.device
+
+Each poll compares the .txt and .cfg files of every pixel subfolder (01, 02, ...)
+with the previous poll (see oect_cache.folder_signature). Only pixels that
+changed are processed:
+
+    new pixel folder          loaded as in uC_scale
+    new data files only       parsed with OECT.add_files, then gms and Vt refit
+    changed or deleted files  pixel reloaded from scratch
+    changed config            pixel reloaded from scratch
+
+After any change the device-level uC* fit is redone from the pixels in memory.
+Files modified less than `settle` seconds ago are assumed to still be written
+and are left for a later poll.
+
+@author: Raj
+"""
+
+import os
+import time
+import traceback
+import warnings
+
+import oect_processing as oectp
+from . import oect_cache
+from . import oect_load
+from .oect_lot import _pixel_order
+
+
+class DeviceWatcher:
+    '''
+    Polls a device folder and keeps its processed pixels and uC* fit up to date
+
+    Parameters
+    ----------
+    path : str
+        Device folder, containing one subfolder per pixel as for uC_scale
+    params : dict, optional
+        Passed to each OECT, e.g. {'d': 40e-9}
+    options : dict, optional
+        Passed to each OECT, e.g. {'gm_batch': True}
+    retrace_only : bool, optional
+        See uC_scale
+    uc_method : str, optional
+        'ols', 'huber' or 'theilsen', see uc_fit.fit_uC
+    settle : float, optional
+        Seconds a file must be unmodified before it is read
+    verbose : bool, optional
+
+    Attributes
+    ----------
+    pixels : dict of OECT
+        Processed pixels, keyed as in uC_scale ('01_uC', ...)
+    failed : dict
+        Pixels that could not be processed, with the error message.
+        They are retried when their files change
+    device : OECTDevice
+        Device-level uC* fit of the current pixels, None until two pixels are processed
+    '''
+
+    def __init__(self, path, params={}, options={}, retrace_only=False, uc_method='ols',
+                 settle=1.0, verbose=False):
+
+        self.path = path
+        self.params = dict(params)
+        self.options = {'V_low': False, 'gm_batch': False, 'vt_method': 'spline'}
+        self.options.update(options)
+        self.retrace_only = retrace_only
+        self.uc_method = uc_method
+        self.settle = settle
+        self.verbose = verbose
+
+        self.pixels = {}
+        self.failed = {}
+        self.device = None
+
+        self._signatures = {}  # pixel key : folder signature when last processed
+
+        return
+
+    def poll(self):
+        '''
+        Processes any pixels whose files changed since the last poll
+
+        Returns
+        -------
+        changes : dict
+            pixel key : 'loaded', 'added', 'reloaded', 'removed' or 'failed'
+        '''
+        changes = {}
+        folders = self._pixel_folders()
+
+        for key in list(self._signatures):
+            if key not in folders:
+                self.pixels.pop(key, None)
+                self.failed.pop(key, None)
+                del self._signatures[key]
+                changes[key] = 'removed'
+
+        for key, folder in folders.items():
+
+            sig = oect_cache.folder_signature(folder)
+            if not sig or sig == self._signatures.get(key) or not self._settled(sig):
+                continue
+
+            old = self._signatures.get(key)
+            new_files = _added_files(old, sig)
+
+            try:
+                if key in self.pixels and new_files is not None:
+                    dv = self.pixels[key]
+                    dv.add_files([os.path.join(folder, name) for name in new_files])
+                    dv.calc_gms()
+                    dv.thresh()
+                    changes[key] = 'added'
+                else:
+                    self.pixels[key] = oect_load.loadOECT(folder, dict(self.params), plot=False,
+                                                          options=dict(self.options), verbose=self.verbose)
+                    changes[key] = 'reloaded' if old else 'loaded'
+
+                self.failed.pop(key, None)
+
+            except Exception:
+                err = traceback.format_exc()
+                warnings.warn('Failed to process ' + folder + '\n' + err)
+                self.pixels.pop(key, None)
+                self.failed[key] = err
+                changes[key] = 'failed'
+
+            self._signatures[key] = sig
+
+        if changes:
+            self.pixels = {k: self.pixels[k] for k in sorted(self.pixels, key=_pixel_order)}
+            self._fit()
+
+        return changes
+
+    def watch(self, callback=None, interval=2.0, timeout=None):
+        '''
+        Polls every interval seconds until timeout (None = until interrupted)
+
+        callback : function, optional
+            Called as callback(watcher, changes) after every poll that changed something
+        '''
+        start = time.time()
+
+        try:
+            while timeout is None or time.time() - start < timeout:
+
+                changes = self.poll()
+                if changes:
+                    if self.verbose:
+                        print(changes)
+                    if callback:
+                        callback(self, changes)
+
+                time.sleep(interval)
+
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    def _pixel_folders(self):
+        '''
+        Pixel subfolders with an integer name, as in uC_scale
+        '''
+        folders = {}
+        for name in sorted([n for n in os.listdir(self.path) if n.isdigit()], key=int):
+
+            folder = os.path.join(self.path, name)
+            if os.path.isdir(folder) and os.listdir(folder):
+                folders[name + '_uC'] = folder
+
+        return folders
+
+    def _settled(self, sig):
+        '''
+        True if no data file in the folder was modified in the last settle seconds
+        '''
+        now = time.time_ns()
+        for entry in sig:
+            if len(entry) == 3 and now - entry[2] < self.settle * 1e9:
+                return False
+
+        return True
+
+    def _fit(self):
+        '''
+        Redoes the device-level uC* fit from the processed pixels
+        '''
+        if len(self.pixels) < 2:
+            self.device = None
+            return
+
+        self.device = oectp.OECTDevice(self.path, pixels=dict(self.pixels),
+                                       options={'retrace_only': self.retrace_only,
+                                                'uc_method': self.uc_method})
+        self.device.params['folder'] = self.path
+        self.device.failed = dict(self.failed)
+
+        return
+
+
+def _added_files(old, new):
+    '''
+    Names of the data files in signature new that are not in old, or None if
+    any file in old was changed or deleted or a config file was added (the
+    pixel must then be reloaded)
+    '''
+    if old is None:
+        return None
+
+    new = {entry[0]: entry for entry in new}
+    for entry in old:
+        if new.get(entry[0]) != entry:
+            return None
+
+    added = [name for name in new if name not in {entry[0] for entry in old}]
+    if not all(name.endswith('.txt') for name in added):
+        return None  # new config file
+
+    return added
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+uC* extraction from the peak transconductance of a set of pixels
+
+    gm = uC* * Wd/L * (Vg - Vt)
+
+Usage:
+
+    >> arrays = uc_fit.collect_pixels(pixels)
+    >> fit = uc_fit.fit_uC(arrays['WdL'] * arrays['Vg_Vt'], arrays['gms'])
+    >> fit['uC_0']  # uC* forced through 0,0, in S/m*V (* 1e-2 for F/cm*V*s)
+
+The straight-line fits are solved with the normal equations rather than
+curve_fit, and bootstrap_uC refits many resamples in one vectorized call.
+
+@author: Raj
+"""
+
+import numpy as np
+from scipy import stats
+
+HUBER_K = 1.345  # 95% efficiency for normally-distributed residuals
+
+
+def collect_pixels(pixels, retrace_only=False):
+    '''
+    Stacks the per-pixel results into flat arrays for the uC* fit
+
+    pixels : dict of OECT
+        Processed pixels (calc_gms and thresh already run). Pixels with no gms are skipped
+    retrace_only : bool, optional
+        Only use the retrace (drops the first curve of pixels with more than one)
+
+    Returns
+    -------
+    arrays : dict containing
+        WdL, Vg_Vt, Vt, gms : ndarray
+            One entry per transfer curve
+        W, mobility : ndarray
+            One entry per pixel
+        L, d : float
+            From the last pixel, assumes Length and thickness are fixed
+    '''
+    pixels = [pixels[p] for p in pixels if not pixels[p].gms.empty]
+
+    counts = np.array([len(np.atleast_1d(dv.VgVts)) for dv in pixels], dtype=int)
+    total = np.sum(counts)
+
+    WdL = np.empty(total)
+    Vg_Vt = np.empty(total)
+    Vt = np.empty(total)
+    gms = np.empty(total)
+    keep = np.ones(total, dtype=bool)
+    W = np.empty(len(pixels))
+    mobility = np.empty(len(pixels))
+
+    arrays = {}
+    start = 0
+    for n, (dv, c) in enumerate(zip(pixels, counts)):
+
+        stop = start + c
+        WdL[start:stop] = dv.WdL  # as many times as there are transfer curves
+        Vg_Vt[start:stop] = dv.VgVts
+        Vt[start:stop] = dv.Vts
+        gms[start:stop] = dv.peak_gm
+        W[n] = dv.W
+        mobility[n] = dv.mobility
+
+        # remove the trace
+        if retrace_only and c > 1:
+            keep[start] = False
+
+        arrays['L'] = dv.L
+        arrays['d'] = dv.d
+        start = stop
+
+    arrays['WdL'] = WdL[keep]
+    arrays['W'] = W
+    arrays['Vg_Vt'] = Vg_Vt[keep]
+    arrays['Vt'] = Vt[keep]
+    arrays['gms'] = gms[keep]
+    arrays['mobility'] = mobility
+
+    return arrays
+
+
+def fit_uC(x, gms, weights=None, method='ols'):
+    '''
+    Fits gm = uC * x with and without an intercept, where x = Wd/L * (Vg-Vt)
+
+    x : ndarray
+        Wd/L * (Vg - Vt) for each transfer curve
+    gms : ndarray
+        Peak transconductance for each transfer curve
+    weights : ndarray, optional
+        Per-point weights (e.g. 1/sigma**2) for a weighted least-squares fit
+    method : str, optional
+        'ols' = (weighted) least squares, identical to curve_fit
+        'huber' = Huber-loss fit by iteratively reweighted least squares
+        'theilsen' = median of pairwise slopes, ignores weights
+
+    Returns
+    -------
+    fit : dict containing
+        uC : ndarray
+            [intercept, slope] of the fit with an intercept
+        uC_0 : ndarray
+            [slope] of the fit through 0,0 (better for log-log plots)
+        uC_err, uC_0_err : ndarray
+            1-sigma uncertainties of uC and uC_0
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    gms = np.asarray(gms, dtype=np.float64)
+    w = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    if method == 'ols':
+        uC, uC_err = _wls(x, gms, w, intercept=True)
+        uC_0, uC_0_err = _wls(x, gms, w, intercept=False)
+
+    elif method == 'huber':
+        uC, uC_err = _huber(x, gms, w, intercept=True)
+        uC_0, uC_0_err = _huber(x, gms, w, intercept=False)
+
+    elif method == 'theilsen':
+        slope, intercept, lo, hi = stats.theilslopes(gms, x)
+        uC = np.array([intercept, slope])
+        uC_err = np.array([np.nan, (hi - lo) / (2 * stats.norm.ppf(0.975))])
+
+        ratios = gms[x != 0] / x[x != 0]
+        uC_0 = np.array([np.median(ratios)])
+        uC_0_err = np.array([1.2533 * np.std(ratios) / np.sqrt(len(ratios))])  # s.e. of median
+
+    else:
+        raise ValueError('method must be ols, huber, or theilsen')
+
+    return {'uC': uC, 'uC_0': uC_0, 'uC_err': uC_err, 'uC_0_err': uC_0_err}
+
+
+def bootstrap_uC(x, gms, n_boot=1000, seed=None):
+    '''
+    Bootstrap distribution of the least-squares uC* fits. All resamples are
+    fit at once from sums along the resample axis
+
+    x : ndarray
+        Wd/L * (Vg - Vt) for each transfer curve
+    gms : ndarray
+        Peak transconductance for each transfer curve
+    n_boot : int, optional
+        Number of resamples
+    seed : int, optional
+        For reproducible resampling
+
+    Returns
+    -------
+    uC : ndarray
+        shape (n_boot, 2), [intercept, slope] for each resample
+    uC_0 : ndarray
+        shape (n_boot,), the slope through 0,0 for each resample
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    gms = np.asarray(gms, dtype=np.float64)
+
+    rng = np.random.default_rng(seed)
+    ix = rng.integers(0, len(x), size=(n_boot, len(x)))
+    xb = x[ix]
+    yb = gms[ix]
+
+    n = len(x)
+    sx = xb.sum(axis=1)
+    sy = yb.sum(axis=1)
+    sxx = (xb * xb).sum(axis=1)
+    sxy = (xb * yb).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx ** 2)
+        uC_0 = sxy / sxx
+
+    uC = np.column_stack([(sy - slope * sx) / n, slope])
+
+    return uC, uC_0
+
+
+def _wls(x, y, w, intercept=True):
+    '''
+    Weighted least-squares line via the normal equations
+
+    Returns the parameters ([a, b] or [b]) and their standard errors, scaled by
+    the reduced chi-square as in curve_fit (absolute_sigma=False)
+    '''
+    X = np.column_stack([np.ones(len(x)), x]) if intercept else x[:, None]
+    XtW = X.T * w
+    A = XtW @ X
+    p = np.linalg.solve(A, XtW @ y)
+
+    dof = len(x) - len(p)
+    if dof > 0:
+        s2 = np.sum(w * (y - X @ p) ** 2) / dof
+        err = np.sqrt(np.diag(np.linalg.inv(A)) * s2)
+    else:
+        err = np.full(len(p), np.inf)
+
+    return p, err
+
+
+def _huber(x, y, w, intercept=True, max_iter=50, tol=1e-10):
+    '''
+    Huber-loss line fit by iteratively reweighted least squares
+    '''
+    p, err = _wls(x, y, w, intercept)
+    X = np.column_stack([np.ones(len(x)), x]) if intercept else x[:, None]
+
+    for _ in range(max_iter):
+
+        r = y - X @ p
+        scale = 1.4826 * np.median(np.abs(r - np.median(r)))  # MAD
+        if scale == 0:
+            break
+
+        u = np.abs(r) / (HUBER_K * scale)
+        hw = np.where(u <= 1, 1, 1 / np.maximum(u, 1))
+
+        p_new, err = _wls(x, y, w * hw, intercept)
+        converged = np.allclose(p_new, p, rtol=tol, atol=0)
+        p = p_new
+        if converged:
+            break
+
+    return p, err
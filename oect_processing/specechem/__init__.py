@@ -1,5 +1,7 @@
+from . import kinetics
 from . import uvvis
 from . import uvvis_h5
+from . import uvvis_mmap
 from . import uvvis_plot
 
 __all__ = ['uvvis', 'uvvis_plot']
\ No newline at end of file
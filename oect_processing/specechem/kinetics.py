@@ -0,0 +1,270 @@
+import numpy as np
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+'''
+Batched exponential kinetics fits of many time traces at once (e.g. every
+wavelength of a spectra_vs_time band)
+
+Usage:
+
+    >> fits = kinetics.fit_banded(tx, data.spectra_vs_time[0.9].loc[700:900], fittype='exp')
+    >> fits['tau']  # one row per wavelength
+
+The fits use variable projection: for a grid of rates the amplitudes and offset
+are linear, so every trace is solved by least squares for every grid point at
+once. The best grid point then seeds a vectorized Levenberg-Marquardt
+refinement of all the parameters for all the traces together.
+
+Models (as in uvvis.fit_exp, fit_biexp, fit_strexp):
+    exp = y0 + A * exp(-t/tau)
+    biexp = y0 + A1 * exp(-t/tau1) + A2 * exp(-t/tau2), tau1 < tau2
+    stretched = y0 + A * exp(-t/tau)**beta. This is exp(-t*beta/tau), so only
+        tau/beta is determined. It is fit as exp and reported with beta = 1
+'''
+
+NEXP = {'exp': 1, 'biexp': 2, 'stretched': 1}
+
+F_MIN = 10  # F statistic of the exponentials over a constant, below which a fit is not converged
+
+
+def fit_banded(t, data, fittype='exp', ngrid=40, max_iter=200, n_jobs=1, executor=None):
+    '''
+    Fits every row of data (e.g. wavelength) vs t
+
+    t : ndarray
+        Times, shape (ntimes,)
+    data : DataFrame or ndarray
+        Shape (ntraces, ntimes). A DataFrame index (wavelength) is kept in the output
+    fittype : str, optional
+        'exp', 'biexp' or 'stretched'
+    ngrid : int, optional
+        Number of log-spaced rates in the variable-projection grid
+    max_iter : int, optional
+        Levenberg-Marquardt iterations
+    n_jobs : int, optional
+        Number of worker processes, each fitting a block of rows. 1 = serial,
+        None or -1 = one per CPU
+    executor : concurrent.futures.Executor, optional
+        An existing pool, used instead of creating one. The rows are split
+        into n_jobs blocks, or one per CPU if n_jobs is 1 or None
+
+    Returns
+    -------
+    fits : DataFrame
+        One row per trace with y0, A, tau (A1, tau1, A2, tau2 for biexp; beta for
+        stretched), the RMS residual and whether the refinement converged
+    '''
+    if fittype not in NEXP:
+        raise ValueError('Fit must be exp, biexp, or stretched')
+
+    index = data.index if isinstance(data, pd.DataFrame) else None
+    Y = np.asarray(data, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+
+    if n_jobs is not None and n_jobs < 1:
+        n_jobs = None  # one worker per CPU
+    args = (repeat(t), repeat(NEXP[fittype]), repeat(ngrid), repeat(max_iter))
+
+    # one block of rows per worker; for an executor, n_jobs or one per CPU
+    n_blocks = max(min(n_jobs if n_jobs and n_jobs > 1 else os.cpu_count() or 1, len(Y)), 1)
+
+    if executor is not None:
+        results = list(executor.map(fit_exp_batch, np.array_split(Y, n_blocks), *args))
+    elif n_jobs == 1 or len(Y) < 2:
+        results = [fit_exp_batch(Y, t, NEXP[fittype], ngrid, max_iter)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(fit_exp_batch, np.array_split(Y, n_blocks), *args))
+
+    p = np.concatenate([r[0] for r in results])
+    rms = np.concatenate([r[1] for r in results])
+    converged = np.concatenate([r[2] for r in results])
+
+    with np.errstate(divide='ignore'):
+        if fittype == 'biexp':
+            fits = {'y0': p[:, 0], 'A1': p[:, 1], 'tau1': 1 / p[:, 2],
+                    'A2': p[:, 3], 'tau2': 1 / p[:, 4]}
+        else:
+            fits = {'y0': p[:, 0], 'A': p[:, 1], 'tau': 1 / p[:, 2]}
+            if fittype == 'stretched':
+                fits['beta'] = np.ones(len(p))
+
+    fits['residual'] = rms
+    fits['converged'] = converged
+
+    return pd.DataFrame(fits, index=index)
+
+
+def fit_exp_batch(Y, t, nexp=1, ngrid=40, max_iter=200, tol=1e-10):
+    '''
+    Fits y0 + sum_j A_j * exp(-k_j * t) to every row of Y
+
+    Y : ndarray
+        Shape (ntraces, ntimes)
+    t : ndarray
+        Shape (ntimes,)
+    nexp : int, optional
+        Number of exponentials, 1 or 2
+
+    Returns
+    -------
+    p : ndarray
+        Shape (ntraces, 1 + 2*nexp), [y0, A1, k1, A2, k2...] with k = 1/tau, fastest first
+    rms : ndarray
+        RMS residual per trace
+    converged : ndarray of bool
+        False if the refinement stalled, or the exponentials are not identified:
+        a rate <= 0, or no significant improvement over a constant (e.g. a flat
+        or pure-noise trace)
+    '''
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    t = np.asarray(t, dtype=np.float64)
+
+    p = _grid_search(Y, t, nexp, ngrid)
+    p, sse, converged = _levenberg_marquardt(Y, t, p, nexp, max_iter, tol)
+
+    # F test of the 2*nexp exponential parameters against a constant
+    sse0 = np.sum((Y - Y.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    dof = max(Y.shape[1] - 1 - 2 * nexp, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        F = (sse0 - sse) / (2 * nexp) / (sse / dof)
+    converged &= (F > F_MIN) & np.all(p[:, 2::2] > 0, axis=1)
+
+    # fastest component first
+    if nexp == 2:
+        swap = p[:, 2] < p[:, 4]
+        p[swap] = p[swap][:, [0, 3, 4, 1, 2]]
+
+    return p, np.sqrt(sse / Y.shape[1]), converged
+
+
+def _rate_grid(t, ngrid):
+    '''
+    Log-spaced rates from 1/(10*duration) to 1/(smallest time step)
+    '''
+    dt = np.min(np.diff(np.unique(t))) if len(np.unique(t)) > 1 else 1.0
+    span = np.ptp(t) if np.ptp(t) > 0 else 1.0
+
+    return np.logspace(np.log10(0.1 / span), np.log10(1 / dt), ngrid)
+
+
+def _grid_search(Y, t, nexp, ngrid, chunk=2 ** 22):
+    '''
+    Variable projection over a grid of rates: the offset and amplitudes are
+    linear, so for each grid point the best fit of every trace comes from the
+    normal equations. The products of the traces with each basis function are
+    computed once and shared by all grid points
+    '''
+    rates = _rate_grid(t, ngrid)
+    if nexp == 1:
+        combos = np.arange(ngrid)[:, None]
+    else:
+        combos = np.array([(i, j) for i in range(ngrid) for j in range(i)])
+
+    # basis: constant, then exp(-k*t) for every rate
+    E = np.vstack([np.ones(len(t)), np.exp(-rates[:, None] * t)])
+    gram = E @ E.T
+    EY = E @ Y.T  # (1 + ngrid, ntraces)
+
+    cols = np.hstack([np.zeros((len(combos), 1), dtype=int), combos + 1])
+    G = gram[cols[:, :, None], cols[:, None, :]]  # (ncombos, 1 + nexp, 1 + nexp)
+    Ginv = np.linalg.pinv(G)
+
+    best = np.full(len(Y), -np.inf)
+    p = np.zeros((len(Y), 1 + 2 * nexp))
+    step = max(1, chunk // (max(len(Y), 1) * cols.shape[1]))
+
+    for c in range(0, len(combos), step):
+
+        b = EY[cols[c:c + step]]  # (nc, 1 + nexp, ntraces)
+        coef = np.einsum('cij,cjm->cim', Ginv[c:c + step], b)
+        proj = np.einsum('cim,cim->cm', b, coef)  # sum of squares explained
+
+        k = np.argmax(proj, axis=0)
+        better = proj[k, np.arange(len(Y))] > best
+        ix = np.flatnonzero(better)
+
+        best[ix] = proj[k[ix], ix]
+        p[ix, 0] = coef[k[ix], 0, ix]
+        for j in range(nexp):
+            p[ix, 1 + 2 * j] = coef[k[ix], 1 + j, ix]
+            p[ix, 2 + 2 * j] = rates[combos[c + k[ix], j]]
+
+    return p
+
+
+def _model(t, p, nexp):
+
+    f = np.repeat(p[:, :1], len(t), axis=1)
+    for j in range(nexp):
+        f += p[:, 1 + 2 * j, None] * np.exp(-p[:, 2 + 2 * j, None] * t)
+
+    return f
+
+
+def _jacobian(t, p, nexp):
+
+    J = np.empty((len(p), len(t), 1 + 2 * nexp))
+    J[:, :, 0] = 1
+    for j in range(nexp):
+        e = np.exp(-p[:, 2 + 2 * j, None] * t)
+        J[:, :, 1 + 2 * j] = e
+        J[:, :, 2 + 2 * j] = -p[:, 1 + 2 * j, None] * t * e
+
+    return J
+
+
+def _levenberg_marquardt(Y, t, p, nexp, max_iter=200, tol=1e-10):
+    '''
+    Vectorized Levenberg-Marquardt: every trace takes its own damped
+    Gauss-Newton step each iteration, solved as a stack of small systems
+    '''
+    lam = np.full(len(Y), 1e-3)
+    r = Y - _model(t, p, nexp)
+    sse = np.sum(r ** 2, axis=1)
+    converged = np.zeros(len(Y), dtype=bool)
+    stalled = np.zeros(len(Y), dtype=bool)  # damping blew up, not converged
+
+    for _ in range(max_iter):
+
+        active = ~converged & ~stalled
+        if not np.any(active):
+            break
+
+        J = _jacobian(t, p[active], nexp)
+        JtJ = np.einsum('mni,mnj->mij', J, J)
+        Jtr = np.einsum('mni,mn->mi', J, r[active])
+
+        # Marquardt scaling of the diagonal
+        A = JtJ.copy()
+        d = np.arange(A.shape[1])
+        A[:, d, d] *= 1 + lam[active, None]
+
+        try:
+            step = np.linalg.solve(A, Jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(A, Jtr)])
+
+        p_new = p[active] + step
+        r_new = Y[active] - _model(t, p_new, nexp)
+        sse_new = np.sum(r_new ** 2, axis=1)
+
+        ix = np.flatnonzero(active)
+        better = np.isfinite(sse_new) & (sse_new <= sse[ix])
+
+        # relative change in the cost, for the traces that improved
+        done = better & ((sse[ix] - sse_new) <= tol * np.maximum(sse[ix], 1e-300))
+
+        p[ix[better]] = p_new[better]
+        r[ix[better]] = r_new[better]
+        sse[ix[better]] = sse_new[better]
+        lam[ix[better]] /= 10
+        lam[ix[~better]] *= 10
+
+        converged[ix[done]] = True
+        stalled[ix[~done & (lam[ix] > 1e12)]] = True  # no further progress possible
+
+    return p, sse, converged
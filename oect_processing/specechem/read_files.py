@@ -2,10 +2,11 @@ import numpy as np
 import os
 import pandas as pd
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
-def read_files(path):
+def read_files(path, n_jobs=1):
     '''
     Takes a folder and finds the potential from all the "Steps" files
         
@@ -13,6 +14,10 @@ def read_files(path):
     -----
     path : str
         Folder path to where the data are contained. Assumes are saved as "steps"
+    n_jobs : int, optional
+        Number of threads reading the step files. 1 = serial, None or -1 = one per CPU.
+        Only the first row of each is read, so threads only help for many files
+        or a slow network drive
     
     Returns
     -------
@@ -67,11 +72,22 @@ def read_files(path):
 
     potentials = np.zeros([len(stepfiles)])
 
-    pp = pd.read_csv(stepfiles[0], header=0, sep='\t')
-    pot = [n for n in pp.columns if 'Potential' in n][0]
+    def first_row(fl):
+        return pd.read_csv(fl, header=0, sep='\t', nrows=1)
 
-    for fl, x in zip(stepfiles, np.arange(len(potentials))):
-        pp = pd.read_csv(fl, header=0, sep='\t')
+    if n_jobs is not None and n_jobs < 1:
+        n_jobs = None  # one worker per CPU
+
+    if n_jobs == 1 or len(stepfiles) < 2:
+        rows = [first_row(fl) for fl in stepfiles]
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            rows = list(pool.map(first_row, stepfiles))
+
+    if rows:
+        pot = [n for n in rows[0].columns if 'Potential' in n][0]
+
+    for pp, x in zip(rows, np.arange(len(potentials))):
         potentials[x] = np.round(pp[pot][0], 2)
 
     return stepfiles, specfiles, potentials, dedopestepfiles, dedopespecfiles
@@ -11,13 +11,17 @@ import os
 import pandas as pd
 import re
 import seaborn as sns
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from matplotlib import pyplot as plt
 from pathlib import Path
 from scipy import integrate as spint
 from scipy import signal as sg
 from scipy.optimize import curve_fit
 
+from . import kinetics
 from . import read_files
+from . import uvvis_mmap
 
 '''
 UV Vis spec-echem processing
@@ -77,7 +81,8 @@ class UVVis(object):
 
         return
 
-    def time_dep_spectra(self, specfiles, smooth=None, round_wl=2, droptimes=None):
+    def time_dep_spectra(self, specfiles, smooth=None, round_wl=2, droptimes=None, cache=None,
+                         n_jobs=1, executor=None):
         '''
         Generates all the time-dependent spectra. This yields a dictionary where
         each voltage key contains the time-dependent spectra dataframe 
@@ -102,14 +107,45 @@ class UVVis(object):
             Specific time indices to drop. This functionality is for initial or final
             errors in spectroelectrochemistry data
         
+        cache : str or Path, optional
+            Folder for a memory-mapped copy of the spectra (see uvvis_mmap).
+            If it matches specfiles, smooth and round_wl the spectra are opened
+            from it without parsing; otherwise they are parsed and written there
+        
+        n_jobs : int, optional
+            Number of worker processes reading and parsing the spectra files.
+            1 = serial, None or -1 = one per CPU
+        
+        executor : concurrent.futures.Executor, optional
+            An existing pool to parse the files in. Overrides n_jobs
         '''
+        if cache:
+            sig = uvvis_mmap.spectra_signature(specfiles[:len(self.potentials)], self.potentials,
+                                               smooth=smooth, round_wl=round_wl)
+
+        if cache and uvvis_mmap.read_signature(cache) == sig:
 
-        self.spectra_vs_time = {}
-        for v, r in zip(self.potentials, range(len(self.potentials))):
-            spectra_path = specfiles[r]
+            self.spectra_vs_time = uvvis_mmap.load_mmap(cache)
+
+        else:
 
-            df = self._single_time_spectra(spectra_path, smooth=smooth, digits=round_wl)
-            self.spectra_vs_time[v] = df
+            paths = specfiles[:len(self.potentials)]
+            args = (paths, repeat(smooth), repeat(round_wl))
+
+            if executor is not None:
+                dfs = executor.map(_load_spectra, *args)
+            elif n_jobs == 1 or len(paths) < 2:
+                dfs = map(self._single_time_spectra, *args)
+            else:
+                if n_jobs is not None and n_jobs < 1:
+                    n_jobs = None  # one worker per CPU
+                with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                    dfs = list(pool.map(_load_spectra, *args))
+
+            self.spectra_vs_time = dict(zip(self.potentials, dfs))
+
+            if cache:
+                uvvis_mmap.save_mmap(self, cache, signature=sig)
 
         if droptimes:
             for st in self.spectra_vs_time:
@@ -150,6 +186,13 @@ class UVVis(object):
         per_run = int(len(pp) / runs[-1])
         wl = pp['Wavelength (nm)'][0:per_run]
 
+        # fixed block structure: one reshape and one convolution for all the spectra
+        df = self._reshape_spectra(pp, runs, times, per_run, smooth)
+        if df is not None:
+            if digits:
+                df = df.set_index(np.round(df.index.values, digits))  # rounds wavelengths
+            return df
+
         # Set up dataframe
         df = pd.DataFrame(index=wl)
         if digits:
@@ -170,6 +213,31 @@ class UVVis(object):
 
         return df
 
+    @staticmethod
+    def _reshape_spectra(pp, runs, times, per_run, smooth=None):
+        '''
+        Fast path for _single_time_spectra when the file is runs x per_run rows,
+        ordered by spectrum number. Returns None for ragged files
+        '''
+        nruns = min(len(runs), len(times))
+        labels = np.round(times[:nruns], 2)
+
+        if (len(pp) != len(runs) * per_run or runs[-1] != len(runs)
+                or len(np.unique(labels)) != nruns):
+            return None
+        if 'Spectrum number' in pp and not np.array_equal(pp['Spectrum number'].values,
+                                                          np.repeat(runs, per_run)):
+            return None
+
+        data = pp['Absorbance'].values.reshape(len(runs), per_run)[:nruns]
+
+        if smooth:
+            data = sg.fftconvolve(data, np.ones((1, smooth)) / smooth, mode='same', axes=1)
+
+        wl = pp['Wavelength (nm)'][0:per_run]
+
+        return pd.DataFrame(data.T, index=pd.Index(wl.values, name=wl.name), columns=labels)
+
     def spec_echem_voltage(self, time=0, smooth=3, digits=None):
         '''
         Takes the list of spectra files specfiles, then extracts the time-slice of 
@@ -235,7 +303,7 @@ class UVVis(object):
 
         return
 
-    def current_vs_time(self, stepfiles):
+    def current_vs_time(self, stepfiles, n_jobs=1):
         '''
         Processes "step" files to generate the current vs time at each voltage
 
@@ -243,13 +311,21 @@ class UVVis(object):
         
         stepfiles : str, list
             List of steps files (containing working electrode current) on disk
+        
+        n_jobs : int, optional
+            Number of threads reading the step files. 1 = serial
         '''
 
         tx = []
 
-        for fl, v in zip(stepfiles, self.potentials):
+        if n_jobs == 1:
+            steps = map(_read_step, stepfiles)
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+                steps = list(pool.map(_read_step, stepfiles))
+
+        for pp, v in zip(steps, self.potentials):
 
-            pp = pd.read_csv(fl, sep='\t')
             data = pp['WE(1).Current (A)']
 
             if not any(tx):
@@ -333,7 +409,7 @@ class UVVis(object):
 
         return out
 
-    def banded_fits(self, wl_start=700, wl_stop=900, voltage=1, fittype='exp'):
+    def banded_fits(self, wl_start=700, wl_stop=900, voltage=1, fittype='exp', method='curve_fit', n_jobs=1):
         '''
         Returns the fits from a range of spectra_vs_time data for a particular potential
         
@@ -349,12 +425,23 @@ class UVVis(object):
             exp = single exponential (fastest)
             biexp = two exponentials
             stretched = stretched expontential
+
+        method : str, optional
+            'curve_fit' (default) fits each wavelength separately
+            'batch' fits all the wavelengths at once with kinetics.fit_banded.
+            For 'stretched' it only finds tau/beta and reports beta = 1
+            
+        n_jobs : int, optional
+            Worker processes for method='batch', see kinetics.fit_banded
             
         Generates
         -------
         fits : ndarray list
             Contains the fit values. Either a single entry list for exp or a list of
                 tuples for biexp and stretched
+                
+        fits_table : DataFrame
+            For method='batch', index = wavelength, all fit parameters, residual and convergence
         
         '''
 
@@ -364,6 +451,19 @@ class UVVis(object):
         if fittype not in ['exp', 'biexp', 'stretched']:
             raise ValueError('Fit must be exp, biexp, or stretched')
 
+        if method == 'batch':
+
+            self.fits_table = kinetics.fit_banded(tx, wl_x.iloc[1:], fittype=fittype, n_jobs=n_jobs)
+
+            if fittype == 'exp':
+                self.fits = self.fits_table['tau'].values
+            elif fittype == 'biexp':
+                self.fits = self.fits_table[['tau1', 'tau2']].values
+            elif fittype == 'stretched':
+                self.fits = self.fits_table[['tau', 'beta']].values
+
+            return
+
         fits = []  # single exponential
 
         for wl in wl_x.index.values[1:]:
@@ -383,6 +483,18 @@ class UVVis(object):
         return
 
 
+def _load_spectra(spectra_path, smooth, digits):
+    '''
+    Process-pool worker for time_dep_spectra
+    '''
+    return UVVis()._single_time_spectra(spectra_path, smooth=smooth, digits=digits)
+
+
+def _read_step(fl):
+
+    return pd.read_csv(fl, sep='\t')
+
+
 def fit_exp(t, y0, A, tau):
     return y0 + A * np.exp(-t / tau)
 
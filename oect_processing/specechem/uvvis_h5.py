@@ -5,40 +5,195 @@ from pathlib import Path
 
 from .uvvis import UVVis
 
+'''
+HDF5 storage of UVVis data
 
-def save_h5(data, filename):
+Usage:
+
+    >> uvvis_h5.save_h5(data, r'path_to_file.h5', compression='gzip')
+    >> data = uvvis_h5.convert_h5(r'path_to_file.h5')
+    >> band = uvvis_h5.read_spectra(r'path_to_file.h5', potential=0.9, wl_start=700, wl_stop=900)
+
+save_h5 writes everything in one open with h5py:
+
+    spectra      potential x wavelength x time absorbance, chunked per potential
+    potentials   the potential of each spectra plane
+    wavelength   shared wavelength axis
+    time         potential x time, the time axis of each plane
+    current      time x potential, with current_time
+    charge       integrated charge per potential
+
+Planes with fewer time points, or wavelengths missing at some potentials, are NaN padded.
+read_spectra reads only the hyperslab asked for, so a single potential,
+wavelength band or time window is read without loading the whole cube.
+
+convert_h5 also reads files from the previous save_h5, which used
+DataFrame.to_hdf (one PyTables group per potential).
+'''
+
+LAYOUT = 'cube'
+H5_VERSION = 1
+
+
+def save_h5(data, filename, compression=None, dtype=np.float64):
     '''
-    Saves the to two HDF5 files (.h5)
+    Saves the spectra_vs_time, current and charge of data to a single HDF5 file (.h5)
+
+    data : UVVis
+        With spectra_vs_time generated. current and charge are saved if present
+    filename : str or Path
+    compression : str, optional
+        h5py filter for the spectra, e.g. 'gzip' or 'lzf'. None = uncompressed
+    dtype : numpy dtype, optional
+        np.float32 halves the size of the file
     '''
-
     if isinstance(filename, str):
         filename = Path(filename)
 
+    potentials = list(data.spectra_vs_time)
+    frames = [data.spectra_vs_time[p] for p in potentials]
+
+    wavelength = frames[0].index
+    for df in frames[1:]:
+        if not df.index.equals(wavelength):
+            wavelength = wavelength.union(df.index)
+    ntimes = max(df.shape[1] for df in frames)
+
     with h5py.File(filename, 'w') as f:
-        dset = f.create_dataset('potentials', (len(data.potentials),))
-        dset[:] = data.potentials[:]
-        try:
-            dset = f.create_dataset('charge', (len(data.charge.values[0]),))
-            dset[:] = data.charge.values[0][:]
-        except:
-            pass
-    f.close()
 
-    for p in data.spectra_vs_time:
-        data.spectra_vs_time[p].to_hdf(filename, key=str(p), mode='a')
+        f.attrs['layout'] = LAYOUT
+        f.attrs['version'] = H5_VERSION
 
-    try:
-        data.current.to_hdf(filename, key='current', mode='a')
-    except:
-        pass
+        f.create_dataset('potentials', data=np.asarray(potentials, dtype=np.float64))
+        f.create_dataset('wavelength', data=wavelength.values.astype(np.float64))
+
+        time = f.create_dataset('time', (len(frames), ntimes), dtype=np.float64, fillvalue=np.nan)
+        spectra = f.create_dataset('spectra', (len(frames), len(wavelength), ntimes), dtype=dtype,
+                                   chunks=(1, min(len(wavelength), 256), min(ntimes, 256)),
+                                   compression=compression, fillvalue=np.nan)
+
+        for n, df in enumerate(frames):
+            if not df.index.equals(wavelength):
+                df = df.reindex(wavelength)
+            time[n, :df.shape[1]] = df.columns.values.astype(np.float64)
+            spectra[n, :, :df.shape[1]] = df.values
+
+        current = getattr(data, 'current', None)
+        if isinstance(current, pd.DataFrame):
+            f.create_dataset('current', data=current.values.astype(np.float64))
+            f.create_dataset('current_time', data=current.index.values.astype(np.float64))
+            f.create_dataset('current_potentials', data=current.columns.values.astype(np.float64))
+
+        charge = getattr(data, 'charge', None)
+        if isinstance(charge, pd.DataFrame):
+            f.create_dataset('charge', data=charge.values[0].astype(np.float64))
 
     return
 
 
+def read_spectra(h5file, potential=None, wl_start=None, wl_stop=None, t_start=None, t_stop=None):
+    '''
+    Reads part of the spectra cube written by save_h5
+
+    potential : float or list, optional
+        Potential(s) to read. None = all
+    wl_start, wl_stop : float, optional
+        Wavelength band, inclusive as in DataFrame.loc. None = from the start/to the end
+    t_start, t_stop : float, optional
+        Time window, inclusive. None = from the start/to the end
+
+    Returns
+    -------
+    spectra_vs_time : dict
+        Potential : DataFrame of index = wavelength, columns = times, data = absorbance
+    '''
+    with h5py.File(h5file, 'r') as f:
+
+        if f.attrs.get('layout') != LAYOUT:
+            raise ValueError('{} is not a {} layout file, use convert_h5'.format(h5file, LAYOUT))
+
+        potentials = f['potentials'][()]
+        wavelength = f['wavelength'][()]
+
+        if potential is None:
+            planes = range(len(potentials))
+        else:
+            planes = [_find_potential(potentials, p) for p in np.atleast_1d(potential)]
+
+        w0, w1 = _window(wavelength, wl_start, wl_stop)
+
+        spectra_vs_time = {}
+        for n in planes:
+            tx = f['time'][n]
+            tx = tx[~np.isnan(tx)]
+            t0, t1 = _window(tx, t_start, t_stop)
+
+            df = pd.DataFrame(f['spectra'][n, w0:w1, t0:t1], index=wavelength[w0:w1], columns=tx[t0:t1])
+            df.index.name = 'Wavelength (nm)'
+            df.columns.name = 'Time (s)'
+            spectra_vs_time[potentials[n]] = df
+
+    return spectra_vs_time
+
+
 def convert_h5(h5file):
     '''
     Converts a saved hdf5 to uvvis Class format
-    
+
+    Reads the single-file layout of save_h5 and, failing that, the
+    previous per-potential PyTables layout
+    '''
+    with h5py.File(h5file, 'r') as f:
+        native = f.attrs.get('layout') == LAYOUT
+
+    if not native:
+        return _convert_legacy(h5file)
+
+    data = UVVis(None, None, None)
+    data.spectra_vs_time = read_spectra(h5file)
+    data.potentials = np.array(list(data.spectra_vs_time))
+    data.time_index()
+
+    with h5py.File(h5file, 'r') as f:
+
+        if 'current' in f:
+            current = pd.DataFrame(data=f['current'][()], index=f['current_time'][()],
+                                   columns=f['current_potentials'][()])
+            current.index.name = 'Time (s)'
+            current.columns.name = 'Potential (V)'
+            data.current = current
+
+        if 'charge' in f:
+            charge = pd.DataFrame([f['charge'][()]], columns=data.potentials, index=[0])
+            charge.columns.name = 'Potential (V)'
+            data.charge = charge
+
+    return data
+
+
+def _find_potential(potentials, p):
+
+    match = np.flatnonzero(np.isclose(potentials, p))
+    if not len(match):
+        raise KeyError('No spectra at {} V'.format(p))
+
+    return match[0]
+
+
+def _window(axis, start, stop):
+    '''
+    Index slice of a sorted axis, inclusive of start and stop
+    '''
+    i0 = 0 if start is None else np.searchsorted(axis, start, side='left')
+    i1 = len(axis) if stop is None else np.searchsorted(axis, stop, side='right')
+
+    return i0, i1
+
+
+def _convert_legacy(h5file):
+    '''
+    Reads files from the previous save_h5 (DataFrame.to_hdf per potential)
+
     axis0 = time
     axis1 = wavelength
     block0_items
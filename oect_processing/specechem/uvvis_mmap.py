@@ -0,0 +1,119 @@
+import json
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+
+'''
+Memory-mapped binary cache of UVVis.spectra_vs_time
+
+Usage:
+
+    >> uvvis_mmap.save_mmap(data, r'path_to_cache')
+    >> spectra_vs_time = uvvis_mmap.load_mmap(r'path_to_cache')
+
+or let time_dep_spectra manage it:
+
+    >> data.time_dep_spectra(specfiles=specs, cache=r'path_to_cache')
+
+Each potential's wavelength x time absorbance matrix is a C-ordered .npy file,
+and index.json holds the potentials, wavelengths, times and the signature of the
+source spectra files. Loaded DataFrames wrap read-only memory maps, so opening a
+dataset costs no parsing and only the rows actually used are read from disk.
+'''
+
+INDEX = 'index.json'
+MMAP_VERSION = 1
+
+
+def save_mmap(data, folder, dtype=np.float64, signature=None):
+    '''
+    Writes data.spectra_vs_time as one .npy per potential plus a JSON index
+
+    data : UVVis
+        With spectra_vs_time already generated
+    folder : str or Path
+        Folder for the cache files, created if needed
+    dtype : numpy dtype, optional
+        np.float32 halves the size of the cache
+    signature : list, optional
+        Identifies the source files, see spectra_signature
+    '''
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    index = {'version': MMAP_VERSION, 'signature': signature, 'potentials': []}
+
+    # the index is removed first and written last, so a partial cache is never read as valid
+    if (folder / INDEX).exists():
+        os.remove(folder / INDEX)
+
+    for n, (v, df) in enumerate(data.spectra_vs_time.items()):
+        fl = 'spectra_{}.npy'.format(n)
+        np.save(folder / fl, np.ascontiguousarray(df.values, dtype=dtype))
+
+        index['potentials'].append({'potential': float(v), 'file': fl,
+                                    'wavelength': df.index.values.tolist(),
+                                    'time': df.columns.values.tolist(),
+                                    'names': [df.index.name, df.columns.name]})
+
+    with open(folder / INDEX, 'w') as f:
+        json.dump(index, f)
+
+    return
+
+
+def load_mmap(folder, mmap_mode='r'):
+    '''
+    Opens a cache written by save_mmap
+
+    mmap_mode : str, optional
+        Passed to np.load. 'r' = read-only map, 'c' = copy-on-write, None = read into memory
+
+    Returns
+    -------
+    spectra_vs_time : dict
+        Potential : DataFrame of index = wavelength, columns = times, data = absorbance
+    '''
+    folder = Path(folder)
+
+    with open(folder / INDEX) as f:
+        index = json.load(f)
+
+    spectra_vs_time = {}
+    for p in index['potentials']:
+        arr = np.load(folder / p['file'], mmap_mode=mmap_mode)
+        df = pd.DataFrame(arr, index=p['wavelength'], columns=p['time'], copy=False)
+        df.index.name, df.columns.name = p['names']
+        spectra_vs_time[p['potential']] = df
+
+    return spectra_vs_time
+
+
+def read_signature(folder):
+    '''
+    Returns the source-file signature of a cache, or None if there is no valid cache
+    '''
+    try:
+        with open(Path(folder) / INDEX) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('version') != MMAP_VERSION:
+        return None
+
+    return index['signature']
+
+
+def spectra_signature(specfiles, potentials, **kwargs):
+    '''
+    Identifies the spectra files (name, size, modification time), the potentials
+    and any processing options (smooth, round_wl, ...) used to build the cache
+    '''
+    sig = []
+    for fl in specfiles:
+        st = os.stat(fl)
+        sig.append([os.path.basename(fl), st.st_size, st.st_mtime_ns])
+
+    return [sig, [float(v) for v in potentials], sorted([k, repr(v)] for k, v in kwargs.items())]
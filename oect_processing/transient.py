@@ -5,13 +5,17 @@ Created on Thu May  9 14:15:37 2019
 @author: GingerLab
 """
 
+import inspect
 import numpy as np
+import os
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from matplotlib import pyplot as plt
 from scipy.optimize import curve_fit
 
 
-def read_time_dep(path, start=0, stop=0, v_limit=None, skipfooter=1):
+def read_time_dep(path, start=0, stop=0, v_limit=None, skipfooter=1, chunksize=100000):
     '''
     Reads in the time-dependent data using Raj's automated version
     Saves all the different current 
@@ -24,6 +28,11 @@ def read_time_dep(path, start=0, stop=0, v_limit=None, skipfooter=1):
         Limits constant current data to when the voltage_compliance limit is reached
         Do not use this for Constant Voltage data
         e.g. -0.9 V is typical
+    skipfooter : int
+        Unused, kept for compatibility. The trailer rows (V_DS = ...) are
+        detected by their non-numeric time
+    chunksize : int, optional
+        Rows parsed at a time, see read_time_dep_chunks
         
     Returns:
         
@@ -31,19 +40,106 @@ def read_time_dep(path, start=0, stop=0, v_limit=None, skipfooter=1):
         Single DataFrame with all the indices corrected
     
     '''
-    df = pd.read_csv(path, sep='\t', skipfooter=skipfooter, engine='python')
-    df = df.set_index('Time (ms)')  # convert to seconds
-
-    # crop the pre-trigger stuff
-    f = df.index.searchsorted(start)
-    df = df.drop(df.index.values[:f])
-    if stop != 0:
-        f = df.index.searchsorted(stop)
-        df = df.drop(df.index.values[f:])
-    if v_limit:
-        df = df.loc[np.abs(df['V_G(V)']) <= np.abs(v_limit)]
+    df = pd.concat(read_time_dep_chunks(path, start, stop, v_limit, chunksize))
 
     # Add the setpoints as attributes for easy reference
+    _set_attrs(df, path)
+
+    ids = df['I_DS (A)']
+    norm = 1 + (ids - np.min(np.abs(ids))) / (np.max(np.abs(ids)) - np.min(np.abs(ids)))
+    df['I_DS_norm (a.u.)'] = norm
+
+    return df
+
+
+def read_time_dep_chunks(path, start=0, stop=0, v_limit=None, chunksize=100000):
+    '''
+    Generator of the time-dependent data in DataFrames of up to chunksize rows,
+    so very long logs can be processed with bounded memory. Uses the C parser;
+    the time window and compliance limit are applied to each chunk as it is read
+    and the file is closed once stop is passed
+
+    start, stop, v_limit :
+        As in read_time_dep
+
+    Yields:
+        
+    df : DataFrame
+        Indexed by 'Time (ms)'. There is no I_DS_norm column, since that needs
+        the whole file
+    '''
+    with pd.read_csv(path, sep='\t', engine='c', chunksize=chunksize) as reader:
+
+        for df in reader:
+
+            # the trailer (V_DS = ...) makes the time column non-numeric
+            if df['Time (ms)'].dtype == object:
+                df = df.loc[pd.to_numeric(df['Time (ms)'], errors='coerce').notnull()]
+                df = df.apply(pd.to_numeric)
+
+            df = df.set_index('Time (ms)')
+
+            # crop the pre-trigger stuff
+            df = df.loc[df.index.values >= start]
+            done = False
+            if stop != 0:
+                done = len(df) and df.index.values[-1] >= stop
+                df = df.loc[df.index.values < stop]
+            if v_limit:
+                df = df.loc[np.abs(df['V_G (V)']) <= np.abs(v_limit)]
+
+            yield df
+
+            if done:
+                break
+
+
+def iter_cycles(path, start=0, stop=0, v_limit=None, p_type=True, chunksize=100000):
+    '''
+    Generator of the individual cycles of a cycling run, read in chunks
+    Each cycle runs from the point before a doping step through the point before
+    the next one (the same slices fit_cycles uses), so it can be passed directly
+    to fit_cycles_batch. Data before the first doping step is dropped
+
+    start, stop, v_limit, chunksize :
+        As in read_time_dep_chunks
+    p_type: bool, optional
+        Assumes doping is a negative voltage
+
+    Yields:
+
+    df : DataFrame
+        One cycle, indexed by 'Time (ms)'
+    '''
+    buf = None
+    started = False
+
+    for df in read_time_dep_chunks(path, start, stop, v_limit, chunksize):
+
+        if buf is not None:
+            df = pd.concat([buf, df])
+
+        dv = np.diff(df['V_G (V)'].values)
+        steps = np.where(dv < 0)[0] if p_type else np.where(dv > 0)[0]
+
+        if not len(steps):
+            buf = df if started else df.iloc[-1:]
+            continue
+
+        for a, b in zip(steps[:-1], steps[1:]):
+            yield _set_attrs(df.iloc[a:b + 1], path)
+
+        buf = df.iloc[steps[-1]:]
+        started = True
+
+    if started:
+        yield _set_attrs(buf, path)
+
+
+def _set_attrs(df, path):
+    '''
+    Constant-current/voltage flags and the file name, as read_time_dep sets
+    '''
     if df.columns[0] == 'I_G (A)':
         df.is_cc = True
         df.is_cv = False
@@ -52,9 +148,6 @@ def read_time_dep(path, start=0, stop=0, v_limit=None, skipfooter=1):
         df.is_cv = True
 
     df.name = path.split(r'/')[-1][:-4]
-    ids = df['I_DS (A)']
-    norm = 1 + (ids - np.min(np.abs(ids))) / (np.max(np.abs(ids)) - np.min(np.abs(ids)))
-    df['I_DS_norm (a.u.)'] = norm
 
     return df
 
@@ -145,15 +238,7 @@ def fit_cycles(df, doping_time, dedoping_time, func=expf, norm=False,
     '''
 
     t = df.index.values / 1000  # in seconds
-
-    # cycle_idx contains indices for each cycle time in the DataFrame
-    # doping_idx contains the indices where doping stops in each cycle
-    if p_type:
-        doping_idx = np.where(np.diff(df['V_G (V)']) < 0)[0]
-        dedoping_idx = np.where(np.diff(df['V_G (V)']) > 0)[0]
-    else:
-        doping_idx = np.where(np.diff(df['V_G (V)']) > 0)[0]
-        dedoping_idx = np.where(np.diff(df['V_G (V)']) < 0)[0]
+    yy = df['I_DS_norm (a.u.)'].values if norm else df['I_DS (A)'].values
 
     doping_fits = []
     dedoping_fits = []
@@ -161,39 +246,166 @@ def fit_cycles(df, doping_time, dedoping_time, func=expf, norm=False,
     if plot:
         _, ax = plot_current(df, norm=norm, plot_voltage=(False))
 
-    for n, _ in enumerate(doping_idx):
+    for _, phase, start, stop in _segment_cycles(df['V_G (V)'].values, p_type):
 
-        _dope = range(doping_idx[n], dedoping_idx[n] + 1)
-
-        try:
-            _dedope = range(dedoping_idx[n], doping_idx[n + 1] + 1)
-        except:
-            _dedope = range(dedoping_idx[n], len(t))
         # X-axis times
-        xx_dope = t[_dope]
-        xx_dedope = t[_dedope]
-
-        if norm:
-            yy_dope = df['I_DS_norm (a.u.)'].iloc[_dope]
-            yy_dedope = df['I_DS_norm (a.u.)'].iloc[_dedope]
-        else:
-            yy_dope = df['I_DS (A)'].iloc[_dope]
-            yy_dedope = df['I_DS (A)'].iloc[_dedope]
+        xx = t[start:stop]
+        yy_fit = yy[start:stop]
 
         # Curve fitting
-        popt_dope, _ = curve_fit(func, xx_dope - xx_dope[0], yy_dope,
-                                 p0=[yy_dope.iloc[0],
-                                     yy_dope.max() - yy_dope.min(),
-                                     dope_tau_p0])
-        popt_dedope, _ = curve_fit(func, xx_dedope - xx_dedope[0], yy_dedope,
-                                   p0=[yy_dedope.iloc[0],
-                                       -(yy_dedope.max() - yy_dedope.min()),
-                                       dedope_tau_p0])
-        doping_fits.append(popt_dope)
-        dedoping_fits.append(popt_dedope)
+        p0 = _cycle_p0(yy_fit, phase, dope_tau_p0 if phase == 'dope' else dedope_tau_p0)
+        popt, _ = curve_fit(func, xx - xx[0], yy_fit, p0=p0)
+
+        if phase == 'dope':
+            doping_fits.append(popt)
+        else:
+            dedoping_fits.append(popt)
 
         if plot:
-            ax.plot(xx_dope, func(xx_dope - xx_dope[0], *popt_dope), 'r--')
-            ax.plot(xx_dedope, func(xx_dedope - xx_dedope[0], *popt_dedope), 'g--')
+            ax.plot(xx, func(xx - xx[0], *popt), 'r--' if phase == 'dope' else 'g--')
 
     return doping_fits, dedoping_fits
+
+
+def fit_cycles_batch(df, func=expf, norm=False, plot=False, p_type=True, dope_tau_p0=10,
+                     dedope_tau_p0=1, seed=True, n_jobs=1, executor=None):
+    '''
+    Fits the doping and dedoping phase of every cycle, as fit_cycles, for long
+    cycling runs. All cycles are segmented up front into array slices, each fit
+    starts from the previous cycle's parameters, and the cycles can be split
+    across a process pool (each worker gets a contiguous block of cycles).
+
+    df : Pandas DataFrame
+        The DataFrame containing our kinetics information, from read_time_dep
+
+    func : function
+        default = single exponential. Must be picklable (module-level) for n_jobs > 1
+
+    norm, plot, p_type, dope_tau_p0, dedope_tau_p0 :
+        As in fit_cycles
+
+    seed : bool, optional
+        Use the previous cycle's fit as the initial guess. A fit that fails from
+        the seed is retried from the default guess
+
+    n_jobs : int, optional
+        Number of worker processes. 1 = serial, None or -1 = one per CPU
+
+    executor : concurrent.futures.Executor, optional
+        An existing pool to submit the cycles to, used instead of creating one.
+        The cycles are split into n_jobs blocks, or one per CPU if n_jobs is 1 or None
+
+    Returns
+    -------
+    fits : DataFrame
+        One row per cycle and phase ('dope' or 'dedope') with the fit parameters
+        (y0, A, tau for expf) and the RMS residual. Failed fits are NaN
+    '''
+    t = df.index.values / 1000  # in seconds
+    yy = df['I_DS_norm (a.u.)'].values if norm else df['I_DS (A)'].values
+    segments = _segment_cycles(df['V_G (V)'].values, p_type)
+
+    tau_p0 = {'dope': dope_tau_p0, 'dedope': dedope_tau_p0}
+    jobs = [(cycle, phase, t[start:stop] - t[start], yy[start:stop], tau_p0[phase])
+            for cycle, phase, start, stop in segments]
+
+    if n_jobs is not None and n_jobs < 1:
+        n_jobs = None  # one worker per CPU
+    workers = n_jobs or os.cpu_count() or 1
+    if executor is not None and workers == 1:
+        workers = os.cpu_count() or 1  # a block per CPU for the existing pool
+
+    # contiguous blocks of whole cycles (two phases each), so seeding carries through a block
+    cycles = np.array_split(np.arange(len(jobs) // 2), max(1, min(workers, len(jobs) // 2)))
+    blocks = [jobs[2 * c[0]:2 * c[-1] + 2] for c in cycles if len(c)]
+
+    args = (repeat(func), repeat(seed))
+    if executor is not None:
+        results = list(executor.map(_fit_block, blocks, *args))
+    elif workers == 1 or len(blocks) < 2:
+        results = list(map(_fit_block, blocks, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_fit_block, blocks, *args))
+
+    names = list(inspect.signature(func).parameters)[1:]
+    fits = pd.DataFrame([row for r in results for row in r],
+                        columns=['cycle', 'phase'] + names + ['residual'])
+
+    if plot:
+        _, ax = plot_current(df, norm=norm, plot_voltage=(False))
+        for (_, phase, start, stop), p in zip(segments, fits[names].values):
+            xx = t[start:stop]
+            ax.plot(xx, func(xx - xx[0], *p), 'r--' if phase == 'dope' else 'g--')
+
+    return fits
+
+
+def _segment_cycles(v, p_type=True):
+    '''
+    Splits a cycling run into its doping and dedoping phases from the steps in V_G
+    Each phase starts at the step and includes the point of the next step.
+    An incomplete final cycle (doping but no dedoping step) is skipped
+
+    Returns
+    -------
+    segments : list of (cycle, phase, start, stop)
+        phase is 'dope' or 'dedope'; data is v[start:stop]
+    '''
+    # doping_idx contains the indices where doping starts in each cycle
+    if p_type:
+        doping_idx = np.where(np.diff(v) < 0)[0]
+        dedoping_idx = np.where(np.diff(v) > 0)[0]
+    else:
+        doping_idx = np.where(np.diff(v) > 0)[0]
+        dedoping_idx = np.where(np.diff(v) < 0)[0]
+
+    segments = []
+    for n, d in enumerate(doping_idx[:len(dedoping_idx)]):
+
+        stop = doping_idx[n + 1] + 1 if n + 1 < len(doping_idx) else len(v)
+        segments.append((n, 'dope', d, dedoping_idx[n] + 1))
+        segments.append((n, 'dedope', dedoping_idx[n], stop))
+
+    return segments
+
+
+def _cycle_p0(yy, phase, tau_p0):
+    '''
+    Default initial guess for a doping (rising) or dedoping (falling) phase
+    '''
+    A = np.max(yy) - np.min(yy)
+
+    return [yy[0], A if phase == 'dope' else -A, tau_p0]
+
+
+def _fit_block(jobs, func, seed):
+    '''
+    Process-pool worker for fit_cycles_batch. Fits a contiguous block of phases,
+    seeding each from the previous fit of the same phase
+    '''
+    rows = []
+    last = {}
+    for cycle, phase, xx, yy, tau_p0 in jobs:
+
+        guesses = [_cycle_p0(yy, phase, tau_p0)]
+        if seed and phase in last:
+            guesses.insert(0, last[phase])
+
+        popt = None
+        for p0 in guesses:
+            try:
+                popt, _ = curve_fit(func, xx, yy, p0=p0)
+                break
+            except (RuntimeError, ValueError):
+                continue
+
+        if popt is None:
+            rows.append([cycle, phase] + [np.nan] * len(guesses[-1]) + [np.nan])
+            continue
+
+        last[phase] = popt
+        residual = np.sqrt(np.mean((func(xx, *popt) - yy) ** 2))
+        rows.append([cycle, phase] + list(popt) + [residual])
+
+    return rows
@@ -2,7 +2,11 @@ import os
 import sys
 import pytest
 import configparser
+import json
 import numpy as np
+import pandas as pd
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, '..')
 
@@ -10,10 +14,17 @@ print(os.getcwd())
 if 'tests' in os.getcwd():
     os.chdir('..')
 sys.path.append('oect/')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import oect_processing as oect
 from oect_processing.oect_utils.config import make_config, config_file
+from oect_processing.oect_utils.oect_read import read_curve, read_file
+from oect_processing.oect_utils.oect_cache import OECTCache
+from oect_processing.oect_utils import uc_fit, oect_h5, oect_lot, oect_profile, oect_sweeps, oect_watch
 from oect_processing import transient
+from oect_processing import model_fitting
+from oect_processing.specechem import kinetics, uvvis, uvvis_h5, read_files
+from uvvis_data import write_uvvis
 
 
 # most values are hardcoded - be careful if modifying cfg/txt files
@@ -48,6 +59,233 @@ class TestOECT:
                                     params={'d': 41e-9})
         assert (test_oect.d == 41e-9)
 
+    # test that rescaling the thickness matches a fresh fit, without recalculating gm
+    def test_set_thickness(self):
+        fresh = oect.OECTDevice(path='tests/test_device/full_device',
+                                options={'plot': [False, False]},
+                                params={'d': 41e-9, 'c_star': 100})
+        test_oect = oect.OECTDevice(path='tests/test_device/full_device',
+                                    options={'plot': [False, False]},
+                                    params={'d': 80e-9, 'c_star': 100})
+        gms = {p: test_oect.pixels[p].gms for p in test_oect.pixels}
+        test_oect.set_thickness(41)
+        assert test_oect.d == 41e-9
+        assert np.allclose(test_oect.WdL, fresh.WdL) and np.allclose(test_oect.uC_0, fresh.uC_0)
+        assert np.allclose(test_oect.params['mobility'], fresh.params['mobility'])
+        assert all(test_oect.pixels[p].gms is gms[p] for p in gms)
+        assert test_oect.params['folder'] == 'tests/test_device/full_device'
+
+    # test that the closed-form uC* fits match curve_fit, and the robust fit ignores outliers
+    def test_uc_fit(self):
+        from scipy.optimize import curve_fit
+        test_oect = oect.OECTDevice(path='tests/test_device/full_device',
+                                    options={'plot': [False, False]})
+        x = test_oect.WdL * test_oect.Vg_Vt
+        uC, pcov = curve_fit(lambda x, a, b: a + b * x, x, test_oect.gms)
+        uC_0, pcov_0 = curve_fit(lambda x, b: b * x, x, test_oect.gms)
+        assert np.allclose(test_oect.uC, uC) and np.allclose(test_oect.uC_0, uC_0)
+        assert np.allclose(test_oect.params['uC_err'], np.sqrt(np.diag(pcov)))
+        assert np.allclose(test_oect.params['uC_0_err'], np.sqrt(np.diag(pcov_0)))
+
+        x = np.linspace(1, 10, 20)
+        gms = 2 * x
+        gms[5] = 100
+        for method in ['huber', 'theilsen']:
+            assert np.isclose(uc_fit.fit_uC(x, gms, method=method)['uC_0'][0], 2, rtol=1e-3)
+        bs, bs_0 = uc_fit.bootstrap_uC(x, 2 * x, n_boot=50, seed=0)
+        assert bs.shape == (50, 2) and np.allclose(bs_0, 2)
+
+    # test that loading pixels in a process pool matches the serial result
+    def test_load_device_parallel(self):
+        serial = oect.OECTDevice(path='tests/test_device/full_device',
+                                 options={'plot': [False, False]})
+        parallel = oect.OECTDevice(path='tests/test_device/full_device',
+                                   options={'plot': [False, False], 'n_jobs': 2})
+        assert list(parallel.pixels) == list(serial.pixels)
+        assert np.allclose(parallel.Vt, serial.Vt)
+        assert np.allclose(parallel.gms, serial.gms)
+
+    # test that a broken pixel is reported without aborting the device
+    def test_load_device_broken_pixel(self, tmp_path):
+        shutil.copytree('tests/test_device/full_device/01', str(tmp_path / '01'))
+        shutil.copytree('tests/test_device/full_device/02', str(tmp_path / '02'))
+        shutil.copytree('tests/test_device/broken', str(tmp_path / '03'))
+        with pytest.warns(UserWarning):
+            test_oect = oect.OECTDevice(path=str(tmp_path),
+                                        options={'plot': [False, False], 'n_jobs': 2})
+        assert list(test_oect.pixels) == ['01_uC', '02_uC']
+        assert list(test_oect.failed) == ['03_uC']
+
+    # test that an unchanged pixel is loaded from the cache, and a changed one is not
+    def test_cache(self, tmp_path):
+        shutil.copytree('tests/test_device/01', str(tmp_path / 'pixel'))
+        pixel = str(tmp_path / 'pixel')
+        cache = OECTCache(str(tmp_path / 'cache'))
+        first = cache.load(pixel)
+        second = cache.load(pixel)
+        assert cache.hits == 1 and cache.misses == 1
+        assert np.allclose(first.Vts, second.Vts)
+
+        cache.load(pixel, options={'gm_method': 'raw'})  # new options
+        os.utime(os.path.join(pixel, 'uc1_kpf6_transfer_0.txt'), ns=(0, 0))  # modified file
+        cache.load(pixel)
+        assert cache.hits == 1 and cache.misses == 3
+
+        cache.invalidate(pixel)
+        assert cache.size() == 0
+
+    # test the cache with a generated config, profiling, and a failed write
+    def test_cache_edge_cases(self, tmp_path, monkeypatch):
+        shutil.copytree('tests/test_device/no_config', str(tmp_path / 'pixel'))
+        pixel = str(tmp_path / 'pixel')
+        cache = OECTCache(str(tmp_path / 'cache'))
+        OECT = oect.OECT
+
+        def load(folder, **kwargs):  # the config is written into the folder on Windows
+            dv = OECT(folder, **kwargs)
+            shutil.copy('tests/test_device/01/uc1_kpf6_config.cfg', os.path.join(folder, 'config.cfg'))
+            return dv
+        monkeypatch.setattr(oect, 'OECT', load)
+        cache.load(pixel)
+        cache.load(pixel)
+        assert cache.hits == 1 and cache.misses == 1
+
+        first = cache.load(pixel, options={'profile': True})
+        second = cache.load(pixel, options={'profile': True})
+        assert not first.timings.empty and second.timings.empty
+
+        with pytest.raises(Exception):
+            cache.put(lambda: None, pixel)  # not picklable
+        assert not [f for f in os.listdir(cache.path) if f.endswith('.tmp')]
+
+        # an entry that no longer unpickles is a miss, and is replaced
+        fl = os.path.join(cache.path, cache.key(pixel))
+        with open(fl, 'wb') as f:
+            f.write(b'cno_such_module\nClass\n.')  # a class that no longer exists
+        assert cache.get(pixel) is None and not os.path.exists(fl)
+        cache.load(pixel)
+        assert cache.get(pixel) is not None
+
+    # test that the cache evicts entries past its maximum size
+    def test_cache_eviction(self, tmp_path, monkeypatch):
+        cache = OECTCache(str(tmp_path / 'cache'), max_size=1)
+        cache.load('tests/test_device/01')
+        assert cache.size() == 0
+
+        # an entry listed, then deleted by another worker before it is read
+        listdir = os.listdir
+        monkeypatch.setattr(os, 'listdir', lambda path: listdir(path) + ['gone.pkl'])
+        cache.load('tests/test_device/01')
+        assert cache.size() == 0
+
+    # test that profiling records the stages of each pixel and the device, and is off by default
+    def test_profile(self, tmp_path, capsys):
+        test_oect = oect.OECT(folder='tests/test_device/01')
+        test_oect.calc_gms()
+        assert test_oect.timings.empty and capsys.readouterr().out == ''
+
+        log = str(tmp_path / 'profile.jsonl')
+        test_oect = oect.OECTDevice(path='tests/test_device/full_device',
+                                    options={'plot': [False, False], 'profile': 'memory',
+                                             'profile_log': log})
+        timings = test_oect.timings
+        assert {'read', 'metadata', 'reverse', 'gm', 'Vt', 'peak'} <= set(timings.loc['01_uC'].index)
+        assert list(timings.loc['device'].index) == ['pixels', 'uC fit']
+        assert (timings.loc['01_uC', 'read']['calls'] == 3) and (timings['peak (MB)'] > 0).all()
+        with open(log) as f:
+            lines = [json.loads(line) for line in f]
+        assert len(lines) == timings['calls'].sum()
+
+        # a nested stage does not reset the peak of the stage around it
+        prof = oect_profile.Profiler(memory=True)
+        with prof.stage('outer'):
+            big = np.ones(10 ** 6)
+            del big
+            with prof.stage('inner'):
+                pass
+        assert prof.records['outer'][2] >= 8e6 > prof.records['inner'][2]
+
+        test_oect.pixels = {}
+        test_oect.params.pop('timings')
+        assert test_oect.timings.empty
+
+    # test that the watcher processes new pixels and new files incrementally
+    def test_watch(self, tmp_path):
+        for pix in ['01', '02']:
+            src = os.path.join('tests/test_device/full_device', pix)
+            os.mkdir(str(tmp_path / pix))
+            for fl in os.listdir(src):
+                if 'output' not in fl:
+                    shutil.copy(os.path.join(src, fl), str(tmp_path / pix))
+        watcher = oect_watch.DeviceWatcher(str(tmp_path), settle=0)
+        assert watcher.poll() == {'01_uC': 'loaded', '02_uC': 'loaded'}
+        assert watcher.pixels['01_uC'].outputs.empty and watcher.device is not None
+        assert watcher.poll() == {}
+
+        src = 'tests/test_device/full_device/01'
+        for fl in os.listdir(src):
+            if 'output' in fl:
+                shutil.copy(os.path.join(src, fl), str(tmp_path / '01'))
+        assert watcher.poll() == {'01_uC': 'added'}
+        full = oect.OECT(folder=src)
+        full.calc_gms()
+        full.thresh()
+        added = watcher.pixels['01_uC']
+        assert sorted(added.outputs.columns) == sorted(full.outputs.columns)
+        assert added.transfers.equals(full.transfers) and np.allclose(added.Vts, full.Vts)
+
+        # pixels are ordered by folder number, as OECTDevice
+        shutil.copytree('tests/test_device/full_device/03', str(tmp_path / '10'))
+        watcher.poll()
+        device = oect.OECTDevice(path=str(tmp_path), options={'plot': [False, False]})
+        assert list(watcher.pixels) == list(device.pixels) == ['01_uC', '02_uC', '10_uC']
+        shutil.copytree('tests/test_device/full_device/04', str(tmp_path / '9'))
+        watcher.poll()
+        assert list(watcher.pixels) == ['01_uC', '02_uC', '9_uC', '10_uC']
+        os.mkdir(str(tmp_path / '11'))  # not written yet
+        assert watcher.poll() == {} and not watcher.failed
+
+    # test that a lot processes every device, then only the pixels that changed
+    def test_lot(self, tmp_path):
+        shutil.copytree('tests/test_device/full_device', str(tmp_path / 'A'))
+        shutil.copytree('tests/test_device/full_device', str(tmp_path / 'batch' / 'B'))
+        lot = oect_lot.Lot(str(tmp_path), n_jobs=2)
+        done = []
+        results, fits = lot.run(callback=lambda dev, key, dv, err: done.append((dev, key)))
+        device = oect.OECTDevice(path='tests/test_device/full_device', options={'plot': [False, False]})
+        assert len(done) == 10 and list(results.loc['A'].index) == list(device.pixels)
+        assert np.allclose(fits['uC_0'], device.uC_0[0]) and list(fits['pixels']) == [5, 5]
+
+        done.clear()
+        shutil.rmtree(str(tmp_path / 'A' / '05'))
+        os.utime(str(tmp_path / 'batch' / 'B' / '02' / 'uc2_1000um_kpf6_transfer_0.txt'), ns=(0, 0))
+        results, fits = lot.run(callback=lambda dev, key, dv, err: done.append((dev, key)))
+        assert done == [(os.path.join('batch', 'B'), '02_uC')] and list(fits['pixels']) == [4, 5]
+
+    # test that a device saved to HDF5 loads back, reading pixels only on access
+    def test_save_h5(self, tmp_path):
+        test_oect = oect.OECTDevice(path='tests/test_device/full_device',
+                                    options={'plot': [False, False]})
+        fl = oect_h5.save_h5(test_oect, str(tmp_path / 'uC_data.h5'))
+        summary = oect_h5.load_summary(fl)
+        assert list(summary.index) == list(test_oect.pixels)
+        assert np.allclose(summary['Vt'], [np.mean(p.Vts) for p in test_oect.pixels.values()])
+
+        loaded = oect_h5.load_h5(fl)
+        assert np.allclose(loaded.uC, test_oect.uC) and not loaded.pixels.loaded()
+        assert loaded.pixels['02_uC'].transfers.equals(test_oect.pixels['02_uC'].transfers)
+        assert loaded.pixels.loaded() == ['02_uC']
+
+    # test that the timings of a profiled device survive saving to HDF5
+    def test_save_h5_profiled(self, tmp_path):
+        test_oect = oect.OECTDevice(path='tests/test_device/full_device',
+                                    options={'plot': [False, False], 'profile': True})
+        fl = oect_h5.save_h5(test_oect, str(tmp_path / 'uC_data.h5'))
+        loaded = oect_h5.load_h5(fl)
+        pd.testing.assert_frame_equal(loaded.params['timings'], test_oect.params['timings'], check_dtype=False)
+        assert loaded.pixels['02_uC'].timings.equals(test_oect.pixels['02_uC'].timings)
+        pd.testing.assert_frame_equal(loaded.timings, test_oect.timings, check_dtype=False)
+
     # test that parameters are read from config
     def test_set_params(self):
         test_oect = oect.OECT(folder='tests/test_device/01')  # called in init
@@ -138,6 +376,13 @@ class TestOECT:
                 and test_oect.W == 4000
                 and test_oect.L == 10)
 
+    # test that the single-pass reader returns the same metadata as get_metadata
+    def test_read_file_metadata(self):
+        test_file = 'tests/test_device/metadata_test/uc1_kpf6_output_0.txt'
+        v, data, columns, metadata = read_file(test_file, 'V_DS')
+        assert (metadata == {'V_G': -0.5, 'Width/um': 4000, 'Length/um': 10}
+                and len(v) == data.shape[0])
+
     # transfer_curve
     ######################################################################
 
@@ -149,6 +394,16 @@ class TestOECT:
             test_oect.get_metadata(test_file)
             test_oect.transfer_curve(test_file)
 
+    # test that the reader drops the metadata rows and keeps the columns
+    def test_read_curve(self):
+        v, data, columns = read_curve('tests/test_device/01/uc1_kpf6_transfer_0.txt', 'V_G')
+        assert (columns == ['I_DS (A)', 'I_DS Error (A)', 'I_G (A)', 'I_G Error (A)']
+                and data.shape == (len(v), 4)
+                and data.dtype == np.float64
+                and v[0] == -0.9
+                and data[0, 0] == -3.896240E-3
+                and not np.isnan(v).any())
+
     # output_curve
     ###################################################################
 
@@ -160,6 +415,35 @@ class TestOECT:
             test_oect.get_metadata(test_file)
             test_oect.transfer_curve(test_file)
 
+    # sweeps
+    ###################################################################
+
+    # test that the output and transfer dicts are views over one copy of the data
+    def test_sweeps(self, tmp_path):
+        import pickle
+        test_oect = oect.OECT(folder='tests/test_device/01')
+        sweeps = test_oect.sweeps
+        assert list(test_oect.output) == sweeps.keys('output') and len(sweeps.table()) == 5
+        for frames in [test_oect.output, test_oect.output_raw, test_oect.transfer, test_oect.transfer_raw]:
+            assert all(np.shares_memory(df.values, sweeps.data) for df in frames.values())
+        assert list(test_oect.transfer['-0.6_0'].columns) == ['I_DS (A)']
+        assert list(test_oect.output_raw['-0.5_fwd'].columns) == read_curve(
+            'tests/test_device/01/uc1_kpf6_output_0.txt', 'V_DS')[2]
+        fwd, bwd = test_oect.output['-0.5_fwd'], test_oect.output['-0.5_bwd']
+        assert fwd.index[-1] == bwd.index[0] and len(fwd) + len(bwd) == 16  # share the turnaround row
+        assert sweeps.nbytes == sweeps.v.nbytes + sweeps.data.nbytes
+
+        loaded = pickle.loads(pickle.dumps(test_oect))
+        assert all(loaded.output[k].equals(df) for k, df in test_oect.output.items())
+
+        # a file with a new column leaves it NaN in the earlier rows
+        sweeps = oect_sweeps.Sweeps()
+        cols = ['I_DS (A)'] + oect_sweeps.DROP
+        sweeps.add('transfer', [0, 1], np.ones((2, 4)), cols, [('a', 0, 2, 'both')])
+        sweeps.add('transfer', [0, 1, 2], np.ones((3, 5)), cols + ['T (C)'], [('b', 0, 3, 'both')])
+        assert sweeps.data.shape == (5, 5) and np.isnan(sweeps.data[:2, 4]).all()
+        assert sweeps.frames('transfer', raw=True)['b'].shape == (3, 5)
+
     # all_outputs
     ###################################################################
 
@@ -174,6 +458,15 @@ class TestOECT:
         test_oect.all_outputs()  # call again
         assert test_oect.num_outputs == 8
 
+    # test that sweeps on slightly different grids are interpolated onto the first sweep's voltages
+    def test_assemble_grids(self):
+        from oect_processing.oect_utils.oect_sweeps import assemble
+        v = np.linspace(-0.8, 0, 9)
+        shifted = np.linspace(-0.81, 0.01, 12)[::-1]  # reverse sweep on another grid
+        df = assemble([(v, 2 * v), (shifted, 2 * shifted), (v[2:], v[2:])], ['a', 'b', 'c'])
+        assert list(df.columns) == ['a', 'b', 'c'] and np.array_equal(df.index, v)
+        assert np.allclose(df['b'], 2 * v) and np.isnan(df['c'].values[:2]).all()
+
     # all_transfers
     ##################################################################
 
@@ -182,6 +475,47 @@ class TestOECT:
         test_oect = oect.OECT(folder='tests/test_device/01')  # called in init
         assert test_oect.num_transfers == 2
 
+    # calc_gms
+    ###################################################################
+
+    # test that the vectorized gm calculation matches the per-curve loop
+    def test_calc_gms_batch(self):
+        for method in ['sg', 'raw', 'poly']:
+            test_oect = oect.OECT(folder='tests/test_device/01', options={'gm_method': method})
+            test_oect.calc_gms()
+            batch_oect = oect.OECT(folder='tests/test_device/01',
+                                   options={'gm_method': method, 'gm_batch': True})
+            batch_oect.calc_gms()
+            assert np.allclose(test_oect.gms.values, batch_oect.gms.values)
+            assert np.allclose(test_oect.gm_peaks.values, batch_oect.gm_peaks.values)
+            assert np.allclose(test_oect.gm_peaks.index, batch_oect.gm_peaks.index)
+
+    # test that the vectorized gm calculation matches the loop for a pixel with several transfer curves
+    def test_calc_gms_batch_curves(self, tmp_path):
+        shutil.copytree('tests/test_device/01', str(tmp_path / 'pixel'))
+        with open(str(tmp_path / 'pixel' / 'uc1_kpf6_transfer_0.txt')) as f:
+            lines = f.read().split('\n')
+        for n, line in enumerate(lines):  # halve I_DS of the data rows
+            row = line.split('\t')
+            if len(row) == 5 and row[0] not in ['V_G', '']:
+                row[1] = str(float(row[1]) * 0.5)
+                lines[n] = '\t'.join(row)
+        with open(str(tmp_path / 'pixel' / 'uc1_kpf6_transfer_1.txt'), 'w') as f:
+            f.write('\n'.join(lines))
+
+        pixels = []
+        for batch in [False, True]:
+            test_oect = oect.OECT(folder=str(tmp_path / 'pixel'), options={'gm_batch': batch})
+            test_oect.calc_gms()
+            test_oect.thresh()
+            pixels.append(test_oect)
+        test_oect, batch_oect = pixels
+        assert len(test_oect.transfer) == 2
+        assert np.allclose(test_oect.gms.values, batch_oect.gms.values)
+        assert test_oect.gm_peaks.equals(batch_oect.gm_peaks)
+        assert np.allclose(test_oect.peak_gm, batch_oect.peak_gm)
+        assert np.allclose(test_oect.Vts, batch_oect.Vts)
+
     # _reverse
     ###################################################################
 
@@ -199,6 +533,19 @@ class TestOECT:
         v = np.concatenate((a, b))
         assert len(v) // 2, True == test_oect._reverse(v)
 
+    # thresh
+    ######################################################################
+
+    # test that the least-squares Vt search agrees with the spline search
+    def test_thresh_lstsq(self):
+        test_oect = oect.OECT(folder='tests/test_device/01')
+        test_oect.calc_gms()
+        test_oect.thresh()
+        fast_oect = oect.OECT(folder='tests/test_device/01', options={'vt_method': 'lstsq'})
+        fast_oect.calc_gms()
+        fast_oect.thresh()
+        assert np.allclose(test_oect.Vts, fast_oect.Vts, atol=0.01)
+
     # update_config
     ######################################################################
 
@@ -285,6 +632,16 @@ class TestTransient:
     def test_load(self):
         df = transient.read_time_dep('tests/test_transient/03_400um_-0.8V_cycles.txt', start=0)
 
+    # test that reading in small chunks crops the same data, and cycles stream one at a time
+    def test_load_chunks(self):
+        fl = 'tests/test_transient/03_400um_-0.8V_cycles.txt'
+        df = transient.read_time_dep(fl, start=1000, stop=300000)
+        chunked = transient.read_time_dep(fl, start=1000, stop=300000, chunksize=100)
+        assert df.equals(chunked) and df.index[0] >= 1000 and df.index[-1] < 300000
+        cycles = list(transient.iter_cycles(fl, chunksize=50))
+        fits = transient.fit_cycles_batch(transient.read_time_dep(fl))
+        assert len(cycles) == fits['cycle'].nunique()
+
     # test loading and then plotting the data
     def test_load_plot(self):
         df = transient.read_time_dep('tests/test_transient/03_400um_-0.8V_cycles.txt', start=0)
@@ -295,6 +652,135 @@ class TestTransient:
         df = transient.read_time_dep('tests/test_transient/03_400um_-0.8V_cycles.txt', start=0)
         transient.fit_cycles(df, 40, 20, norm=True)
 
+    # test that the batched cycle fits match fit_cycles, serially and in a process pool
+    def test_fit_cycles_batch(self):
+        df = transient.read_time_dep('tests/test_transient/03_400um_-0.8V_cycles.txt', start=0)
+        dope, dedope = transient.fit_cycles(df, 40, 20, norm=True, plot=False)
+        fits = transient.fit_cycles_batch(df, norm=True)
+        assert list(fits.columns) == ['cycle', 'phase', 'y0', 'A', 'tau', 'residual']
+        assert np.allclose(fits.loc[fits.phase == 'dope', 'tau'], np.array(dope)[:, 2], rtol=1e-3)
+        assert np.allclose(fits.loc[fits.phase == 'dedope', 'tau'], np.array(dedope)[:, 2], rtol=1e-3)
+        pooled = transient.fit_cycles_batch(df, norm=True, n_jobs=2)
+        assert np.allclose(pooled['tau'], fits['tau'], rtol=1e-3)
+        with ThreadPoolExecutor(2) as pool:
+            pooled = transient.fit_cycles_batch(df, norm=True, n_jobs=2, executor=pool)
+        assert np.allclose(pooled['tau'], fits['tau'], rtol=1e-3)
+
+
+class TestModelFitting:
+
+    # test that friedlein_multi labels each time point with the branch used for Ids
+    def test_friedlein_multi_regime(self):
+        t = np.linspace(0, 200, 500)
+        p = [1e-5, 1e-2, 1e-2, 20e-4, 0.85, 1000, 0.25, 0.6, 0]
+        Ids, regime = model_fitting.friedlein_multi(t, *p, return_regime=True)
+        assert regime.dtype == np.int8
+        assert set(regime) == {model_fitting.REGIME_SAT, model_fitting.REGIME_LIN,
+                               model_fitting.REGIME_SUB}
+        assert np.array_equal(Ids, model_fitting.friedlein_multi(t, *p))
+
+    # test that the closed-form Vt roots match fsolve, and K = 0 falls back to the guess
+    def test_getVt(self):
+        Vch = 0.85 * (1 - np.exp(-np.linspace(0, 200, 200) / 20))
+        Vt, roots = model_fitting.getVt(0.25, 50, Vch, 0.6)
+        Vt_fs, roots_fs = model_fitting.getVt(0.25, 50, Vch, 0.6, method='fsolve')
+        assert np.allclose(roots, roots_fs, atol=1e-6) and np.isclose(Vt, 0.25, atol=1e-3)
+        assert np.allclose(model_fitting.getVt(0.25, 0, Vch, 0.6)[1], 0.25)
+
+    # test that model_friedlein fits friedlein_multi with only t as the independent variable
+    def test_model_friedlein(self):
+        pytest.importorskip('lmfit')
+        from matplotlib import pyplot as plt
+        t = np.linspace(0, 200, 500)
+        Ids = model_fitting.friedlein_multi(t, 1e-5, 1e-2, 1e-2, 20e-4, 0.85, 1000, 0.25, 0.6, 0)
+        device = {-0.8: pd.DataFrame({'Ids (A)': Ids}, index=t)}
+        fmodel, result = model_fitting.model_friedlein(device)
+        plt.close('all')
+        assert fmodel.independent_vars == ['t'] and result.success
+
+
+class TestUVVis:
+
+    # test that the memory-mapped cache returns the parsed spectra without parsing again
+    def test_time_dep_spectra_cache(self, tmp_path):
+        write_uvvis(str(tmp_path), potentials=[0, 0.5, 1], wavelengths=20, times=10)
+        steps, specs, potentials, _, _ = read_files.read_files(tmp_path)
+        data = uvvis.UVVis(steps, specs, potentials)
+        data.time_dep_spectra(specs, smooth=3, cache=tmp_path / 'cache')
+        cached = uvvis.UVVis(steps, specs, potentials)
+        cached._single_time_spectra = None  # must not be called
+        cached.time_dep_spectra(specs, smooth=3, cache=tmp_path / 'cache')
+        for v in potentials:
+            assert np.allclose(cached.spectra_vs_time[v].values, data.spectra_vs_time[v].values)
+            assert np.allclose(cached.spectra_vs_time[v].columns, data.spectra_vs_time[v].columns)
+
+    # test that the reshape fast path matches the per-spectrum path
+    def test_single_time_spectra_reshape(self, tmp_path):
+        write_uvvis(str(tmp_path), potentials=[0, 0.5, 1], wavelengths=20, times=10)
+        data = uvvis.UVVis()
+        fast = data._single_time_spectra(str(tmp_path / 'spectra(2).txt'), smooth=3, digits=2)
+        data._reshape_spectra = lambda *args: None  # forces the ragged-file path
+        slow = data._single_time_spectra(str(tmp_path / 'spectra(2).txt'), smooth=3, digits=2)
+        assert np.allclose(fast.values, slow.values)
+        assert np.array_equal(fast.index, slow.index) and np.array_equal(fast.columns, slow.columns)
+
+    # test that loading the potentials in a process pool matches the serial result
+    def test_time_dep_spectra_parallel(self, tmp_path):
+        write_uvvis(str(tmp_path), potentials=[0, 0.5, 1], wavelengths=20, times=10)
+        steps, specs, potentials, _, _ = read_files.read_files(tmp_path)
+        assert np.allclose(potentials, [0, 0.5, 1])
+        assert np.array_equal(read_files.read_files(tmp_path, n_jobs=2)[2], potentials)
+        serial = uvvis.UVVis(steps, specs, potentials)
+        serial.time_dep_spectra(specs, smooth=3)
+        parallel = uvvis.UVVis(steps, specs, potentials)
+        parallel.time_dep_spectra(specs, smooth=3, n_jobs=2)
+        assert list(parallel.spectra_vs_time) == list(serial.spectra_vs_time)
+        for v in potentials:
+            assert parallel.spectra_vs_time[v].equals(serial.spectra_vs_time[v])
+
+    # test the single-file HDF5 round trip and partial reads of the spectra cube
+    def test_uvvis_h5(self, tmp_path):
+        write_uvvis(str(tmp_path), potentials=[0, 0.5, 1], wavelengths=20, times=10)
+        steps, specs, potentials, _, _ = read_files.read_files(tmp_path)
+        data = uvvis.UVVis(steps, specs, potentials)
+        data.time_dep_spectra(specs, smooth=3)
+        data.current_vs_time(steps)
+        uvvis_h5.save_h5(data, str(tmp_path / 'uvvis.h5'), compression='gzip')
+        loaded = uvvis_h5.convert_h5(str(tmp_path / 'uvvis.h5'))
+        for v in potentials:
+            assert loaded.spectra_vs_time[v].equals(data.spectra_vs_time[v])
+        assert loaded.current.equals(data.current)
+        assert np.allclose(loaded.charge.values, data.charge.values.astype(float))
+        band = uvvis_h5.read_spectra(str(tmp_path / 'uvvis.h5'), potential=0.5, wl_start=600, wl_stop=800,
+                                     t_start=11, t_stop=13)
+        assert list(band) == [0.5]
+        assert band[0.5].equals(data.spectra_vs_time[0.5].loc[600:800, 11:13])
+
+    # test that the batched banded fits match curve_fit at every wavelength
+    def test_banded_fits_batch(self):
+        t = np.arange(0, 30, 0.25)
+        wl = np.arange(700, 720, 0.5)
+        tau = np.linspace(2, 8, len(wl))
+        rng = np.random.default_rng(0)
+        absorb = 0.3 - 0.5 * np.exp(-t / tau[:, None]) + 1e-3 * rng.standard_normal((len(wl), len(t)))
+        data = uvvis.UVVis()
+        data.spectra_vs_time = {1: pd.DataFrame(absorb, index=wl, columns=t)}
+        data.time_spectra_norm_sm = pd.DataFrame(index=t)
+        data.banded_fits(wl_start=700, wl_stop=720, fittype='exp', method='batch')
+        assert data.fits_table['converged'].all()
+        assert np.array_equal(data.fits_table.index, wl[1:])
+        with ThreadPoolExecutor(2) as pool:
+            fits = kinetics.fit_banded(t, data.spectra_vs_time[1].iloc[1:], executor=pool)
+        assert np.allclose(fits['tau'], data.fits_table['tau'])
+        data.banded_fits(wl_start=700, wl_stop=720, fittype='exp', method='curve_fit')
+        assert np.allclose(data.fits_table['tau'], data.fits, rtol=1e-5)
+        assert np.allclose(data.fits, tau[1:], rtol=0.02)
+
+        # a flat and a pure-noise trace are not converged fits
+        flat = np.vstack([np.full(len(t), 0.3), 1e-3 * rng.standard_normal(len(t))])
+        _, _, converged = kinetics.fit_exp_batch(flat, t)
+        assert not converged.any()
+
 # questions/why I didn't write tests for these functions
 # loaddata - just consolidates a lot of functions
 # calc_gms - what would an expected gm would be?
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic spec-echem data for the UVVis tests, also used by benchmarks/synthetic.py
+"""
+
+import numpy as np
+import os
+
+
+def write_uvvis(path, potentials=11, wavelengths=401, times=60, dt=0.5, seed=0):
+    '''
+    Writes spectra(n).txt and steps(n).txt for potentials from -0.2 to 0.8 V,
+    or for a list of potentials. The absorbance of a band near 700 nm grows
+    with potential, with a wavelength-dependent time constant
+    '''
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    wl = np.round(np.linspace(500, 900, wavelengths) + 0.17, 2)  # fractional, as from the spectrometer
+    t = np.arange(times) * dt
+    tau = 2 + 4 * (wl - 500) / 400
+    band = np.exp(-((wl - 700) / 100) ** 2)
+
+    if np.ndim(potentials) == 0:
+        potentials = np.round(np.linspace(-0.2, 0.8, potentials), 2)
+
+    for n, v in enumerate(potentials):
+        absorb = (v + 0.3) * band * (1 - np.exp(-t[:, None] / tau))
+        absorb += 1e-3 * rng.standard_normal(absorb.shape)
+
+        spectra = np.column_stack([np.repeat(np.arange(1, times + 1), wavelengths), np.repeat(t + 10, wavelengths),
+                                   np.tile(wl, times), absorb.ravel()])
+        np.savetxt(os.path.join(path, 'spectra({}).txt'.format(n)), spectra, delimiter='\t', comments='',
+                   header='Spectrum number\tTime (s)\tWavelength (nm)\tAbsorbance', fmt='%.6g')
+
+        steps = np.column_stack([t, np.full(times, v), 1e-4 * np.exp(-t)])
+        np.savetxt(os.path.join(path, 'steps({}).txt'.format(n)), steps, delimiter='\t', comments='',
+                   header='Corrected time (s)\tWE(1).Potential (V)\tWE(1).Current (A)', fmt='%.6g')
+
+    return path